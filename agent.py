@@ -1,11 +1,12 @@
 """SNMP Logic for Agent(Server)-side implementations"""
 from __future__ import generators
-import weakref
+import weakref, time
 from twistedsnmp import datatypes
 from twistedsnmp.pysnmpproto import v2c,v1, error, resolveVersion, oid
 from twistedsnmp.errors import noError, tooBig, noSuchName, badValue
-from twistedsnmp import errors
+from twistedsnmp import errors, instrumentation
 from twisted.internet import reactor, defer
+from twistedsnmp.logs import agentprotocol_log as log
 
 __metaclass__ = type
 
@@ -18,17 +19,144 @@ except NameError:
 			yield i,x
 			i += 1
 
+# largest UDP payload, i.e. no local constraint on message size
+DEFAULT_MAX_MESSAGE_SIZE = 65507
+
+# TrapHandler notification types
+TRAP = 'trap'
+INFORM = 'inform'
+# SNMPv2-MIB notification objects (RFC 1907, RFC 2576 3.1)
+SYS_UP_TIME = '.1.3.6.1.2.1.1.3.0'
+SNMP_TRAP_OID = '.1.3.6.1.6.3.1.1.4.1.0'
+SNMP_TRAP_ENTERPRISE = '.1.3.6.1.6.3.1.1.4.3.0'
+SNMP_TRAPS = '.1.3.6.1.6.3.1.1.5'
+
+def lengthSize( length ):
+	"""Get encoded size of a BER length field for length"""
+	if length < 0x80:
+		return 1
+	size = 1
+	while length:
+		size += 1
+		length >>= 8
+	return size
+
+def integerSize( value ):
+	"""Get encoded size of BER integer contents for value"""
+	size = 1
+	value = long(value)
+	if value < 0:
+		value = ~value
+	while value > 0x7f:
+		size += 1
+		value >>= 8
+	return size
+
+def oidSize( value ):
+	"""Get encoded size of BER OID contents for (string or OID) value"""
+	if isinstance( value, (str,unicode)):
+		value = [int(i) for i in value.split('.') if i]
+	else:
+		value = list(value)
+	if len(value) < 2:
+		return 1
+	size = 0
+	for arc in [value[0]*40 + value[1]] + value[2:]:
+		size += 1
+		while arc > 0x7f:
+			size += 1
+			arc >>= 7
+	return size
+
+def varBindSize( key, value ):
+	"""Estimate encoded size of the (key,value) variable binding
+
+	Exact for the common Python types, for PySNMP objects the
+	Python value (e.g. dotted IpAddress string) is measured, which
+	generally over-estimates slightly.
+	"""
+	if hasattr( value, 'get' ) and not isinstance( value, dict ):
+		try:
+			value = value.get()
+		except Exception:
+			pass
+	if value is None:
+		content = 0
+	elif isinstance( value, (int,long) ):
+		content = integerSize( value )
+	elif isinstance( value, str ):
+		content = len(value)
+	elif isinstance( value, (tuple,list) ):
+		content = oidSize( value )
+	else:
+		content = len(str(value))
+	keySize = oidSize( key )
+	content = 1 + lengthSize(keySize) + keySize + 1 + lengthSize(content) + content
+	return 1 + lengthSize(content) + content
+
+def hasDeferredValues( result ):
+	"""Does [(oid,value)] result include any Deferred values?"""
+	for key,value in result:
+		if isinstance( value, defer.Deferred ):
+			return True
+	return False
+
 class Agent:
 	"""Implementation of SNMP Logic for Agent-side implementations
 
 	This base-class is intended to interact with objects providing
 	an OID-store interface.  It's primary purpose is to implement
 	the iteration control mechanisms for querying that store.
+
+	attributes:
+		maxMessageSize -- local limit on response message size,
+			GETBULK responses are truncated to fit, GET and
+			GETNEXT responses which would be larger are replaced
+			by tooBig error responses
+		truncateRows -- if true, GETBULK responses are truncated
+			to whole repetitions (table rows), rather than just
+			dropping trailing variables, in either case responses
+			in which not even the first repetition fits are
+			replaced by tooBig error responses
+		responseCache -- optional responsecache.ResponseCache
+			from which repeated GET/GETNEXT/GETBULK requests are
+			answered without querying the dataStore
+		valueTimeout -- seconds to wait for Deferred values (see
+			resolveValues) before answering without them
+		instrumentation -- optional instrumentation.Instrumentation
+			recording the time spent in each phase of the handlers
+		lastValues -- { oid: value } last value produced by each
+			Deferred value, used when a later Deferred fails
 	"""
-	def __init__(self, dataStore, protocol=None):
-		"""Initialise the MockAgent with OID list"""
+	maxMessageSize = DEFAULT_MAX_MESSAGE_SIZE
+	truncateRows = True
+	responseCache = None
+	valueTimeout = 2.0
+	instrumentation = None
+	def __init__(
+		self, dataStore, protocol=None, maxMessageSize=None,
+		responseCache=None,
+	):
+		"""Initialise the MockAgent with OID list
+
+		dataStore -- OIDStore providing our OID values
+		protocol -- optional AgentProtocol to serve
+		maxMessageSize -- if specified, overrides maxMessageSize
+		responseCache -- if specified, a ResponseCache (or true value
+			to create a default ResponseCache) for encoded responses
+		"""
 		self.dataStore = dataStore
+		self.lastValues = {}
+		self.startTime = time.time()
+		if maxMessageSize is not None:
+			self.maxMessageSize = maxMessageSize
+		if responseCache:
+			if not hasattr( responseCache, 'lookup' ):
+				from twistedsnmp import responsecache
+				responseCache = responsecache.ResponseCache()
+			self.responseCache = responseCache
 		self._trapRegistry = {}
+		self._trapRoutes = {}
 		if protocol is not None:
 			self.setProtocol( protocol )
 			protocol.setAgent( self )
@@ -46,25 +174,62 @@ class Agent:
 
 		sends response to the client as a side effect
 		
-		returns the sent response
+		returns the sent response (None if sent from responseCache,
+		or a Deferred firing with the response if the dataStore
+		produced Deferred values)
 		"""
+		timing = instrumentation.startTiming( self.instrumentation, 'get', self.dataStore )
+		cacheKey = self.sendCachedResponse( request, address, implementation, 'get' )
+		timing.mark( 'cache' )
+		if cacheKey is True:
+			timing.finish()
+			return None
 		variables = request.apiGenGetPdu().apiGenGetVarBind()
 		response = request.reply()
 		pdu = response.apiGenGetPdu()
 		try:
 			result = self.getOIDs( [key for (key,_) in variables] )
 		except errors.OIDNameError, err:
+			timing.mark( 'lookup' )
 			pdu.apiGenSetErrorStatus( err.errorCode )
 			pdu.apiGenSetErrorIndex( err.errorIndex + 1 ) # 1-indexed
 			pdu.apiGenSetVarBind(variables)
 			result = None
 		else:
-			pdu.apiGenSetVarBind([
-				(key,datatypes.typeCoerce(value,implementation))
-				for (key,value) in result
-			])
-		self.protocol.send( response.encode(), address )
+			timing.mark( 'lookup' )
+			if hasDeferredValues( result ):
+				return self.deferResponse(
+					response, variables, result, address,
+					self.encodeVariables, (variables, implementation),
+					timing = timing,
+				)
+			self.setResponseVariables( response, result, variables, implementation )
+			timing.mark( 'coerce' )
+		message = response.encode()
+		timing.mark( 'encode' )
+		self.sendResponse( message, address, cacheKey )
+		timing.finish()
 		return response
+	def sendCachedResponse( self, request, address, implementation, requestType ):
+		"""Send response for request from responseCache if possible
+
+		returns True if the response was sent, otherwise the cache
+		key under which to store the response (None if not caching)
+		"""
+		cache = self.responseCache
+		if cache is None:
+			return None
+		key = cache.key( request, implementation, requestType )
+		message = cache.lookup( key, request, self.dataStore )
+		if message is None:
+			return key
+		self.protocol.send( message, address )
+		return True
+	def sendResponse( self, message, address, key=None ):
+		"""Send encoded response message, caching it under key"""
+		if key is not None:
+			self.responseCache.store( key, message, self.dataStore )
+		self.protocol.send( message, address )
 	def getOIDs( self, oids ):
 		"""Get the given set of OIDs
 
@@ -92,10 +257,9 @@ class Agent:
 
 		sends response to the client as a side effect
 		
-		returns the sent response
-
-		XXX Doesn't currently check for message too long error
-			condition
+		returns the sent response (None if sent from responseCache,
+		or a Deferred firing with the response if the dataStore
+		produced Deferred values)
 
 		(1)  If, for any object name in the variable-bindings field,
 			that name does not lexicographically precede the name of
@@ -141,23 +305,212 @@ class Agent:
 		http://www.faqs.org/rfcs/rfc1157.html
 		Section: 4.1.3, GetNextRequest
 		"""
+		timing = instrumentation.startTiming( self.instrumentation, 'getNext', self.dataStore )
+		cacheKey = self.sendCachedResponse( request, address, implementation, 'getNext' )
+		timing.mark( 'cache' )
+		if cacheKey is True:
+			timing.finish()
+			return None
 		variables = request.apiGenGetPdu().apiGenGetVarBind()
 		response = request.reply()
 		pdu = response.apiGenGetPdu()
 		try:
 			result = self.getNextOIDs( [key for (key,_) in variables] )
 		except errors.OIDNameError, err:
+			timing.mark( 'lookup' )
 			pdu.apiGenSetErrorStatus( err.errorCode )
 			pdu.apiGenSetErrorIndex( err.errorIndex + 1 ) # 1-indexed
 			pdu.apiGenSetVarBind(variables)
 			result = None
 		else:
-			pdu.apiGenSetVarBind([
-				(key,datatypes.typeCoerce(value,implementation))
-				for (key,value) in result
-			])
-		self.protocol.send( response.encode(), address )
+			timing.mark( 'lookup' )
+			if hasDeferredValues( result ):
+				return self.deferResponse(
+					response, variables, result, address,
+					self.encodeVariables, (variables, implementation),
+					timing = timing,
+				)
+			self.setResponseVariables( response, result, variables, implementation )
+			timing.mark( 'coerce' )
+		message = response.encode()
+		timing.mark( 'encode' )
+		self.sendResponse( message, address, cacheKey )
+		timing.finish()
 		return response
+	def encodeVariables( self, response, result, variables, implementation ):
+		"""Set GET/GETNEXT response variables and encode the response"""
+		self.setResponseVariables( response, result, variables, implementation )
+		return response.encode()
+	def deferResponse(
+		self, response, variables, result, address, encode, arguments=(),
+		variableIndex=None, timing=instrumentation.NULL_TIMING,
+	):
+		"""Send response once result's Deferred values are available
+
+		response -- the response message
+		variables -- the request's variables
+		result -- [(oid,value)] result including Deferred values
+		address -- address to which to send the response
+		encode -- callable as encode( response, result, *arguments )
+			setting response's variables and returning the encoded
+			response
+		variableIndex -- optional callable converting an index into
+			result to an index into the request's variables
+		timing -- instrumentation.Timing (or NULL_TIMING) for the request,
+			the wait is recorded as 'resolve', the timing finishes
+			once the response is sent (or sending fails)
+
+		Responses including Deferred values are never cached.
+
+		returns Deferred firing with the sent response
+		"""
+		def onResolved( result ):
+			timing.mark( 'resolve' )
+			message = encode( response, result, *arguments )
+			timing.mark( 'encode' )
+			self.sendResponse( message, address )
+			timing.finish()
+			return response
+		def onError( reason ):
+			reason.trap( errors.OIDNameError )
+			timing.mark( 'resolve' )
+			err = reason.value
+			pdu = response.apiGenGetPdu()
+			pdu.apiGenSetErrorStatus( err.errorCode )
+			pdu.apiGenSetErrorIndex( err.errorIndex + 1 ) # 1-indexed
+			pdu.apiGenSetVarBind(variables)
+			message = response.encode()
+			timing.mark( 'encode' )
+			self.sendResponse( message, address )
+			timing.finish()
+			return response
+		def onFailure( reason ):
+			timing.finish()
+			log.error(
+				"""Unable to send response to %s: %s""",
+				address, reason.getTraceback(),
+			)
+		d = self.resolveValues( result, variableIndex )
+		d.addCallbacks( onResolved, onError )
+		d.addErrback( onFailure )
+		return d
+	def resolveValues( self, result, variableIndex=None ):
+		"""Wait for the Deferred values in result
+
+		result -- [(oid,value)] where values may be Deferreds, for
+			instance those returned by callable values in a
+			BisectOIDStore which query another process
+		variableIndex -- optional callable converting an index into
+			result to an index into the request's variables
+
+		The Deferreds are waited for concurrently, values which fail,
+		or which are not available within self.valueTimeout seconds,
+		are replaced by the last value retrieved for the same OID.
+
+		returns Deferred firing with result with all values resolved,
+		or failing with OIDNameError( errorCode=genErr ) for the first
+		value with no last value to fall back on
+		"""
+		result = list( result )
+		final = defer.Deferred()
+		pending = {}
+		for index,(key,value) in enumerate( result ):
+			if isinstance( value, defer.Deferred ):
+				pending[ index ] = value
+		def finish( ):
+			if timer.active():
+				timer.cancel()
+			if not final.called:
+				final.callback( result )
+		def fallback( index ):
+			key = result[index][0]
+			if self.lastValues.has_key( key ):
+				result[index] = (key, self.lastValues[key])
+			elif not final.called:
+				if timer.active():
+					timer.cancel()
+				if variableIndex is not None:
+					index = variableIndex( index )
+				final.errback( errors.OIDNameError(
+					key, errorIndex=index, errorCode=errors.genErr,
+					message="""Value not available""",
+				))
+		def resolved( value, index ):
+			key = result[index][0]
+			# late values are still useful for later requests
+			self.lastValues[ key ] = value
+			if final.called or not pending.has_key( index ):
+				return None
+			del pending[ index ]
+			result[index] = (key,value)
+			if not pending:
+				finish()
+		def failed( reason, index ):
+			if final.called or not pending.has_key( index ):
+				return None
+			del pending[ index ]
+			log.warn(
+				"""Failure retrieving value for %s: %s""",
+				result[index][0], reason.getErrorMessage(),
+			)
+			fallback( index )
+			if not pending:
+				finish()
+		def expired( ):
+			indices = pending.keys()
+			pending.clear()
+			for index in indices:
+				log.warn( """Timeout retrieving value for %s""", result[index][0] )
+				fallback( index )
+			finish()
+		timer = reactor.callLater( self.valueTimeout, expired )
+		for index, d in pending.items():
+			d.addCallbacks(
+				resolved, failed,
+				callbackArgs=(index,), errbackArgs=(index,),
+			)
+		return final
+	def setResponseVariables( self, response, result, variables, implementation ):
+		"""Set GET/GETNEXT response variables, or tooBig error
+
+		response -- the response message
+		result -- [(oid,value)] result for the request
+		variables -- the request's variables
+		implementation -- v1 or v2c implementation module
+
+		If the response would exceed self.maxMessageSize, the
+		response instead has error-status tooBig and error-index 0,
+		with the request's variables for SNMPv1 (RFC 1157 4.1.3)
+		or no variables for SNMPv2c (RFC 1905 4.2.1).
+
+		returns whether the result was set
+		"""
+		pdu = response.apiGenGetPdu()
+		if self.maxMessageSize < DEFAULT_MAX_MESSAGE_SIZE:
+			size = self.messageOverhead( response )
+			for key,value in result:
+				size += varBindSize( key, value )
+			if size > self.maxMessageSize:
+				pdu.apiGenSetErrorStatus( tooBig )
+				pdu.apiGenSetErrorIndex( 0 )
+				if implementation is v1:
+					pdu.apiGenSetVarBind( variables )
+				else:
+					pdu.apiGenSetVarBind( [] )
+				return False
+		pdu.apiGenSetVarBind([
+			(key,datatypes.typeCoerce(value,implementation))
+			for (key,value) in result
+		])
+		return True
+	def messageOverhead( self, response ):
+		"""Get encoded size of response without variables
+
+		Includes allowance for the three (message, PDU and
+		variable-list) length fields growing to their long form.
+		"""
+		response.apiGenGetPdu().apiGenSetVarBind( [] )
+		return len(response.encode()) + 6
 	def getNextOIDs( self, oids ):
 		"""Get the given set of OIDs' next items
 
@@ -168,9 +521,9 @@ class Agent:
 		result = []
 		for index, base in enumerate(oids):
 			try:
-				result.append( self.dataStore.nextOID( base ))
+				result.extend( self.dataStore.nextOIDs( base, 1 ))
 			except errors.OIDNameError, err:
-				errorIndex = index
+				err.errorIndex = index
 				raise
 		return result
 
@@ -185,7 +538,9 @@ class Agent:
 
 		sends response to the client as a side effect
 		
-		returns the sent response
+		returns the sent response (None if sent from responseCache,
+		or a Deferred firing with the response if the dataStore
+		produced Deferred values)
 
 		The get-bulk request has two elements, a set of non-repeating
 		get-next OIDs (normally 0), and a set of repeating get-bulk
@@ -200,6 +555,12 @@ class Agent:
 		Section 4.2.3, The GetBulkRequest-PDU
 		"""
 		from twistedsnmp import datatypes
+		timing = instrumentation.startTiming( self.instrumentation, 'getTable', self.dataStore )
+		cacheKey = self.sendCachedResponse( request, address, implementation, 'getTable' )
+		timing.mark( 'cache' )
+		if cacheKey is True:
+			timing.finish()
+			return None
 		variables = request.apiGenGetPdu().apiGenGetVarBind()
 		result = []
 		errorCode = None
@@ -224,17 +585,117 @@ class Agent:
 			)
 		except errors.OIDNameError, err:
 			# should never happen, but who knows...
+			timing.mark( 'lookup' )
 			pdu.apiGenSetErrorStatus( err.errorCode )
 			pdu.apiGenSetErrorIndex( err.errorIndex + 1 ) # 1-indexed
 			pdu.apiGenSetVarBind(variables)
 			result = None
 		else:
+			timing.mark( 'lookup' )
+			repeating = max((len(variables) - nonRepeaters,0))
+			if hasDeferredValues( result ):
+				def variableIndex( index ):
+					if index < nonRepeaters:
+						return index
+					return nonRepeaters + (index-nonRepeaters) % repeating
+				return self.deferResponse(
+					response, variables, result, address,
+					self.encodeTable,
+					(implementation, nonRepeaters, repeating),
+					variableIndex, timing,
+				)
+			message = self.encodeTable(
+				response, result, implementation, nonRepeaters, repeating,
+				timing,
+			)
+			self.sendResponse( message, address, cacheKey )
+			timing.finish()
+			return response
+		message = response.encode()
+		timing.mark( 'encode' )
+		self.sendResponse( message, address, cacheKey )
+		timing.finish()
+		return response
+	def encodeTable(
+		self, response, result, implementation, nonRepeaters, repeating,
+		timing=instrumentation.NULL_TIMING,
+	):
+		"""Set (truncated) GETBULK response variables and encode the response
+
+		timing -- instrumentation.Timing (or NULL_TIMING) for the request
+		"""
+		pdu = response.apiGenGetPdu()
+		result = self.truncateTable( response, result, nonRepeaters, repeating )
+		if result is not None:
 			pdu.apiGenSetVarBind([
 				(key,datatypes.typeCoerce(value,implementation))
 				for (key,value) in result
 			])
-		self.protocol.send( response.encode(), address )
-		return response
+			timing.mark( 'coerce' )
+			message = response.encode()
+			timing.mark( 'encode' )
+			while len(message) > self.maxMessageSize:
+				# estimate was low (unusual value types), drop more
+				length = self.truncatedLength(
+					len(result)-1, nonRepeaters, repeating,
+				)
+				if length is None:
+					break
+				result = result[:length]
+				pdu.apiGenSetVarBind([
+					(key,datatypes.typeCoerce(value,implementation))
+					for (key,value) in result
+				])
+				message = response.encode()
+			else:
+				return message
+		# not even the non-repeaters and a single repetition fit
+		pdu.apiGenSetErrorStatus( tooBig )
+		pdu.apiGenSetErrorIndex( 0 )
+		pdu.apiGenSetVarBind( [] )
+		return response.encode()
+	def truncateTable( self, response, result, nonRepeaters, repeating ):
+		"""Truncate GETBULK result to fit in self.maxMessageSize
+
+		Sizes of the variables are accumulated until the limit is
+		reached, as RFC 1905 4.2.3 allows, the trailing variables
+		are then dropped (see truncatedLength).
+
+		returns result, truncated copy of result, or None if the
+		response cannot be truncated to fit (tooBig)
+		"""
+		if self.maxMessageSize >= DEFAULT_MAX_MESSAGE_SIZE:
+			return result
+		size = self.messageOverhead( response )
+		for index, (key,value) in enumerate( result ):
+			size += varBindSize( key, value )
+			if size > self.maxMessageSize:
+				length = self.truncatedLength( index, nonRepeaters, repeating )
+				if length is None:
+					return None
+				return result[:length]
+		return result
+	def truncatedLength( self, length, nonRepeaters, repeating ):
+		"""Get length to which to truncate a GETBULK result
+
+		length -- number of variables which will fit
+		nonRepeaters, repeating -- counts of request variables
+
+		The non-repeaters and one complete repetition must always
+		fit, a partial first row (or no variables at all) is never
+		sent.  If self.truncateRows, only whole repetitions are
+		returned after that, so a row of the table is never split
+		across responses.
+
+		returns the truncated length, or None if the non-repeaters
+		and a single repetition do not fit (the response must then
+		be tooBig)
+		"""
+		if length <= 0 or length < nonRepeaters + repeating:
+			return None
+		if self.truncateRows and repeating:
+			return length - ((length - nonRepeaters) % repeating)
+		return length
 	def getTableOIDs( self, nonRepeating=(), repeating=(), maxRepetitions=255 ):
 		"""Get non-repeating and repeating OID values
 
@@ -257,28 +718,39 @@ class Agent:
 		result = []
 		for index, base in enumerate(nonRepeating):
 			try:
-				oid,value = self.dataStore.nextOID( base )
+				oid,value = self.dataStore.nextOIDs( base, 1 )[0]
 			except errors.OIDNameError, err:
-				oid = oid
+				oid = base
 				value = v2c.EndOfMibView()
 			result.append( (oid,value) )
-		nextIter = repeating
-		for repeat in range(maxRepetitions):
-			variables = nextIter
-			nextIter = []
-			foundGood = 0
-			for index, base in enumerate(variables):
-				try:
-					oid,value = self.dataStore.nextOID( base )
-					foundGood = 1
-				except errors.OIDNameError, err:
-					# XXX is the use of base here correct?
-					oid = base
-					value = v2c.EndOfMibView()
-				nextIter.append( oid )
-				result.append( (oid,value) )
-			if not foundGood:
-				break # just to save processing
+		if maxRepetitions <= 0 or not repeating:
+			return result
+		# scan each column with a single range-scan of the store
+		columns = []
+		longest = 0
+		for base in repeating:
+			try:
+				column = self.dataStore.nextOIDs( base, maxRepetitions )
+			except errors.OIDNameError, err:
+				column = []
+			columns.append( column )
+			longest = max((longest,len(column)))
+		# once every column is exhausted we include one row of
+		# EndOfMibView values and stop
+		repetitions = min((maxRepetitions,longest+1))
+		for index, base in enumerate(repeating):
+			column = columns[index]
+			if len(column) < repetitions:
+				# XXX is the use of the last OID here correct?
+				if column:
+					base = column[-1][0]
+				column.extend([
+					(base,v2c.EndOfMibView())
+					for i in range(repetitions-len(column))
+				])
+		for repeat in range(repetitions):
+			for column in columns:
+				result.append( column[repeat] )
 		return result
 	def set( self, request, address, implementation ):
 		"""Set OIDs as given by request
@@ -293,6 +765,7 @@ class Agent:
 		undo on failure even including the commit itself.  Not
 		implemented.
 		"""
+		timing = instrumentation.startTiming( self.instrumentation, 'set', self.dataStore )
 		errorCode = 0
 		errorIndex = 0
 		variables = request.apiGenGetPdu().apiGenGetVarBind()
@@ -301,17 +774,24 @@ class Agent:
 			if errorCode:
 				errorIndex = index
 				break
+		timing.mark( 'validate' )
 		response = request.reply()
 		pdu = response.apiGenGetPdu()
 		if errorCode:
 			pdu.apiGenSetErrorStatus( errorCode )
 			pdu.apiGenSetErrorIndex( errorIndex + 1 ) # 1-indexed
 			pdu.apiGenSetVarBind(variables)
-			return self.protocol.send( response.encode(), address )
-		self.setOIDs( variables )
-		response = request.reply()
-		pdu.apiGenSetVarBind(variables)
-		return self.protocol.send( response.encode(), address )
+			message = response.encode()
+		else:
+			self.setOIDs( variables )
+			timing.mark( 'store' )
+			response = request.reply()
+			pdu.apiGenSetVarBind(variables)
+			message = response.encode()
+		timing.mark( 'encode' )
+		result = self.protocol.send( message, address )
+		timing.finish()
+		return result
 	def setOIDs( self, variables ):
 		"""Set the OID:value variables in our dataStore"""
 		for index, (oid,value) in enumerate(variables):
@@ -321,6 +801,9 @@ class Agent:
 		"""Get our system object identifier for traps"""
 		# XXX find something useful...
 		return '1.3.6.1.1.2.3.4.1'
+	def getSysUpTime( self ):
+		"""Get hundredths of seconds since the agent was created"""
+		return int( (time.time() - self.startTime) * 100 )
 
 
 	def registerTrap( 
@@ -341,7 +824,25 @@ class Agent:
 		if managers is None:
 			specifics[ trapHandler.specificType ] = managers = {}
 		managers[ trapHandler.managerIP ] = trapHandler
+		self._trapRoutes.clear()
 		return trapHandler
+	def trapHandlers( self, genericType=6, specificType=0 ):
+		"""Get list of TrapHandlers to receive given trap types
+
+		The routing of each (genericType,specificType) is calculated
+		once (with findTrapHandlers) and kept until the registrations
+		change.
+		"""
+		key = (genericType,specificType)
+		handlers = self._trapRoutes.get( key )
+		if handlers is None:
+			handlers = []
+			for (generic,specific,values) in self.findTrapHandlers(
+				genericType, specificType
+			):
+				handlers.extend( values.values() )
+			self._trapRoutes[ key ] = handlers
+		return handlers
 	def findTrapHandlers( self, genericType=None, specificType=None ):
 		"""Yield set of paths to handlers for given types"""
 		if genericType is None:
@@ -392,29 +893,79 @@ class Agent:
 						del self._trapRegistry[generic]
 				except KeyError, err:
 					pass
+		if count:
+			self._trapRoutes.clear()
 		return count
 	def sendTrap(
 		self, genericType=6, specificType=0, 
 		pdus=None,
 	):
-		"""Send given trap to all registered watchers"""
-		for (generic,specific,values) in self.findTrapHandlers(
-			genericType, specificType
-		):
-			for handler in values.values():
+		"""Send given trap to all registered watchers
+
+		The trap is encoded once for each (community, version,
+		notification type) among the watchers, then sent to each
+		of them.  Informs which are not acknowledged are logged
+		(see sendInform to track acknowledgements).
+
+		returns number of watchers to which the trap was sent
+		"""
+		deliveries = self.notify( genericType, specificType, pdus )
+		for delivery in deliveries:
+			if delivery is not None:
+				delivery.addErrback( lambda reason: None )
+		return len(deliveries)
+	def sendInform(
+		self, genericType=6, specificType=0,
+		pdus=None,
+	):
+		"""Send given trap to all registered watchers, tracking informs
+
+		As for sendTrap, but returns a DeferredList of the
+		acknowledgements of the watchers which receive informs
+		(each result is (success, address) where failures are
+		defer.TimeoutError Failures).
+		"""
+		return defer.DeferredList(
+			[
+				delivery
+				for delivery in self.notify( genericType, specificType, pdus )
+				if delivery is not None
+			],
+			consumeErrors = True,
+		)
+	def notify( self, genericType=6, specificType=0, pdus=None ):
+		"""Encode and deliver trap to registered watchers
+
+		returns list of TrapHandler.deliver results, i.e. None for
+		traps and Deferreds for informs
+		"""
+		handlers = self.trapHandlers( genericType, specificType )
+		if not handlers:
+			return []
+		if hasattr( pdus, 'items' ):
+			pdus = pdus.items()
+		messages = {}
+		deliveries = []
+		for handler in handlers:
+			key = handler.encodingKey()
+			message = messages.get( key )
+			if message is None:
 				# XXX need to be able to add more data!
-				handler.send( 
-					self, 
-					genericType=genericType, 
-					specificType=specificType, 
-					pdus=pdus 
+				message = messages[ key ] = handler.encode(
+					self,
+					genericType=genericType,
+					specificType=specificType,
+					pdus=pdus,
 				)
+			deliveries.append( handler.deliver( self, message ) )
+		return deliveries
 
 class TrapHandler( object ):
 	"""Registration for a given Trap for a given manager"""
 	def __init__( 
 		self, managerIP, community='public', version='v2c',
 		genericType=None, specificType=None,
+		notification=None, timeout=None, retryCount=None,
 	):
 		"""Initialise the registration for the given parameters
 		
@@ -422,35 +973,99 @@ class TrapHandler( object ):
 		community -- community string to use for the messages we send 
 		genericType -- the major type spec for matching messages
 		specificType -- the minor type spec for matching messages
+		notification -- TRAP to send traps of the given version,
+			INFORM to send (SNMPv2c) inform requests, which are
+			re-sent until acknowledged, if None (the default) v1
+			traps are sent whatever the version
+		timeout, retryCount -- for informs, override the defaults
+			of the protocol's InformTracker
 		"""
 		self.managerIP = managerIP
 		self.community = community
 		self.genericType = genericType
 		self.specificType = specificType
+		self.notification = notification
+		if notification == INFORM:
+			version = 'v2c'
 		self.implementation = resolveVersion( version)[1]
+		self.timeout = timeout
+		self.retryCount = retryCount
 	def send( self, agent, genericType=6, specificType=0, pdus=None ):
-		"""Given agent, send our message to the management stations"""
-		# XXX pysnmp doesn't seem to support v2 traps...
+		"""Given agent, send our message to the management stations
+
+		returns Deferred firing on acknowledgement for informs
+		"""
+		return self.deliver(
+			agent, self.encode( agent, genericType, specificType, pdus ),
+		)
+	def deliver( self, agent, message ):
+		"""Send encoded message from agent to our manager
+
+		returns Deferred firing on acknowledgement for informs
+		"""
+		if self.notification == INFORM:
+			return agent.protocol.getInformTracker().send(
+				message, self.managerIP,
+				timeout=self.timeout, retryCount=self.retryCount,
+			)
+		agent.protocol.send( message, self.managerIP )
+		return None
+	def encodingKey( self ):
+		"""Get key identifying handlers whose encoded traps are identical"""
+		return (self.community, self.implementation, self.notification)
+	def encode( self, agent, genericType=6, specificType=0, pdus=None ):
+		"""Given agent, encode our trap message"""
+		if self.notification is not None and self.implementation is not v1:
+			return self.encodeV2( agent, genericType, specificType, pdus )
 		from pysnmp.proto.api import alpha
 		ver = alpha.v1
 		req = ver.Message()
 		req.apiAlphaSetCommunity(self.community)
 		trap = ver.TrapPdu()
-		if ver is alpha.v1:
-			trap.apiAlphaSetEnterprise(agent.getSysObjectId())
-			trap.apiAlphaSetGenericTrap( genericType )
-			trap.apiAlphaSetSpecificTrap( specificType )
-			if pdus:
-				if hasattr( pdus, 'items' ):
-					pdus = pdus.items()
-				pdus = [
-					(oid.OID(key),datatypes.typeCoerce(value, v1))
-					for key,value in pdus 
-				]
-				trap.apiAlphaSetVarBindList( *pdus )
-		else:
-			raise NotImplementedError( """No v2c trap-sending support yet""" )
+		trap.apiAlphaSetEnterprise(agent.getSysObjectId())
+		trap.apiAlphaSetGenericTrap( genericType )
+		trap.apiAlphaSetSpecificTrap( specificType )
+		if pdus:
+			if hasattr( pdus, 'items' ):
+				pdus = pdus.items()
+			pdus = [
+				(oid.OID(key),datatypes.typeCoerce(value, v1))
+				for key,value in pdus 
+			]
+			trap.apiAlphaSetVarBindList( *pdus )
 		req.apiAlphaSetPdu(trap)
-		return agent.protocol.send( req.berEncode(), self.managerIP )
+		return req.berEncode()
+	def encodeV2( self, agent, genericType=6, specificType=0, pdus=None ):
+		"""Given agent, encode our SNMPv2c trap or inform message
+
+		The v1-style trap types are converted to a snmpTrapOID
+		as described in RFC 2576 section 3.1
+		"""
+		if self.notification == INFORM:
+			request = v2c.InformRequest()
+		else:
+			request = v2c.SnmpV2Trap()
+		request.apiGenSetCommunity( self.community )
+		enterprise = agent.getSysObjectId()
+		if genericType == 6:
+			trapOID = '%s.0.%s'%( enterprise, specificType )
+		else:
+			trapOID = '%s.%s'%( SNMP_TRAPS, genericType+1 )
+		variables = [
+			(oid.OID(SYS_UP_TIME), v2c.TimeTicks( agent.getSysUpTime() )),
+			(oid.OID(SNMP_TRAP_OID), v2c.ObjectIdentifier( trapOID )),
+		]
+		if pdus:
+			if hasattr( pdus, 'items' ):
+				pdus = pdus.items()
+			variables.extend([
+				(oid.OID(key),datatypes.typeCoerce(value, v2c))
+				for key,value in pdus
+			])
+		variables.append(
+			(oid.OID(SNMP_TRAP_ENTERPRISE), v2c.ObjectIdentifier( enterprise )),
+		)
+		request.apiGenGetPdu().apiGenSetVarBind( variables )
+		return request.encode()
 
 
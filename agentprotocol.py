@@ -3,9 +3,18 @@ from twisted.internet import defer, protocol, reactor
 from twistedsnmp.pysnmpproto import v2c,v1, error
 from pysnmp import error as pysnmp_error
 from pysnmp.asn1 import error as asnerror
+from twistedsnmp import instrumentation
 from twistedsnmp.logs import agentprotocol_log as log
 #log.setLevel( log.WARN )
 
+# Agent handler (and instrumentation) names for request types
+HANDLER_NAMES = {
+	'get_request': 'get',
+	'get_next_request': 'getNext',
+	'get_bulk_request': 'getTable',
+	'set_request': 'set',
+}
+
 class AgentProtocol(protocol.ConnectedDatagramProtocol):
 	"""Base class for SNMP datagram protocol
 
@@ -15,11 +24,26 @@ class AgentProtocol(protocol.ConnectedDatagramProtocol):
 	sending messages from the Agent back across the network.
 
 	In addition it provides a few utility methods.
+
+	attributes:
+		retransmitCache -- optional responsecache.RetransmitCache
+			used to replay responses to retransmitted requests
+			rather than executing them again
+		informTracker -- informs.InformTracker for informs sent by
+			our agent, recognises their acknowledgements
+		instrumentation -- optional instrumentation.Instrumentation
+			recording the time spent decoding, verifying and
+			handling requests, datagrams which are dropped (not
+			decodable, bad community or no agent) are recorded
+			as the 'rejected' phase instead of 'total'
 	"""
 	agent = None
+	retransmitCache = None
+	informTracker = None
+	instrumentation = None
 	def __init__(
 		self, interface=None, port=161, community='public',
-		snmpVersion = 'v2', agent=None,
+		snmpVersion = 'v2', agent=None, retransmitCache=None,
 	):
 		"""Initialize the SNMPProtocol object
 
@@ -31,6 +55,8 @@ class AgentProtocol(protocol.ConnectedDatagramProtocol):
 			highest available version (v2c, at the moment), but for
 			testing purposes it is occasionally useful to set the
 			version to v1.
+		retransmitCache -- if specified, a RetransmitCache (or true
+			value to create a default RetransmitCache)
 		"""
 		self.interface = interface
 		self.port = port
@@ -40,6 +66,11 @@ class AgentProtocol(protocol.ConnectedDatagramProtocol):
 			self.implementations = [v2c,v1]
 		else:
 			self.implementations = [v1]
+		if retransmitCache:
+			if not hasattr( retransmitCache, 'received' ):
+				from twistedsnmp import responsecache
+				retransmitCache = responsecache.RetransmitCache()
+			self.retransmitCache = retransmitCache
 		if agent is not None:
 			self.setAgent( agent )
 			agent.setProtocol( self )
@@ -58,6 +89,16 @@ class AgentProtocol(protocol.ConnectedDatagramProtocol):
 		XXX Needs to do minimal authentication at least!
 		"""
 		log.debug( 'datagram in from %s: %r', address, datagram )
+		if self.informTracker is not None and self.informTracker.received( datagram, address ):
+			return
+		if self.retransmitCache is not None:
+			key, response = self.retransmitCache.received( datagram, address )
+			if response is not None:
+				if response:
+					log.debug( 'replaying response to retransmission %s', key )
+					self.transport.write( response, address )
+				return
+		timing = instrumentation.startTiming( self.instrumentation, None )
 		processed = 0
 		for implementation in self.implementations:
 			request = implementation.Request()
@@ -70,35 +111,63 @@ class AgentProtocol(protocol.ConnectedDatagramProtocol):
 				log.error( 'Malformed inbound message dropped: %s', why )
 				continue
 			else:
+				requestType = self.requestType( request )
+				timing.setRequestType( HANDLER_NAMES.get( requestType, requestType ) )
+				timing.mark( 'decode' )
 				if self.verifyIdentity( request, address ):
+					timing.mark( 'verify' )
 					# Fetch Object ID's and associated values
 					vars = request.apiGenGetPdu().apiGenGetVarBind()
-					agent = self.agent
+					agent = self.findAgent( request, address )
 					if agent is None:
 						# close down the protocol, as the agent is gone?
+						timing.finish( 'rejected' )
 						return
-					requestType = self.requestType( request )
+					result = None
 					if requestType == 'get_request':
-						agent.get( request, address, implementation )
+						result = agent.get( request, address, implementation )
 					elif requestType == 'get_next_request':
-						agent.getNext( request, address, implementation )
+						result = agent.getNext( request, address, implementation )
 					elif requestType == 'get_bulk_request':
-						agent.getTable( request, address, implementation )
+						result = agent.getTable( request, address, implementation )
 					elif requestType == 'set_request':
-						agent.set( request, address, implementation )
+						result = agent.set( request, address, implementation )
 					else:
 						log.error( "Unrecognised request type %r", requestType )
+					timing.mark( 'handle' )
+					if isinstance( result, defer.Deferred ):
+						# response waits for Deferred values
+						def finish( value ):
+							timing.finish()
+							return value
+						result.addBoth( finish )
+					else:
+						timing.finish()
+				else:
+					timing.finish( 'rejected' )
 				break
 		if not processed:
+			timing.finish( 'rejected' )
 			log.warn(
 				'Warning: unable to decode message from %s:  %s',
 				address, datagram,
 			)
+	def getInformTracker( self ):
+		"""Get our InformTracker, creating it if necessary"""
+		if self.informTracker is None:
+			from twistedsnmp import informs
+			self.informTracker = informs.InformTracker( self )
+		return self.informTracker
+	def findAgent( self, request, address ):
+		"""Find the Agent which should answer request (None to drop it)"""
+		return self.agent
 	def requestType( self, request ):
 		"""Retrieve the request-type from the request"""
 		return request['pdu'].keys()[0]
 	def send(self, response, address):
 		"""Send a request (string) to the network"""
+		if self.retransmitCache is not None:
+			self.retransmitCache.sent( response, address )
 		self.transport.write(response, address)
 	def verifyIdentity( self, request, address ):
 		"""Verify that the address and message-community are valid
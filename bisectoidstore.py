@@ -43,7 +43,11 @@ class BisectOIDStore(oidstore.OIDStore):
 	Signature for a callable value is:
 		def callableValue( oid, storage ):
 			return finalValue
+
+	See the dynamicvalues module for cached callable values
+	and sub-storages calculating whole tables at once.
 	"""
+	chained = False
 	def __init__( self, OIDs=None ):
 		"""Initialise the storage with appropriate OIDs"""
 		self.OIDs = []
@@ -90,6 +94,14 @@ class BisectOIDStore(oidstore.OIDStore):
 		request.
 		"""
 		oid = oidToSortable( oid )
+		if hasattr( value, 'nextOID' ) or hasattr( value, 'firstOID' ):
+			# sub-storages need the general-purpose nextOIDs
+			self.chained = True
+			# and can change without our knowledge
+			self.volatile = True
+		elif callable( value ):
+			self.volatile = True
+		self.version += 1
 		start = bisect.bisect( self.OIDs, (oid,) )
 		previousTable = (
 			start and self.OIDs and
@@ -148,6 +160,14 @@ class BisectOIDStore(oidstore.OIDStore):
 			dumbPrefix = base.__class__.isaprefix
 		else:
 			dumbPrefix = oidstore.dumbPrefix
+		if start and dumbPrefix( self.OIDs[start-1][0], base ) and hasattr(
+			self.OIDs[start-1][1], 'nextOID',
+		):
+			# base is within a sub-storage, which may hold the next OID
+			try:
+				return self.OIDs[start-1][1].nextOID( sortableToOID(base) )
+			except errors.OIDNameError, err:
+				return self.followingOID( start, base )
 		if start < len( self.OIDs ):
 			# require for all OIDs that they precisely match
 			# an OID in the OID set we publish...
@@ -169,24 +189,19 @@ class BisectOIDStore(oidstore.OIDStore):
 						return value.nextOID( sortableToOID(base) )
 					except errors.OIDNameError, err:
 						start += 1
+			elif hasattr( value, 'nextOID' ):
+				# exact match of a sub-storage's root OID, its contents
+				# follow the root, so search it before the item after
+				try:
+					return value.nextOID( sortableToOID(base) )
+				except errors.OIDNameError, err:
+					start += 1
 			else:
 				# otherwise return the item *after* the found OID (exact match)
 				# again, if the value is a sub-storage, then we need to search
 				# forward from the item after...
 				start += 1
-			# now get the real value...
-			while start < len(self.OIDs ):
-				key,value = self.OIDs[start]
-				if hasattr( value, 'firstOID' ):
-					try:
-						return value.firstOID()
-					except errors.OIDNameError, err:
-						pass
-				else:
-					return sortableToOID(key),self.returnValue(value,key)
-				start += 1
-			# overflow error, reached end of our OID table with this OID
-			raise errors.OIDNameError( base, message="""OID is beyond end of table""" )
+			return self.followingOID( start, base )
 		else:
 			# starting OID is beyond end of table
 			# only chance is if the last element is a tabular record
@@ -197,6 +212,70 @@ class BisectOIDStore(oidstore.OIDStore):
 				):
 					return self.OIDs[-1][1].nextOID( sortableToOID(base) )
 			raise errors.OIDNameError( base, message="""OID is beyond end of table""" )
+	def followingOID( self, start, base ):
+		"""Get first OID,value pair from record index start onward
+
+		Searches into sub-storages, skipping empty ones.
+		"""
+		while start < len(self.OIDs ):
+			key,value = self.OIDs[start]
+			if hasattr( value, 'firstOID' ):
+				try:
+					return value.firstOID()
+				except errors.OIDNameError, err:
+					pass
+			else:
+				return sortableToOID(key),self.returnValue(value,key)
+			start += 1
+		# overflow error, reached end of our OID table with this OID
+		raise errors.OIDNameError( base, message="""OID is beyond end of table""" )
+	def firstOIDAfter( self, base ):
+		"""Get first OID,value pair strictly after an arbitrary base OID
+
+		Unlike nextOID, base need not be (or prefix) an OID in this
+		storage, so this can continue a scan from an OID held
+		elsewhere (see overlayoidstore.OverlayOIDStore).
+
+		raises OIDNameError if there is no OID after base
+		"""
+		key = oidToSortable( base )
+		start = bisect.bisect( self.OIDs, (key,) )
+		if start < len(self.OIDs) and self.OIDs[start][0] == key:
+			start += 1
+		return self.followingOID( start, base )
+
+	def nextOIDs( self, base, count ):
+		"""Get up to count OID,value pairs following base OID
+
+		Uses a single bisect and then slices the following
+		records, unless the storage has chained sub-storages
+		(or a sub-class has overridden nextOID), in which case
+		falls back to chaining nextOID calls.
+
+		raises OIDNameError if there is no OID after base
+		"""
+		if self.chained or self.__class__.nextOID.im_func is not BisectOIDStore.nextOID.im_func:
+			return super( BisectOIDStore, self ).nextOIDs( base, count )
+		base = oidToSortable( base )
+		OIDs = self.OIDs
+		start = bisect.bisect( OIDs, (base,) )
+		if start < len( OIDs ):
+			oid = OIDs[start][0]
+			if oid == base:
+				start += 1
+			elif not oidstore.dumbPrefix( base, oid ):
+				# same rule as nextOID, must be in (or prefix of) our OID set
+				raise errors.OIDNameError(
+					base,
+					message="Could not find OID in database",
+				)
+		if start >= len( OIDs ):
+			raise errors.OIDNameError( base, message="""OID is beyond end of table""" )
+		returnValue = self.returnValue
+		return [
+			(sortableToOID(key),returnValue(value,key))
+			for (key,value) in OIDs[start:start+count]
+		]
 
 	def returnValue( self, value, oid ):
 		"""Return value, or value.calculateOIDValue( oid, self )"""
@@ -102,6 +102,7 @@ class BSDOIDStore(oidstore.OIDStore):
 		request.
 		"""
 		old = None
+		self.version += 1
 		oid = oidToSortable( oid )
 		if self.btree.has_key( oid ):
 			try:
@@ -149,6 +150,37 @@ class BSDOIDStore(oidstore.OIDStore):
 					message="OID appears to be last in database"
 				)
 		return oid, value
+	def nextOIDs( self, base, count ):
+		"""Get up to count OID,value pairs following base OID
+
+		Positions the btree cursor once and then steps forward.
+
+		raises OIDNameError if there is no OID after base
+		"""
+		result = []
+		if count <= 0:
+			return result
+		encoded = oidToSortable( base )
+		try:
+			key, value = self.btree.set_location(encoded)
+		except KeyError, err:
+			raise errors.OIDNameError(
+				base,
+				message="OID not found in database"
+			)
+		if key != encoded:
+			result.append( (sortableToOID( key ), value) )
+		try:
+			while len(result) < count:
+				key,value = self.btree.next()
+				result.append( (sortableToOID( key ), value) )
+		except KeyError, err:
+			if not result:
+				raise errors.OIDNameError(
+					base,
+					message="OID appears to be last in database"
+				)
+		return result
 
 
 def set_location(self, key):
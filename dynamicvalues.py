@@ -0,0 +1,153 @@
+"""Cached run-time-calculated values for BisectOIDStore
+
+A callable value in a BisectOIDStore is called on every retrieval,
+so a GETBULK across a table of calculated values calls the value's
+function once per cell, and a poller walking the table every few
+seconds keeps the functions permanently busy.
+
+MemoizedValue wraps such a callable, re-using each OID's value for
+a given number of seconds.
+
+TableProvider is a sub-storage (inserted with setValue at the root
+of a subtree) whose whole subtree is produced by a single call of a
+function.  The result is kept as a snapshot from which GET/GETNEXT
+requests are answered until it is ttl seconds old, so a dynamic
+table costs one calculation per refresh instead of one per cell.
+"""
+import time
+from twisted.internet import defer
+from twistedsnmp import oidstore, bisectoidstore
+
+def ignoreFailure( reason ):
+	"""Errback marking a failure reported elsewhere as handled"""
+	return None
+
+class MemoizedValue( object ):
+	"""Callable value caching its function's result for ttl seconds
+
+	Usage:
+		store.setValue( oid, MemoizedValue( function, ttl=5.0 ) )
+
+	function is called as function( oid, storage ), as for any
+	callable value, and may return a Deferred, in which case the
+	value it produces is cached once available.  Until then further
+	retrievals of the OID don't call function again, they each get
+	a Deferred fired with the same result.
+
+	attributes:
+		calls -- number of calls to function
+	"""
+	def __init__( self, function, ttl=1.0 ):
+		"""Initialise the value
+
+		function -- callable producing values, as function( oid, storage )
+		ttl -- seconds for which a produced value is re-used
+		"""
+		self.function = function
+		self.ttl = ttl
+		self.values = {}
+		self.pending = {} # {oid: [Deferreds waiting for the value]}
+		self.calls = 0
+	def __call__( self, oid, storage ):
+		"""Get cached value for oid, or calculate a new one"""
+		entry = self.values.get( oid )
+		now = time.time()
+		if entry is not None and entry[0] > now:
+			return entry[1]
+		waiting = self.pending.get( oid )
+		if waiting is not None:
+			d = defer.Deferred()
+			waiting.append( d )
+			return d
+		self.calls += 1
+		value = self.function( oid, storage )
+		if isinstance( value, defer.Deferred ):
+			self.pending[ oid ] = []
+			value.addCallbacks(
+				self.resolved, self.failed,
+				callbackArgs=(oid,), errbackArgs=(oid,),
+			)
+		else:
+			self.store( value, oid, now )
+		return value
+	def resolved( self, value, oid ):
+		"""Cache value produced by a Deferred, passing it to waiting callers"""
+		waiting = self.pending.pop( oid, () )
+		self.store( value, oid )
+		for d in waiting:
+			d.callback( value )
+		return value
+	def failed( self, reason, oid ):
+		"""Pass failure of a Deferred to waiting callers (nothing is cached)
+
+		The failure continues down the original Deferred's chain,
+		where it is handled (or reported) once, so each waiting
+		caller's copy is marked as handled after the caller's own
+		callbacks have seen it, rather than logging the same
+		"Unhandled error in Deferred" once per waiting caller.
+		"""
+		waiting = self.pending.pop( oid, () )
+		for d in waiting:
+			d.errback( reason )
+			d.addErrback( ignoreFailure )
+		return reason
+	def store( self, value, oid, now=None ):
+		"""Cache value for oid"""
+		if now is None:
+			now = time.time()
+		self.values[ oid ] = (now + self.ttl, value)
+		return value
+	def clear( self ):
+		"""Discard all cached values"""
+		self.values.clear()
+
+class TableProvider( oidstore.OIDStore ):
+	"""Sub-storage calculating a whole subtree at once
+
+	Usage:
+		store.setValue( tableRoot, TableProvider( function, ttl=10.0 ) )
+
+	function is called with no arguments and returns the subtree's
+	OID:value pairs in any form accepted by OIDStore.update (all
+	OIDs should be within the provider's root OID).
+
+	The provider is read-only, SET requests within it are ignored.
+
+	attributes:
+		refreshes -- number of calls to function
+	"""
+	volatile = True
+	def __init__( self, function, ttl=10.0 ):
+		"""Initialise the provider
+
+		function -- callable producing the subtree's values
+		ttl -- seconds for which a snapshot is used
+		"""
+		self.function = function
+		self.ttl = ttl
+		self.current = None
+		self.expiry = 0
+		self.refreshes = 0
+	def snapshot( self ):
+		"""Get the current snapshot, re-calculating it if expired"""
+		now = time.time()
+		if self.current is None or now >= self.expiry:
+			self.current = bisectoidstore.BisectOIDStore( self.function() )
+			self.expiry = now + self.ttl
+			self.refreshes += 1
+		return self.current
+	def refresh( self ):
+		"""Force re-calculation on next access"""
+		self.current = None
+	def getExactOID( self, base ):
+		"""Get the given OID,value pair from the snapshot"""
+		return self.snapshot().getExactOID( base )
+	def firstOID( self ):
+		"""Retrieve the first OID,value pair from the snapshot"""
+		return self.snapshot().firstOID()
+	def nextOID( self, base ):
+		"""Get next OID,value pair after base from the snapshot"""
+		return self.snapshot().nextOID( base )
+	def nextOIDs( self, base, count ):
+		"""Get up to count OID,value pairs following base from the snapshot"""
+		return self.snapshot().nextOIDs( base, count )
@@ -3,6 +3,7 @@ noError = 0
 tooBig = 1 # Response message would have been too large
 noSuchName = 2 #There is no such variable name in this MIB
 badValue = 3 # The value given has the wrong type or length
+genErr = 5 # The value could not be retrieved for some other reason
 
 class OIDNameError( NameError ):
 	"""An OID was specified which is not defined in namespace"""
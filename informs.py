@@ -0,0 +1,170 @@
+"""Tracking of acknowledgements for SNMPv2c inform requests
+
+An inform must be re-sent until the manager acknowledges it with a
+response carrying the same request id.  An agent sending bursts of
+informs to several managers would need thousands of callLater timers
+if each inform had its own, so the InformTracker keeps all of the
+outstanding informs' deadlines in a single heap, with a single
+reactor timer for the earliest of them.  Deadlines are rounded up to
+the tracker's granularity so that informs sent at nearly the same
+time are retried (or failed) in a single pass.
+
+Acknowledgements are recognised by the AgentProtocol (which has an
+informTracker attribute) from the BER header of the datagram, without
+decoding the whole message.
+"""
+from __future__ import nested_scopes
+from twisted.internet import reactor, defer
+from twistedsnmp import responsecache
+from twistedsnmp.logs import agentprotocol_log as log
+import time, random, heapq, math
+
+class Inform( object ):
+	"""Record of a single outstanding inform
+
+	attributes:
+		message -- the encoded inform request
+		address -- (ip,port) of the manager
+		deferred -- Deferred fired on acknowledgement
+		timeout -- seconds to wait for each attempt
+		retries -- remaining re-sends
+		deadline -- time at which the current attempt expires
+	"""
+	def __init__( self, message, address, timeout, retries ):
+		self.message = message
+		self.address = address
+		self.deferred = defer.Deferred()
+		self.timeout = timeout
+		self.retries = retries
+		self.deadline = None
+
+class InformTracker( object ):
+	"""Sender of informs with shared retry timer
+
+	attributes:
+		protocol -- AgentProtocol through which to send
+		timeout, retryCount -- defaults for send
+		granularity -- seconds to which deadlines are rounded
+		outstanding -- { (address, requestID): Inform }
+		acknowledged, retried, failed -- statistics counts
+	"""
+	def __init__( self, protocol, timeout=1.0, retryCount=3, granularity=0.05 ):
+		"""Initialise the tracker
+
+		protocol -- AgentProtocol through which to send
+		timeout -- default seconds to wait for acknowledgement
+		retryCount -- default number of re-sends before failing
+		granularity -- seconds to which deadlines are rounded
+		"""
+		self.protocol = protocol
+		self.timeout = timeout
+		self.retryCount = retryCount
+		self.granularity = granularity
+		self.outstanding = {}
+		self.queue = []
+		self.timer = None
+		self.requestID = random.randint( 1, 2**30 )
+		self.acknowledged = 0
+		self.retried = 0
+		self.failed = 0
+	def newRequestID( self ):
+		"""Get a new (positive 32-bit) request id"""
+		self.requestID += 1
+		if self.requestID >= 2**31:
+			self.requestID = 1
+		return self.requestID
+	def send( self, message, address, timeout=None, retryCount=None ):
+		"""Send encoded inform message to address
+
+		message -- encoded inform request, its request id is
+			replaced, so one message can be sent to any number
+			of managers
+		address -- (ip,port) of the manager
+		timeout, retryCount -- override our defaults
+
+		returns Deferred firing with address on acknowledgement,
+		or failing with defer.TimeoutError
+		"""
+		if timeout is None:
+			timeout = self.timeout
+		if retryCount is None:
+			retryCount = self.retryCount
+		requestID = self.newRequestID()
+		inform = Inform(
+			responsecache.replaceRequestID( message, requestID ),
+			address, timeout, retryCount,
+		)
+		self.outstanding[ (address,requestID) ] = inform
+		self.transmit( (address,requestID), inform )
+		return inform.deferred
+	def transmit( self, key, inform, reschedule=True ):
+		"""(Re-)send inform and queue its deadline"""
+		self.protocol.send( inform.message, inform.address )
+		deadline = time.time() + inform.timeout
+		if self.granularity:
+			deadline = math.ceil( deadline / self.granularity ) * self.granularity
+		inform.deadline = deadline
+		heapq.heappush( self.queue, (deadline, key) )
+		if reschedule:
+			self.reschedule()
+	def reschedule( self ):
+		"""Set our timer for the earliest deadline"""
+		if not self.queue:
+			return
+		when = self.queue[0][0]
+		if self.timer is not None and self.timer.active():
+			if self.timer.getTime() <= when:
+				return
+			self.timer.cancel()
+		self.timer = reactor.callLater(
+			max((0.0, when - time.time())), self.expire,
+		)
+	def expire( self ):
+		"""Retry or fail all informs whose deadlines have passed"""
+		self.timer = None
+		now = time.time()
+		queue = self.queue
+		while queue and queue[0][0] <= now:
+			deadline, key = heapq.heappop( queue )
+			inform = self.outstanding.get( key )
+			if inform is None or inform.deadline != deadline:
+				# acknowledged, or superseded by a retry
+				continue
+			if inform.retries > 0:
+				inform.retries -= 1
+				self.retried += 1
+				self.transmit( key, inform, reschedule=False )
+			else:
+				del self.outstanding[ key ]
+				self.failed += 1
+				log.warn( """Inform to %s was not acknowledged""", inform.address )
+				inform.deferred.errback( defer.TimeoutError( inform.address ) )
+		self.reschedule()
+	def received( self, datagram, address ):
+		"""Check whether datagram acknowledges an outstanding inform
+
+		returns True if it did (so needs no further processing)
+		"""
+		if not self.outstanding:
+			return False
+		try:
+			tag, start, communityEnd, pduEnd, idStart, idEnd = responsecache.decodeMessage( datagram )
+		except (ValueError,IndexError), err:
+			return False
+		if tag != responsecache.RESPONSE_TAG:
+			return False
+		inform = self.outstanding.pop(
+			(address, responsecache.requestID( datagram )), None,
+		)
+		if inform is None:
+			return False
+		self.acknowledged += 1
+		inform.deferred.callback( address )
+		return True
+	def cancel( self ):
+		"""Stop tracking all outstanding informs (without failing them)"""
+		if self.timer is not None and self.timer.active():
+			self.timer.cancel()
+		self.timer = None
+		self.queue = []
+		self.outstanding.clear()
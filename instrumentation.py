@@ -0,0 +1,177 @@
+"""Latency instrumentation for agents
+
+An Instrumentation object attached to an AgentProtocol and/or Agent
+(attach) aggregates the time spent in each phase of request handling:
+
+	AgentProtocol.datagramReceived -- decode, verify (community
+		check), handle (the Agent's handler) and total, or
+		rejected for dropped datagrams
+	Agent.get/getNext/getTable -- cache (response cache lookup),
+		lookup (OIDStore queries), coerce (type coercion and size
+		checks), encode and total, responses waiting for Deferred
+		values record resolve (the wait) and encode (including
+		coercion) once the values are available
+	Agent.set -- validate, store, encode and total
+
+Each (requestType, store, phase) series has a count, total and
+maximum time and a histogram of times.  requestType is the name of
+the Agent's handler (get, getNext, getTable or set), store is the
+class name of the Agent's OIDStore (or its name attribute), or None
+for the protocol's phases.
+
+Instrumentation is disabled by default, the protocol and agent then
+only test their instrumentation attribute against None (startTiming)
+and time their phases with NULL_TIMING, which records nothing.
+
+Usage:
+
+	stats = Instrumentation()
+	stats.attach( protocol, agent )
+	...
+	for series in stats.snapshot():
+		print series['requestType'], series['phase'], series['mean']
+"""
+import time, bisect
+
+# upper bounds (seconds) of the histogram buckets, a final bucket
+# counts all longer times
+DEFAULT_BUCKETS = (
+	.00001, .00003, .0001, .0003, .001, .003, .01, .03, .1, .3, 1.0,
+)
+
+class Series( object ):
+	"""Count, total, maximum and histogram of one phase's times"""
+	def __init__( self, buckets ):
+		self.buckets = buckets
+		self.count = 0
+		self.total = 0.0
+		self.maximum = 0.0
+		self.histogram = [0] * (len(buckets)+1)
+	def add( self, seconds ):
+		"""Add a single time to the series"""
+		self.count += 1
+		self.total += seconds
+		if seconds > self.maximum:
+			self.maximum = seconds
+		self.histogram[ bisect.bisect_left( self.buckets, seconds ) ] += 1
+	def asDict( self ):
+		"""Get the series as a simple (serialisable) dictionary"""
+		bounds = list(self.buckets) + [None]
+		return {
+			'count': self.count,
+			'total': self.total,
+			'mean': self.count and self.total / self.count or 0.0,
+			'max': self.maximum,
+			'histogram': zip( bounds, self.histogram ),
+		}
+
+class Timing( object ):
+	"""Timing of the phases of a single request
+
+	Created by Instrumentation.start, each mark( phase ) records the
+	time since the previous mark (or the start), finish records the
+	time since the start as the 'total' phase.
+	"""
+	def __init__( self, instrumentation, requestType, store ):
+		self.instrumentation = instrumentation
+		self.requestType = requestType
+		self.store = store
+		self.start = self.last = instrumentation.clock()
+	def setRequestType( self, requestType ):
+		"""Set the request type (once known) under which to record"""
+		self.requestType = requestType
+	def mark( self, phase ):
+		"""Record time since the last mark as phase"""
+		now = self.instrumentation.clock()
+		self.instrumentation.record( self.requestType, self.store, phase, now - self.last )
+		self.last = now
+	def finish( self, phase='total' ):
+		"""Record time since the start as phase"""
+		now = self.instrumentation.clock()
+		self.instrumentation.record( self.requestType, self.store, phase, now - self.start )
+
+class NullTiming( object ):
+	"""Timing which records nothing, used while instrumentation is disabled
+
+	Handlers can then mark their phases unconditionally, see
+	startTiming and NULL_TIMING.
+	"""
+	def setRequestType( self, requestType ):
+		"""Ignore the request type"""
+	def mark( self, phase ):
+		"""Ignore the phase"""
+	def finish( self, phase='total' ):
+		"""Ignore the end of the request"""
+
+NULL_TIMING = NullTiming()
+
+def startTiming( instrumentation, requestType, store=None ):
+	"""Start timing a request if instrumentation is enabled
+
+	instrumentation -- Instrumentation instance or None (disabled)
+
+	returns Timing instance, or NULL_TIMING if instrumentation is None
+	"""
+	if instrumentation is None:
+		return NULL_TIMING
+	return instrumentation.start( requestType, store )
+
+def storeName( store ):
+	"""Get name under which to report store"""
+	if store is None:
+		return None
+	return getattr( store, 'name', None ) or store.__class__.__name__
+
+class Instrumentation( object ):
+	"""Aggregated per-request-type, per-store, per-phase latencies"""
+	def __init__( self, buckets=DEFAULT_BUCKETS, clock=time.time ):
+		"""Initialise the instrumentation
+
+		buckets -- sorted upper bounds (seconds) of histogram buckets
+		clock -- function returning the current time in seconds
+		"""
+		self.buckets = tuple( buckets )
+		self.clock = clock
+		self.series = {}
+	def attach( self, *objects ):
+		"""Enable instrumentation of the given protocols/agents"""
+		for object in objects:
+			object.instrumentation = self
+	def detach( self, *objects ):
+		"""Disable instrumentation of the given protocols/agents"""
+		for object in objects:
+			if getattr( object, 'instrumentation', None ) is self:
+				object.instrumentation = None
+	def start( self, requestType, store=None ):
+		"""Start timing a request of requestType against store
+
+		returns Timing instance
+		"""
+		return Timing( self, requestType, storeName( store ) )
+	def record( self, requestType, store, phase, seconds ):
+		"""Add a time for the phase of a request"""
+		key = (requestType, store, phase)
+		series = self.series.get( key )
+		if series is None:
+			series = self.series[ key ] = Series( self.buckets )
+		series.add( seconds )
+	def snapshot( self ):
+		"""Get the current aggregates
+
+		returns list of dictionaries, one for each series, with
+		requestType, store, phase, count, total, mean, max and
+		histogram ([(upperBound,count)] where the last bucket's
+		upperBound is None) keys, sorted by requestType, store and
+		phase
+		"""
+		keys = self.series.keys()
+		keys.sort()
+		result = []
+		for key in keys:
+			description = self.series[ key ].asDict()
+			description[ 'requestType' ], description[ 'store' ], description[ 'phase' ] = key
+			result.append( description )
+		return result
+	def reset( self ):
+		"""Discard all aggregates"""
+		self.series = {}
@@ -49,7 +49,10 @@ class IAgentProxy(components.Interface):
 		recordCallback=None,
 		retryCount=4, timeout= 2.0,
 		maxRepetitions= DEFAULT_BULK_REPETITION_SIZE,
-		startOIDs=None,
+		startOIDs=None, nonRepeaters=(), rowCallback=None,
+		orderingPolicy='strict', orderingTolerance=3,
+		anomalyCallback=None, integrationBudget=None,
+		snapshot=None, changeCallback=None,
 	):
 		"""Convenience method for creating and running a TableRetriever
 
@@ -72,11 +75,40 @@ class IAgentProxy(components.Interface):
 			i.e. if passed in, we retrieve the table from startOIDs to
 			the end of the table excluding startOIDs themselves, rather 
 			than from roots to the end of the table.
+		nonRepeaters -- optional scalar OIDs (e.g. sysUpTime) to be
+			retrieved with get-next semantics in the first request
+			(as the GETBULK non-repeaters), saving a separate get
+			request.
+		rowCallback -- if specified, roots are treated as the columns
+			of a single table and rowCallback( suffix, record ) is
+			called with each (twined) row as soon as all columns have
+			passed its index, see twinetables.RowAssembler.  Table
+			values are then not included in the final result.
+		orderingPolicy -- how to handle agents which return OIDs
+			which do not increase (e.g. looping agents), one of
+			'strict', 'tolerate' or 'skip', see
+			tableretriever.TableRetriever
+		orderingTolerance -- number of non-increasing OIDs tolerated
+			per column for the 'tolerate' and 'skip' policies
+		anomalyCallback -- called for each non-increasing OID as
+			anomalyCallback( root, previousOID, returnedOID )
+		integrationBudget -- if specified, maximum microseconds spent
+			integrating a large response before yielding to the
+			reactor
+		snapshot -- twinetables.TableSnapshot (updated in-place when
+			the walk completes) or previous result for the table,
+			used with changeCallback
+		changeCallback -- if specified, only rows which were added,
+			changed or removed since snapshot are reported, as
+			changeCallback( change, suffix, record ), see
+			twinetables.SnapshotDiffer.  Table values are then not
+			included in the final result.
 
 		Will use bulk downloading when available (i.e. if
 		we have implementation v2c, not v1).
 
-		return value is a defered for a { rootOID: { oid: value } } mapping
+		return value is a defered for a { rootOID: { oid: value } } mapping,
+		with non-repeating OIDs reported as { nonRepeaterOID: { oid: value } }
 		"""
 	def listenTrap( 
 		self, ipAddress=None, genericType=None, specificType=None,
@@ -0,0 +1,273 @@
+"""Multi-process mass retrieval, sharding agents across worker processes
+
+A single reactor decodes all responses on a single processor, so for
+very large numbers of agents the MassRetriever becomes CPU bound long
+before the network is saturated.  ProcessMassRetriever splits the
+agent addresses into shards, each of which is retrieved by a
+MassRetriever in a separate worker process (with its own protocol and
+proxies).  Each agent's results are streamed back to the parent over
+the worker's stdout as soon as the agent completes, and merged into the
+usual { (ip,port): { oid: value } } structure (or passed to a callback).
+
+Wire format (worker to parent) is a sequence of frames:
+	format -- 1 byte, 'm' for marshal or 'p' for pickle
+	length -- 4 bytes, big-endian unsigned length of the payload
+	payload -- serialised ((ip,port), { oid: value })
+where OIDs are transmitted as dotted strings.
+"""
+from twisted.internet import defer, reactor, protocol, error
+from twistedsnmp.pysnmpproto import oid
+from twistedsnmp.massretriever import addressKey
+from twistedsnmp.logs import massretriever_log as log
+import marshal, cPickle, struct, sys, os
+
+HEADER = '>cI'
+HEADER_SIZE = struct.calcsize( HEADER )
+
+def encodeResult( key, valueSet ):
+	"""Encode a single agent's result as a frame for the parent
+
+	key -- (ip,port) tuple for the agent
+	valueSet -- { oid: value } or { rootOID: { oid: value } } mapping,
+		with None values for failed retrievals
+	"""
+	data = {}
+	for name, value in valueSet.iteritems():
+		if isinstance( value, dict ):
+			value = dict([ (str(k),v) for (k,v) in value.iteritems() ])
+		data[ str(name) ] = value
+	record = (addressKey(tuple(key)), data)
+	try:
+		payload = marshal.dumps( record )
+		format = 'm'
+	except ValueError:
+		# e.g. pysnmp object values, fall back to the slower pickle
+		payload = cPickle.dumps( record, cPickle.HIGHEST_PROTOCOL )
+		format = 'p'
+	return struct.pack( HEADER, format, len(payload) ) + payload
+
+def decodeResult( format, payload ):
+	"""Decode a frame payload into (key, { OID: value }) form"""
+	if format == 'm':
+		key, data = marshal.loads( payload )
+	else:
+		key, data = cPickle.loads( payload )
+	OID = oid.OID
+	valueSet = {}
+	for name, value in data.iteritems():
+		if isinstance( value, dict ):
+			value = dict([ (OID(k),v) for (k,v) in value.iteritems() ])
+		valueSet[ OID(name) ] = value
+	return addressKey(tuple(key)), valueSet
+
+class WorkerProtocol( protocol.ProcessProtocol ):
+	"""Parent-side protocol reading result frames from a worker process"""
+	def __init__( self, retriever, shard, job ):
+		"""Initialise the protocol
+
+		retriever -- the ProcessMassRetriever receiving our results
+		shard -- the addresses being retrieved by the worker
+		job -- the pickled job description sent to the worker
+		"""
+		self.retriever = retriever
+		self.shard = shard
+		self.job = job
+		self.buffer = ''
+		self.seen = {}
+	def connectionMade( self ):
+		"""Send the job description to the worker"""
+		self.transport.write( self.job )
+		self.transport.closeStdin()
+	def outReceived( self, data ):
+		"""Process (possibly partial) result frames from the worker"""
+		self.buffer += data
+		size = HEADER_SIZE
+		while len(self.buffer) >= size:
+			format, length = struct.unpack( HEADER, self.buffer[:size] )
+			if len(self.buffer) < size + length:
+				break
+			payload = self.buffer[size:size+length]
+			self.buffer = self.buffer[size+length:]
+			key, valueSet = decodeResult( format, payload )
+			self.seen[ key ] = 1
+			self.retriever.integrateWorkerResult( key, valueSet )
+	def errReceived( self, data ):
+		"""Pass on worker's error output to our log"""
+		log.warn( 'worker %s: %s', self.transport.pid, data.rstrip() )
+	def processEnded( self, reason ):
+		"""Handle completion (or failure) of the worker process
+
+		A partial frame left in self.buffer (a worker dying in
+		the middle of a write) is reported by the retriever as a
+		worker failure.
+		"""
+		self.retriever.workerFinished( self, reason )
+
+class ProcessMassRetriever( object ):
+	"""Retrieve value sets from multiple agents using worker processes
+
+	Like the MassRetriever, the object wraps a single query.
+	"""
+	def __init__(
+		self, addresses, processes=2,
+		concurrency=None, packetRate=None,
+		resultCallback=None,
+		executable=None,
+	):
+		"""Initialise the retriever
+
+		addresses -- sequence of (ip,port,[community,[version]])
+			tuples as passed to massretriever.proxies
+		processes -- number of worker processes to use
+		concurrency -- total number of agents in-flight, divided
+			evenly between the workers (default is the
+			MassRetriever default for each worker)
+		packetRate -- total packets-per-second ceiling, divided
+			evenly between the workers
+		resultCallback -- if specified, called as
+			resultCallback( (ip,port), valueSet ) for each agent as
+			its results arrive, rather than merging the results
+		executable -- Python interpreter for the workers, defaults
+			to sys.executable
+		"""
+		addresses = list(addresses)
+		processes = max((1,min((processes,len(addresses)))))
+		self.shards = [ addresses[i::processes] for i in range(processes) ]
+		self.concurrency = concurrency
+		self.packetRate = packetRate
+		self.resultCallback = resultCallback
+		self.executable = executable or sys.executable
+		self.workers = []
+		self.failedWorkers = 0
+	def __call__( self, oids=(), tables=(), **named ):
+		"""Do mass retrieval of oids and tables in worker processes
+
+		oids -- individual (get) oids for each Agent
+		tables -- multi-value (getTable) oids for each Agent
+		** named -- passed to the workers' proxy get and getTable
+			methods, so retryCount and timeout can be specified
+
+		returns a Deferred which fires with the same
+			{ (ip,port): { queriedOID: dataValues } }
+		mapping as MassRetriever, (an empty mapping if
+		resultCallback was specified).
+		"""
+		if not self.shards or not self.shards[0]:
+			raise ValueError( """No agent addresses specified from which to retrieve""" )
+		if not oids and not tables:
+			raise ValueError( """Nothing specified to be retrieved""" )
+		self.oids = [str(x) for x in oids]
+		self.tables = [str(x) for x in tables]
+		self.result = {}
+		self.finalDefer = defer.Deferred()
+		concurrency, packetRate = self.concurrency, self.packetRate
+		if concurrency:
+			concurrency = max((1,concurrency // len(self.shards)))
+		if packetRate:
+			packetRate = packetRate / float(len(self.shards))
+		for shard in self.shards:
+			job = cPickle.dumps( (
+				shard, self.oids, self.tables,
+				concurrency, packetRate, named,
+			), cPickle.HIGHEST_PROTOCOL )
+			worker = WorkerProtocol( self, shard, job )
+			self.workers.append( worker )
+			reactor.spawnProcess(
+				worker, self.executable,
+				[
+					self.executable, '-c',
+					'from twistedsnmp import massprocess; massprocess.main()',
+				],
+				env = os.environ,
+			)
+		return self.finalDefer
+	def integrateWorkerResult( self, key, valueSet ):
+		"""Integrate a single agent's result from a worker
+
+		Follows MassRetriever's rules, None values (failures) only
+		set when the OID is not already present for the agent.
+		"""
+		if self.resultCallback is not None:
+			self.resultCallback( key, valueSet )
+			return
+		set = self.result.get( key )
+		if set is None:
+			self.result[key] = set = {}
+		for name, value in valueSet.iteritems():
+			if value is None and set.has_key( name ):
+				continue
+			set[ name ] = value
+	def workerFinished( self, worker, reason ):
+		"""Handle end of a worker process
+
+		The worker failed unless it exited cleanly (ProcessDone)
+		without leaving a partial frame.  Any agents for which the
+		worker didn't report results are given None values (as for
+		a failed retrieval).  When all workers have finished, fires
+		self.finalDefer with self.result.
+		"""
+		self.workers.remove( worker )
+		if not reason.check( error.ProcessDone ):
+			self.failedWorkers += 1
+			log.error(
+				"""Worker process for %s agents failed: %s""",
+				len(worker.shard), reason.getErrorMessage(),
+			)
+		elif worker.buffer:
+			self.failedWorkers += 1
+			log.error(
+				"""Worker process for %s agents exited with a partial (%s byte) result frame""",
+				len(worker.shard), len(worker.buffer),
+			)
+		for address in worker.shard:
+			key = addressKey( tuple(address) )
+			if not worker.seen.has_key( key ):
+				self.integrateWorkerResult( key, dict([
+					(oid.OID(name),None)
+					for name in self.oids + self.tables
+				]))
+		if not self.workers and not self.finalDefer.called:
+			self.finalDefer.callback( self.result )
+
+def main():
+	"""Worker process entry point
+
+	Reads the job description from stdin, retrieves the values
+	and writes each agent's result to stdout as it completes.
+	"""
+	from twistedsnmp import snmpprotocol, massretriever
+	shard, oids, tables, concurrency, packetRate, named = cPickle.load( sys.stdin )
+	output = sys.stdout
+	def writeResult( key, valueSet ):
+		output.write( encodeResult( key, valueSet ))
+		output.flush()
+	port = snmpprotocol.port()
+	arguments = {}
+	if concurrency:
+		arguments['concurrency'] = concurrency
+	retriever = massretriever.MassRetriever(
+		iter( shard ), protocol = port.protocol,
+		packetRate = packetRate,
+		agentCallback = writeResult,
+		keepResults = False,
+		**arguments
+	)
+	exitCode = []
+	def onFinished( result ):
+		reactor.stop()
+	def onError( reason ):
+		sys.stderr.write( reason.getTraceback() )
+		exitCode.append( 1 )
+		reactor.stop()
+	def start():
+		try:
+			d = retriever( oids=oids, tables=tables, **named )
+		except Exception, err:
+			sys.stderr.write( log.getException( err ) )
+			exitCode.append( 1 )
+			reactor.stop()
+		else:
+			d.addCallbacks( onFinished, onError )
+	reactor.callWhenRunning( start )
+	reactor.run()
+	sys.exit( exitCode and 1 or 0 )
@@ -3,7 +3,7 @@ from __future__ import generators, nested_scopes
 from twisted.internet import defer, reactor, error
 from twisted.python import failure
 from twistedsnmp import agentproxy
-import traceback
+import traceback, time, socket
 from twistedsnmp.logs import massretriever_log as log
 
 from twistedsnmp.pysnmpproto import oid
@@ -16,27 +16,299 @@ def proxies( protocol, addresses, proxyClass=agentproxy.AgentProxy ):
 	addresses -- tuples of (ip,port,[community,[version]]) to be
 		passed to the AgentProxy constructor.
 	proxyClass -- the proxy class to use for the retrieval
+
+	For very large sets of addresses, consider passing the addresses
+	directly to MassRetriever, which creates each proxy just before
+	it is queried.
 	"""
 	return [
-		agentproxy.AgentProxy( protocol=protocol, *args )
+		proxyClass( protocol=protocol, *args )
 		for args in addresses
 	]
 
+DEFAULT_CONCURRENCY = 200
+# returned by FairQueue.next when work is pending but may not start yet
+BLOCKED = 'blocked'
+
+def agentAnswered( err ):
+	"""Does exception err show that the agent answered (e.g. an SNMP error)?
+
+	Timeouts and local (sending) errors don't.
+	"""
+	return not isinstance( err, (
+		error.TimeoutError, defer.TimeoutError, socket.error,
+		KeyboardInterrupt, SystemExit,
+	))
+
+def addressKey( item ):
+	"""Get (ip,port) key for a proxy or address tuple"""
+	if isinstance( item, tuple ):
+		if len(item) > 1:
+			return str(item[0]), int(item[1] or 161)
+		return str(item[0]), 161
+	return item.ip, item.port
+
+class FairQueue( object ):
+	"""Priority/fairness ordering of agents for a MassRetriever
+
+	Agents (proxies or address tuples) are added with a priority and
+	a caller-supplied group label (e.g. subnet or site).  Lower
+	priority values are dispatched first, within a priority the
+	groups with pending agents take turns (round-robin), so a large
+	group cannot push a small one to the end of the run.  If
+	groupLimit is set, no group may have more than groupLimit agents
+	in-flight, so a group behind a slow link cannot monopolise the
+	retriever's concurrency window.
+
+	Pass the queue as the MassRetriever's proxies, the retriever
+	reports completed agents back through agentFinished.
+	"""
+	def __init__( self, groupLimit=None ):
+		"""Initialise the queue
+
+		groupLimit -- maximum agents in-flight for any single group,
+			None for no limit
+		"""
+		if groupLimit is not None and groupLimit < 1:
+			raise ValueError( """groupLimit must be at least 1, got %r"""%(groupLimit,))
+		self.groupLimit = groupLimit
+		self.pending = {}
+		self.groups = {}
+		self.inFlight = {}
+		self.dispatched = {}
+		self.count = 0
+	def add( self, item, priority=0, group=None ):
+		"""Add a proxy or address tuple to the queue
+
+		item -- AgentProxy or (ip,port,[community,[version]]) tuple
+		priority -- priority class, lower values dispatched first
+		group -- fairness label for the agent
+		"""
+		queue = self.pending.get( (priority,group) )
+		if queue is None:
+			self.pending[ (priority,group) ] = queue = []
+			self.groups.setdefault( priority, [] ).append( group )
+		queue.append( item )
+		self.count += 1
+	def __len__( self ):
+		"""Number of agents not yet dispatched"""
+		return self.count
+	def __iter__( self ):
+		return self
+	def next( self ):
+		"""Get the next agent to dispatch
+
+		returns proxy/address, or BLOCKED if every group with
+		pending agents is at its groupLimit
+		raises StopIteration if no agents remain
+		"""
+		if not self.count:
+			raise StopIteration
+		priorities = self.groups.keys()
+		priorities.sort()
+		for priority in priorities:
+			groups = self.groups[priority]
+			for index in range(len(groups)):
+				group = groups[index]
+				if self.groupLimit is not None and self.inFlight.get( group, 0 ) >= self.groupLimit:
+					continue
+				queue = self.pending[ (priority,group) ]
+				item = queue.pop( 0 )
+				if queue:
+					# rotate, next time the following group goes first
+					groups[:] = groups[index+1:] + groups[:index+1]
+				else:
+					del self.pending[ (priority,group) ]
+					del groups[index]
+					groups[:] = groups[index:] + groups[:index]
+					if not groups:
+						del self.groups[priority]
+				self.count -= 1
+				self.inFlight[ group ] = self.inFlight.get( group, 0 ) + 1
+				self.dispatched.setdefault( addressKey(item), [] ).append( group )
+				return item
+		return BLOCKED
+	def agentFinished( self, proxy ):
+		"""Record completion of a dispatched agent, freeing its group slot"""
+		groups = self.dispatched.get( (proxy.ip,proxy.port) )
+		if groups:
+			group = groups.pop()
+			if not groups:
+				del self.dispatched[ (proxy.ip,proxy.port) ]
+			self.inFlight[ group ] -= 1
+
+class CircuitBreaker( object ):
+	"""Per-agent circuit breaker for fast-failing dead agents
+
+	Tracks consecutive timeouts for each (ip,port), once an agent
+	has timed out threshold times in a row its circuit is "open",
+	and retrievers using the breaker replace full queries of the
+	agent with a single short probe request (no retries).  When the
+	agent answers the probe (or any other query) the circuit is
+	closed again and normal queries resume.  Any answer, including
+	an SNMP error, shows that the agent is alive, errors are recorded
+	separately (see error).
+
+	The breaker is intended to be shared by the retrievers for
+	successive polling cycles (see MassRetriever and PollScheduler).
+	"""
+	def __init__(
+		self, threshold=3, probeTimeout=0.5,
+		probeOIDs=('.1.3.6.1.2.1.1.3.0',),
+	):
+		"""Initialise the breaker
+
+		threshold -- consecutive timeouts after which the circuit
+			for an agent opens
+		probeTimeout -- timeout for the single-attempt probe sent
+			to agents with open circuits
+		probeOIDs -- scalar instance OIDs retrieved (get) by the
+			probe, by default sysUpTime.0, which every agent must
+			implement
+		"""
+		self.threshold = threshold
+		self.probeTimeout = probeTimeout
+		self.probeOIDs = list(probeOIDs)
+		self.failures = {}
+		self.openSince = {}
+		self.probes = {}
+		self.errors = {} # {key: last non-timeout error from the agent}
+	def isOpen( self, key ):
+		"""Is the circuit for (ip,port) key open?"""
+		return self.openSince.has_key( key )
+	def success( self, key ):
+		"""Record a response from (ip,port) key, closing the circuit"""
+		if self.failures.has_key( key ):
+			del self.failures[ key ]
+		if self.openSince.has_key( key ):
+			log.info( """Agent %s:%s answered, closing circuit""", key[0], key[1] )
+			del self.openSince[ key ]
+			del self.probes[ key ]
+	def error( self, key, error ):
+		"""Record a non-timeout error (e.g. noSuchName) from (ip,port) key
+
+		The agent answered, so the circuit is closed as for success,
+		error is kept in self.errors as the agent's last error.
+		"""
+		self.success( key )
+		self.errors[ key ] = error
+	def failure( self, key ):
+		"""Record a timeout from (ip,port) key
+
+		returns whether the circuit is now open
+		"""
+		count = self.failures.get( key, 0 ) + 1
+		self.failures[ key ] = count
+		if count >= self.threshold and not self.openSince.has_key( key ):
+			log.info( """Agent %s:%s failed %s times, opening circuit""", key[0], key[1], count )
+			self.openSince[ key ] = time.time()
+			self.probes[ key ] = 0
+		return self.openSince.has_key( key )
+	def probe( self, proxy ):
+		"""Send a single short probe request (for probeOIDs) to proxy's agent
+
+		returns the proxy's get deferred
+		"""
+		key = proxy.ip,proxy.port
+		self.probes[ key ] = self.probes.get( key, 0 ) + 1
+		return proxy.get( self.probeOIDs, timeout=self.probeTimeout, retryCount=0 )
+	def status( self, key=None ):
+		"""Get circuit status for (ip,port) key, or all tracked agents
+
+		returns for a single key a dictionary with keys:
+			open -- whether the circuit is open
+			failures -- consecutive timeouts
+			openSince -- time at which the circuit opened (or None)
+			probes -- number of probes sent while open
+			error -- last non-timeout error (or None)
+		without a key, returns { key: status } for every agent with
+		recorded failures.
+		"""
+		if key is None:
+			return dict([
+				(key,self.status(key))
+				for key in self.failures.keys()
+			])
+		return {
+			'open': self.isOpen( key ),
+			'failures': self.failures.get( key, 0 ),
+			'openSince': self.openSince.get( key ),
+			'probes': self.probes.get( key, 0 ),
+			'error': self.errors.get( key ),
+		}
+	def openAgents( self ):
+		"""Get sorted list of (ip,port) keys with open circuits"""
+		keys = self.openSince.keys()
+		keys.sort()
+		return keys
+
 class MassRetriever( object ):
 	"""Table for retrieving value sets from multiple agents
 
 	The object wraps a single query, it cannot be shared among
 	multiple queries!
+
+	By default agents are queried through a concurrency window,
+	a new agent is started as soon as one of the (up to)
+	concurrency agents in-flight completes, optionally limited
+	by a global packets-per-second ceiling (packetRate).
+
+	Results for each agent can be delivered as soon as the agent
+	completes using agentCallback, with keepResults false the
+	results are then discarded, and the final deferred receives
+	only the summary statistics (see summary).
 	"""
 	def __init__(
-		self, proxies,
+		self, proxies, concurrency=DEFAULT_CONCURRENCY, packetRate=None,
+		agentCallback=None, keepResults=True, breaker=None,
+		protocol=None, proxyClass=agentproxy.AgentProxy,
+		report=None,
 	):
 		"""Initialise the retriever with client AgentProxies
 
-		proxies -- sequence of properties to query in batches
+		proxies -- sequence or iterable (e.g. generator) of proxies
+			to query in batches, items may also be (ip,port,
+			[community,[version]]) address tuples, in which case a
+			proxy is created (with protocol and proxyClass) just
+			before the agent is queried and released once complete.
+			A FairQueue may be passed to control the order in which
+			agents are queried
+		concurrency -- maximum number of agents being queried at any
+			one time, if None, use the (old) fixed-delay smallBatch
+			algorithm, starting one agent every iterDelay seconds
+		packetRate -- if specified, the maximum rate (packets/second)
+			at which requests are started.  Only the initial requests
+			for each agent are paced, retries and table continuations
+			are sent as soon as they are needed.
+		agentCallback -- if specified, called as
+			agentCallback( (ip,port), valueSet )
+			as soon as all queries for each agent have completed
+		keepResults -- if false, each agent's valueSet is dropped
+			from self.result once it is complete, and the final
+			deferred fires with self.summary() rather than
+			self.result.  Proxies sharing an (ip,port) will see
+			their results delivered separately.
+		breaker -- optional CircuitBreaker, agents with open circuits
+			are only sent a short probe, and only queried if they
+			answer it
+		protocol -- SNMPProtocol instance for proxies created from
+			address tuples
+		proxyClass -- the proxy class for proxies created from
+			address tuples
+		report -- optional runreport.RunReport recording per-agent
+			timings, traffic and outcomes for the run
 		"""
 		self.proxies = proxies
 		self.partialDefers = []
+		self.concurrency = concurrency
+		self.packetRate = packetRate
+		self.agentCallback = agentCallback
+		self.keepResults = keepResults
+		self.breaker = breaker
+		self.protocol = protocol
+		self.proxyClass = proxyClass
+		self.report = report
+		self.inFlight = 0
 		
 	def __call__(
 		self, oids=(), tables=(), iterDelay=0.005, *arguments, **named
@@ -45,13 +317,16 @@ class MassRetriever( object ):
 
 		oids -- individual (get) oids for each Agent
 		tables -- multi-value (getTable) oids for each Agent
+		iterDelay -- delay between starting each agent when
+			self.concurrency is None (see smallBatch)
 		** named -- passed to proxy object's get and getTable
 			methods, so retryCount and timeout can be specified
 
 		returns a DeferredList with the results of all queries
 		raises ValueError if no proxies, or neither oids or tables
 
-		The DeferredList's callback recieves a set mapping:
+		The Deferred's callback recieves a set mapping (or
+		self.summary() if self.keepResults is false):
 			{ (ip,port) : valueSet }
 		where valueSet is a set mapping:
 			{ queriedOID : dataValues }
@@ -67,11 +342,115 @@ class MassRetriever( object ):
 		if not oids and not tables:
 			raise ValueError( """Nothing specified to be retrieved""" )
 		self.result = {}
+		self.agentCount = 0
+		self.startTime = time.time()
+		if self.report is not None:
+			self.report.start = self.startTime
 		self.finalDefer = defer.Deferred()
 		self._arguments = arguments
 		self._namedArguments = named
-		self.smallBatch( oids, tables, iterDelay=iterDelay )
+		self._source = iter( self.proxies )
+		if self.concurrency is None:
+			self.smallBatch( oids, tables, iterDelay=iterDelay )
+		else:
+			self._exhausted = False
+			self._nextStart = 0.0
+			self._filling = False
+			self._fillTimer = None
+			self.fillWindow( oids, tables )
 		return self.finalDefer
+
+	def fillWindow( self, oids, tables ):
+		"""Start agents until our concurrency window is full
+
+		Called initially and whenever an agent completes, when
+		all agents have completed, calls returnFinal.  If
+		self.packetRate is set and starting another agent would
+		exceed it, reschedules itself for when the agent may start.
+		"""
+		self._fillTimer = None
+		if self._filling or self.finalDefer.called:
+			return
+		self._filling = True
+		try:
+			while self.inFlight < self.concurrency and not self._exhausted:
+				if self.packetRate:
+					now = time.time()
+					if now < self._nextStart:
+						self._fillTimer = reactor.callLater(
+							self._nextStart - now,
+							self.fillWindow, oids, tables,
+						)
+						return
+					cost = (oids and 1 or 0) + (tables and 1 or 0)
+					self._nextStart = max((now,self._nextStart)) + cost/float(self.packetRate)
+				proxy = self.nextProxy()
+				if proxy is None:
+					self._exhausted = True
+					break
+				elif proxy is BLOCKED:
+					# restarted when an agent completes
+					break
+				self.inFlight += 1
+				dl = defer.DeferredList( self.singleProxy( proxy, oids, tables ) )
+				dl.addCallback( self.proxyComplete, proxy, oids, tables )
+		finally:
+			self._filling = False
+		if not self.inFlight and self._exhausted:
+			self.returnFinal( None )
+	def proxyComplete( self, dataList, proxy, oids, tables ):
+		"""Handle completion of all queries for a single agent
+
+		Frees the agent's slot in the concurrency window, calls
+		agentFinished for the proxy and starts the next agent(s).
+		"""
+		self.inFlight -= 1
+		self.agentFinished( proxy )
+		if not self._filling and self._fillTimer is None:
+			self.fillWindow( oids, tables )
+		return dataList
+	def agentFinished( self, proxy ):
+		"""Hook called when all queries for proxy have completed
+
+		proxy -- the proxy whose results are now complete in
+			self.result[ (proxy.ip,proxy.port) ]
+
+		Passes the results to self.agentCallback (if any),
+		dropping them from self.result if not self.keepResults.
+		"""
+		self.agentCount += 1
+		if isinstance( self._source, FairQueue ):
+			self._source.agentFinished( proxy )
+		key = proxy.ip,proxy.port
+		if self.report is not None:
+			self.report.agentFinished( proxy, self.result.get( key ) )
+		if self.keepResults:
+			valueSet = self.result.get( key )
+		else:
+			valueSet = self.result.pop( key, None )
+		if self.agentCallback is not None and valueSet is not None:
+			try:
+				self.agentCallback( key, valueSet )
+			except Exception, err:
+				log.error(
+					"""Agent callback for %r failed: %s""",
+					proxy, log.getException( err ),
+				)
+	def summary( self ):
+		"""Get summary statistics for the retrieval
+
+		returns dictionary with keys:
+			agents -- number of agents completed
+			success -- number of successful queries
+			errors -- number of failed queries
+			elapsed -- seconds since the retrieval started
+		"""
+		return {
+			'agents': self.agentCount,
+			'success': self.successCount,
+			'errors': self.errorCount,
+			'elapsed': time.time() - self.startTime,
+		}
 		
 	def smallBatch( self, oids, tables, index=0, iterDelay=.01 ):
 		"""Do single-proxy batches iteratively
@@ -85,18 +464,43 @@ class MassRetriever( object ):
 		a few thousand requests/sec if there's enough processing power,
 		but twisted's strange performance characteristics make it
 		difficult to write a beast that works to that level AFAICS.
+
+		Only used when self.concurrency is None, see fillWindow
+		for the default (concurrency-window) algorithm.
 		"""
 		if not self.finalDefer.called:
-			if index < len(self.proxies):
-				proxy = self.proxies[index]
-				self.singleProxy(
+			proxy = self.nextProxy()
+			if proxy is BLOCKED:
+				reactor.callLater( iterDelay, self.smallBatch, oids, tables, index )
+			elif proxy is not None:
+				dl = defer.DeferredList( self.singleProxy(
 					proxy,oids,tables
-				)
+				))
+				dl.addCallback( lambda dataList: self.agentFinished( proxy ) )
 				reactor.callLater( iterDelay, self.smallBatch, oids, tables, index+1 )
 			else:
 				dl = defer.DeferredList( self.partialDefers )
 				dl.addCallback( self.returnFinal )
 
+	def nextProxy( self ):
+		"""Get the next proxy to be queried (or None if finished)
+
+		Address tuples are converted to proxies here, so only the
+		proxies currently being queried need to be in memory.
+		Returns BLOCKED if our FairQueue has pending agents which
+		cannot yet be started.
+		"""
+		try:
+			proxy = self._source.next()
+		except StopIteration:
+			return None
+		if proxy is BLOCKED:
+			return proxy
+		if isinstance( proxy, tuple ):
+			if self.protocol is None:
+				raise ValueError( """Need a protocol to create proxies for addresses: %r"""%(proxy,))
+			proxy = self.proxyClass( protocol=self.protocol, *proxy )
+		return proxy
 	def returnFinal( self, dataList ):
 		"""Handle final defer callback from completion of all partialDefers
 
@@ -105,8 +509,13 @@ class MassRetriever( object ):
 		gets a pointer to self.result, and the method also returns
 		self.result, just for good measure.
 		"""
+		if self.report is not None:
+			self.report.finished()
 		if not self.finalDefer.called:
-			self.finalDefer.callback( self.result )
+			if self.keepResults:
+				self.finalDefer.callback( self.result )
+			else:
+				self.finalDefer.callback( self.summary() )
 		# we're just discarding all the failure/success statistics here
 		return self.result
 
@@ -116,17 +525,74 @@ class MassRetriever( object ):
 		proxy -- the proxy to be queried
 		oids -- single oids to be queried (get)
 		tables -- multi-value oids to be queried (getTable)
+
+		returns list of the (partial) defers created for the proxy
+
+		If the proxy's circuit is open in self.breaker, only a
+		probe request is sent, see probeComplete.
 		"""
+		key = proxy.ip,proxy.port
+		if self.report is not None:
+			self.report.agentStarted( proxy )
+		if self.breaker is not None and self.breaker.isOpen( key ):
+			d = self.breaker.probe( proxy )
+			d.addCallbacks(
+				self.probeComplete, self.probeFailed,
+				callbackArgs=(proxy, oids, tables),
+				errbackArgs=(proxy, oids, tables),
+			)
+			d.addErrback( self.handleSingleError, oids=list(oids)+list(tables), proxy=proxy )
+			defers = [d]
+		else:
+			defers = self.queryProxy( proxy, oids, tables )
+		if self.concurrency is None:
+			self.partialDefers.extend( defers )
+		else:
+			# only smallBatch needs them, don't hold completed results
+			self.queryCount += len(defers)
+		return defers
+	def probeComplete( self, response, proxy, oids, tables ):
+		"""Handle agent answering a circuit-breaker probe
+
+		Closes the agent's circuit and runs the full queries,
+		returns a DeferredList for the full queries.
+		"""
+		self.breaker.success( (proxy.ip,proxy.port) )
+		return defer.DeferredList( self.queryProxy( proxy, oids, tables ) )
+	def probeFailed( self, reason, proxy, oids, tables ):
+		"""Handle failure of a circuit-breaker probe
+
+		Timeouts (and local errors) are passed on to
+		handleSingleError, any other error is an answer from the
+		agent, so the error is recorded, the circuit closed and the
+		full queries run.
+		"""
+		if not agentAnswered( reason.value ):
+			return reason
+		log.info(
+			"""Agent %r answered probe with error: %s""",
+			proxy, reason.getErrorMessage(),
+		)
+		self.breaker.error( (proxy.ip,proxy.port), reason.value )
+		return defer.DeferredList( self.queryProxy( proxy, oids, tables ) )
+	def queryProxy( self, proxy, oids, tables ):
+		"""Start the get/getTable queries for the proxy
+
+		returns list of the defers created for the proxy
+		"""
+		defers = []
 		if oids:
 			d = proxy.get( oids, *self._arguments, **self._namedArguments )
 			d.addCallback( self.integrateSingleResult, proxy=proxy )
 			d.addErrback( self.handleSingleError, oids=oids, proxy=proxy )
-			self.partialDefers.append( d )
+			defers.append( d )
 		if tables:
 			d = proxy.getTable( tables, *self._arguments, **self._namedArguments )
 			d.addCallback( self.integrateSingleResult, proxy=proxy )
 			d.addErrback( self.handleSingleError, oids=tables, proxy=proxy )
-			self.partialDefers.append( d )
+			defers.append( d )
+		return defers
+	queryCount = 0
 	successCount = 0
 	def integrateSingleResult( self, value, proxy ):
 		"""Integrate single agent-query result into mega-result
@@ -149,6 +615,8 @@ class MassRetriever( object ):
 		log.debug( '  success value %r: %r', proxy, value )
 		self.printStats()
 		key = proxy.ip,proxy.port
+		if self.breaker is not None:
+			self.breaker.success( key )
 		set = self.result.get( key )
 		if set is None:
 			self.result[key] = set = {}
@@ -178,7 +646,13 @@ class MassRetriever( object ):
 		else:
 			actualError = err
 			trace = log.getException( err )
-		if not isinstance( actualError, error.TimeoutError ):
+		if isinstance( actualError, (error.TimeoutError,defer.TimeoutError) ):
+			if self.breaker is not None:
+				self.breaker.failure( (proxy.ip,proxy.port) )
+		else:
+			if self.breaker is not None and agentAnswered( actualError ):
+				# the agent answered, if only with an error
+				self.breaker.error( (proxy.ip,proxy.port), actualError )
 			log.error(
 				"""Retrieval for proxy %r encountered unexpected error: %s""",
 				proxy, trace,
@@ -202,5 +676,5 @@ class MassRetriever( object ):
 			'errors=%s success=%s total=%s',
 			self.errorCount,
 			self.successCount,
-			len(self.partialDefers),
+			self.queryCount + len(self.partialDefers),
 		)
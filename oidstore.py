@@ -13,7 +13,16 @@ class OIDStore:
 	OID stores to use an ordered storage format with
 	fast retrieval characteristics, such as a bisect list,
 	or a BSDDB BTree database.
+
+	attributes:
+		version -- counter incremented by setValue, allows
+			cached responses to be invalidated on change
+		volatile -- if true, values may change without a
+			setValue call (e.g. calculated values), so
+			responses must never be cached
 	"""
+	version = 0
+	volatile = False
 	def close( self ):
 		"""Close the OIDStore"""
 	def getExactOID( self, base ):
@@ -34,6 +43,28 @@ class OIDStore:
 		This method is responsible for implementing GETNEXT,
 		and GETBULK requests.
 		"""
+	def nextOIDs( self, base, count ):
+		"""Get up to count OID,value pairs following base OID
+
+		Equivalent to chaining count nextOID calls, each starting
+		from the previous result, stopping early at the end of the
+		store.  Stores should override this to scan forward from a
+		single lookup (e.g. bisect position or cursor), which is
+		what makes GETBULK requests cheap.
+
+		raises OIDNameError if there is no OID after base
+		"""
+		result = []
+		while len(result) < count:
+			try:
+				oidValue = self.nextOID( base )
+			except errors.OIDNameError, err:
+				if not result:
+					raise
+				break
+			result.append( oidValue )
+			base = oidValue[0]
+		return result
 	def validateSetValue( self, oid, value, request, address, implementation ):
 		"""Validate that given oid & value can be set
 
@@ -46,7 +77,7 @@ class OIDStore:
 		"""Set the given oid,value pair, returning old value
 
 		This method is responsible for implementing the SET
-		request.
+		request, implementations must increment self.version
 		"""
 
 	def update( self, valueSet ):
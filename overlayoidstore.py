@@ -0,0 +1,154 @@
+"""OIDStore presenting per-device values over a shared base store"""
+from __future__ import generators
+import bisect
+from twistedsnmp import oidstore, errors
+from twistedsnmp.bisectoidstore import oidToSortable, sortableToOID
+
+class OverlayOIDStore(oidstore.OIDStore):
+	"""OIDStore layering a few local values over a shared base store
+
+	Intended for simulating many similar devices, where one (large)
+	base store holds the template device's values and each device
+	has an overlay holding only the values which differ (sysName,
+	addresses, counters, etc.).  Values set on the overlay (including
+	via SET requests) never modify the base store.
+
+	Overlay values normally replace values present in the base
+	store, OIDs only present in the overlay are served as well,
+	walks continue across them into the base store's OIDs (see
+	sharedOIDs).
+
+	As for BisectOIDStore, overlay values may be callable, with
+	signature:
+		def callableValue( oid, storage ):
+			return finalValue
+	"""
+	def __init__( self, base, OIDs=None ):
+		"""Initialise the overlay
+
+		base -- OIDStore shared by all devices
+		OIDs -- device-specific values, as for OIDStore.update
+		"""
+		self.base = base
+		self.OIDs = []
+		self.changes = 0
+		self.calculated = False
+		self.update( OIDs )
+	def getVersion( self ):
+		"""Get combined version of overlay and base store"""
+		return self.changes + getattr( self.base, 'version', 0 )
+	version = property( getVersion )
+	def getVolatile( self ):
+		"""Are overlay or base store values volatile?"""
+		return self.calculated or getattr( self.base, 'volatile', True )
+	volatile = property( getVolatile )
+	def getExactOID( self, base ):
+		"""Get the given OID,value pair for the given base
+
+		Overlay values take precedence over base store values.
+		"""
+		key = oidToSortable( base )
+		start = bisect.bisect( self.OIDs, (key,) )
+		if start < len(self.OIDs) and self.OIDs[start][0] == key:
+			return sortableToOID(key), self.returnValue( self.OIDs[start][1], key )
+		return self.base.getExactOID( base )
+	def setValue( self, oid, value ):
+		"""Set the given oid,value pair in the overlay, returning old value"""
+		key = oidToSortable( oid )
+		if callable( value ):
+			self.calculated = True
+		self.changes += 1
+		start = bisect.bisect( self.OIDs, (key,) )
+		if start < len(self.OIDs) and self.OIDs[start][0] == key:
+			old = self.OIDs[start][1]
+			self.OIDs[start] = (key,value)
+			return old
+		self.OIDs.insert( start, (key,value) )
+		try:
+			return self.base.getExactOID( oid )[1]
+		except errors.OIDNameError, err:
+			return None
+	def firstOID( self ):
+		"""Retrieve the first OID,value pair for the storage
+
+		Raises OIDNameError if there are no pairs available
+		"""
+		try:
+			oid,value = self.base.firstOID()
+		except errors.OIDNameError, err:
+			if not self.OIDs:
+				raise
+			key,value = self.OIDs[0]
+			return sortableToOID(key), self.returnValue( value, key )
+		if self.OIDs and self.OIDs[0][0] <= oidToSortable( oid ):
+			key,value = self.OIDs[0]
+			return sortableToOID(key), self.returnValue( value, key )
+		return oid,value
+	def nextOID( self, base ):
+		"""Get next OID,value pair after given base OID"""
+		return self.nextOIDs( base, 1 )[0]
+	def nextOIDs( self, base, count ):
+		"""Get up to count OID,value pairs following base OID
+
+		Range-scans the base store, then merges in the overlay's
+		values from the same range.
+
+		raises OIDNameError if there is no OID after base
+		"""
+		key = oidToSortable( base )
+		failure = None
+		try:
+			shared = self.sharedOIDs( base, count )
+		except errors.OIDNameError, err:
+			shared = []
+			failure = err
+		start = bisect.bisect( self.OIDs, (key,) )
+		if start < len(self.OIDs) and self.OIDs[start][0] == key:
+			start += 1
+		local = self.OIDs[start:start+count]
+		if not local:
+			if failure is not None:
+				raise failure
+			return shared
+		result = []
+		shared = [ (oidToSortable(oid),value) for (oid,value) in shared ]
+		i = j = 0
+		while len(result) < count and (i < len(shared) or j < len(local)):
+			if j >= len(local) or (i < len(shared) and shared[i][0] < local[j][0]):
+				oid,value = shared[i]
+				result.append( (sortableToOID(oid),value) )
+				i += 1
+			else:
+				oid,value = local[j]
+				if i < len(shared) and shared[i][0] == oid:
+					# overlay replaces the base store's value
+					i += 1
+				result.append( (sortableToOID(oid),self.returnValue( value, oid )) )
+				j += 1
+		return result
+	def sharedOIDs( self, base, count ):
+		"""Get up to count OID,value pairs following base from the base store
+
+		BisectOIDStore refuses GETNEXT from OIDs which it doesn't
+		hold (or prefix), such as overlay-only OIDs, in which case
+		the scan restarts from the base store's first OID after base.
+		"""
+		try:
+			return self.base.nextOIDs( base, count )
+		except errors.OIDNameError, err:
+			if not hasattr( self.base, 'firstOIDAfter' ):
+				raise
+			first = self.base.firstOIDAfter( base )
+			if count <= 1:
+				return [first]
+			try:
+				return [first] + self.base.nextOIDs( first[0], count-1 )
+			except errors.OIDNameError, err:
+				return [first]
+	def returnValue( self, value, oid ):
+		"""Return value, or value( oid, self ) for callable values"""
+		if callable( value ):
+			return value( sortableToOID(oid), self )
+		return value
+	def close( self ):
+		"""Close the overlay (the shared base store is left open)"""
@@ -0,0 +1,273 @@
+"""Recurring (periodic) polling of large numbers of agents
+
+The MassRetriever wraps a single query, periodic collection with it
+means rebuilding the retriever every interval and polling every agent
+in a single burst.  The PollScheduler is long-lived, each agent is
+registered (add) with its OIDs, tables and polling interval, and the
+scheduler spreads the polls for each interval evenly (with a little
+random jitter) across the interval, so that load on the network and
+the collector is smooth rather than bursty.
+
+Each poll has a deadline, the start of the agent's next poll.  Polls
+which are still running at their deadline cause the next poll to be
+skipped (an "overrun"), and polls which the scheduler could not start
+until too close to their deadline (e.g. because the reactor was
+blocked) are skipped as "late".  Skipped polls are reported through
+skipCallback so they can be flagged in the collected data.
+
+Polls are run through single-agent MassRetrievers, so results (and
+failures, as None values) have the same form as for MassRetriever.
+Request caching is enabled on the scheduled proxies while they are
+being polled, so the encoded get requests are reused across cycles,
+each proxy's previous allowCache setting is restored once its last
+job is removed.
+"""
+from __future__ import nested_scopes
+from twisted.internet import reactor
+from twistedsnmp import massretriever
+from twistedsnmp.logs import massretriever_log as log
+import time, random, heapq, bisect
+
+# fractional part of the golden ratio, successive multiples are
+# (nearly) evenly spread over [0,1) however many there are
+SPREAD = 0.6180339887498949
+OVERRUN = 'overrun'
+LATE = 'late'
+
+class PollJob( object ):
+	"""Record of a single agent's recurring poll
+
+	attributes:
+		proxy -- the AgentProxy being polled
+		oids, tables -- OIDs and tables retrieved on each poll
+		interval -- seconds between successive polls
+		named -- extra arguments for the proxy's get/getTable
+		phase -- index of the job's slot among jobs with the same
+			interval (see PollScheduler.add)
+		nextDue -- time at which the next poll is scheduled (without
+			jitter), polls are scheduled at nextDue + interval
+			afterwards so jitter does not accumulate
+		running -- the MassRetriever for the poll in progress, or None
+		polls, skipped, overruns, late -- statistics counts
+		lastStart, lastDuration -- timing of the last completed poll
+		worstCase -- estimated time for a poll which times out on
+			every retry, polls longer than interval will overrun
+	"""
+	running = None
+	lastStart = None
+	lastDuration = None
+	active = True
+	def __init__( self, proxy, oids, tables, interval, named ):
+		"""Initialise the job (see PollScheduler.add)"""
+		self.proxy = proxy
+		self.oids = oids
+		self.tables = tables
+		self.interval = interval
+		self.named = named
+		self.polls = 0
+		self.skipped = 0
+		self.overruns = 0
+		self.late = 0
+		timeout = named.get( 'timeout', 2.0 )
+		worstCase = 0.0
+		for retry in range( named.get( 'retryCount', 4 ) + 1 ):
+			worstCase += timeout
+			timeout *= 1.5
+		self.worstCase = worstCase
+	def __repr__( self ):
+		"""Get nice representation of the job"""
+		return """%s(%r, %s)"""%(
+			self.__class__.__name__, self.proxy, self.interval,
+		)
+
+class PollScheduler( object ):
+	"""Long-lived scheduler running recurring polls of agents
+
+	A single reactor timer is used for the whole scheduler, set for
+	the earliest due poll.
+	"""
+	def __init__(
+		self, resultCallback=None, skipCallback=None,
+		jitter=0.05, lateFraction=0.5, breaker=None,
+	):
+		"""Initialise the scheduler
+
+		resultCallback -- called as resultCallback( job, valueSet )
+			with the { queriedOID: dataValues } result of each poll
+		skipCallback -- called as skipCallback( job, reason ) for
+			each skipped poll, reason is OVERRUN or LATE
+		jitter -- fraction of an interval by which each poll may be
+			randomly moved (in either direction) from its slot
+		lateFraction -- fraction of the interval after which a poll
+			which could not be started is skipped as LATE
+		breaker -- optional massretriever.CircuitBreaker shared by
+			all polls, so agents which repeatedly time out are only
+			probed until they answer
+		"""
+		self.resultCallback = resultCallback
+		self.skipCallback = skipCallback
+		self.jitter = jitter
+		self.lateFraction = lateFraction
+		self.breaker = breaker
+		self.jobs = []
+		self.queue = []
+		self.phases = {} # {interval: slots allocated}
+		self.freePhases = {} # {interval: [sorted slots of removed jobs]}
+		self.cacheSettings = {} # {id(proxy): [jobCount, previous allowCache]}
+		self.timer = None
+		self.running = False
+	def add( self, proxy, oids=(), tables=(), interval=60.0, **named ):
+		"""Add an agent to be polled every interval seconds
+
+		proxy -- AgentProxy for the agent, request caching is
+			enabled on the proxy (until its last job is removed)
+			so encoded requests are reused
+		oids -- individual (get) oids for the agent
+		tables -- multi-value (getTable) oids for the agent
+		interval -- seconds between polls
+		** named -- passed to proxy object's get and getTable
+			methods, so retryCount and timeout can be specified
+
+		The first poll is placed at a phase within the interval
+		chosen to keep all agents with the same interval evenly
+		spread however many are added.  Removing a job doesn't move
+		the remaining jobs, instead its slot is re-used by the next
+		job added with the same interval, so the spread is kept as
+		jobs are replaced.
+
+		returns the new PollJob
+		raises ValueError if neither oids or tables specified
+		"""
+		if not oids and not tables:
+			raise ValueError( """Nothing specified to be retrieved""" )
+		setting = self.cacheSettings.get( id(proxy) )
+		if setting is None:
+			setting = self.cacheSettings[ id(proxy) ] = [0, proxy.allowCache]
+		setting[0] += 1
+		proxy.allowCache = True
+		job = PollJob( proxy, oids, tables, float(interval), named )
+		if job.worstCase > job.interval:
+			log.warn(
+				"""Polls of %r may take %.1fs (timeouts), longer than interval %.1fs""",
+				proxy, job.worstCase, job.interval,
+			)
+		free = self.freePhases.get( job.interval )
+		if free:
+			job.phase = free.pop( 0 )
+		else:
+			job.phase = self.phases.get( job.interval, 0 )
+			self.phases[ job.interval ] = job.phase + 1
+		phase = ((job.phase * SPREAD) % 1.0) * job.interval
+		job.nextDue = time.time() + phase
+		self.jobs.append( job )
+		self.schedule( job )
+		return job
+	def remove( self, job ):
+		"""Stop polling the given job's agent
+
+		A poll in progress is allowed to complete, but its results
+		are not reported.  The job's phase slot is freed for re-use
+		and once the proxy has no remaining jobs its allowCache
+		setting is restored.
+		"""
+		job.active = False
+		try:
+			self.jobs.remove( job )
+		except ValueError:
+			return
+		bisect.insort( self.freePhases.setdefault( job.interval, [] ), job.phase )
+		setting = self.cacheSettings.get( id(job.proxy) )
+		if setting is not None:
+			setting[0] -= 1
+			if not setting[0]:
+				del self.cacheSettings[ id(job.proxy) ]
+				job.proxy.allowCache = setting[1]
+	def start( self ):
+		"""Start (or resume) polling"""
+		self.running = True
+		self.reschedule()
+	def stop( self ):
+		"""Stop polling, polls in progress are allowed to complete"""
+		self.running = False
+		if self.timer is not None and self.timer.active():
+			self.timer.cancel()
+		self.timer = None
+
+	def schedule( self, job ):
+		"""Queue the job's next poll (with jitter) and update our timer"""
+		when = job.nextDue
+		if self.jitter:
+			when += random.uniform( -self.jitter, self.jitter ) * job.interval
+		heapq.heappush( self.queue, (when, id(job), job) )
+		self.reschedule()
+	def reschedule( self ):
+		"""Set our timer for the earliest queued poll"""
+		if not self.running or not self.queue:
+			return
+		when = self.queue[0][0]
+		delay = max((0.0, when - time.time()))
+		if self.timer is not None and self.timer.active():
+			if self.timer.getTime() <= when:
+				return
+			self.timer.cancel()
+		self.timer = reactor.callLater( delay, self.runDue )
+	def runDue( self ):
+		"""Start all polls which are now due"""
+		self.timer = None
+		now = time.time()
+		queue = self.queue
+		while queue and queue[0][0] <= now:
+			when, key, job = heapq.heappop( queue )
+			if not job.active:
+				continue
+			due = job.nextDue
+			job.nextDue = due + job.interval
+			if job.nextDue <= now:
+				# the reactor was blocked for more than an interval,
+				# don't try to catch up on the missed polls
+				missed = int( (now - job.nextDue) / job.interval ) + 1
+				job.nextDue += missed * job.interval
+			if job.running is not None:
+				job.overruns += 1
+				self.skip( job, OVERRUN )
+			elif now - due > job.interval * self.lateFraction:
+				job.late += 1
+				self.skip( job, LATE )
+			else:
+				self.poll( job, now )
+			self.schedule( job )
+		self.reschedule()
+	def skip( self, job, reason ):
+		"""Record and report a skipped poll"""
+		job.skipped += 1
+		log.info( """Skipping %s poll of %r""", reason, job.proxy )
+		if self.skipCallback is not None:
+			self.skipCallback( job, reason )
+	def poll( self, job, now ):
+		"""Start a single poll of the job's agent"""
+		job.polls += 1
+		job.lastStart = now
+		retriever = massretriever.MassRetriever(
+			[job.proxy], concurrency=1, breaker=self.breaker,
+		)
+		job.running = retriever
+		d = retriever( oids=job.oids, tables=job.tables, **job.named )
+		d.addCallback( self.pollComplete, job, retriever )
+		return d
+	def pollComplete( self, result, job, retriever ):
+		"""Handle completion of a single poll"""
+		if job.running is retriever:
+			job.running = None
+			job.lastDuration = time.time() - job.lastStart
+		if not job.active:
+			return result
+		valueSet = result.get( (job.proxy.ip,job.proxy.port), {} )
+		if self.resultCallback is not None:
+			try:
+				self.resultCallback( job, valueSet )
+			except Exception, err:
+				log.error(
+					"""Result callback for %r failed: %s""",
+					job.proxy, log.getException( err ),
+				)
+		return result
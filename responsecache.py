@@ -0,0 +1,296 @@
+"""Cache of encoded agent responses
+
+Agents answering the same GET/GETNEXT/GETBULK queries from many
+managers spend most of their time rebuilding the variables, coercing
+their types and re-encoding the response.  The ResponseCache stores
+each encoded response, less its request id, keyed on the request
+(version, community, PDU type, variable OIDs and bulk repetitions).
+On a hit the cached body is wrapped with the new request's id, which
+only requires re-encoding the few header bytes.
+
+The cache is invalidated whenever the agent's OIDStore version
+counter changes (setValue increments it).  Stores with volatile
+values (e.g. calculated values) are never cached.
+
+The RetransmitCache is used by the AgentProtocol to recognise
+requests retransmitted by a manager (same source address, request
+id and datagram) within a short time, replaying the response
+already sent rather than executing the request again.
+"""
+import time
+from twistedsnmp.logs import agentprotocol_log as log
+
+RESPONSE_TAG = '\xa2'
+INFORM_TAG = '\xa6'
+SEQUENCE_TAG = '\x30'
+INTEGER_TAG = '\x02'
+
+def encodeLength( length ):
+	"""BER-encode a length field"""
+	if length < 0x80:
+		return chr(length)
+	result = []
+	while length:
+		result.insert( 0, chr(length & 0xff) )
+		length >>= 8
+	return chr( 0x80 | len(result) ) + ''.join(result)
+
+def encodeTLV( tag, content ):
+	"""BER-encode tag, length and content"""
+	return tag + encodeLength( len(content) ) + content
+
+def encodeInteger( value ):
+	"""BER-encode an INTEGER"""
+	value = long(value)
+	result = []
+	while 1:
+		result.insert( 0, chr(int(value & 0xff)) )
+		if -0x80 <= value <= 0x7f:
+			break
+		value >>= 8
+	return encodeTLV( INTEGER_TAG, ''.join(result) )
+
+def decodeHeader( data, offset ):
+	"""Decode the BER tag/length at offset
+
+	returns (tag, contentStart, contentEnd)
+	"""
+	tag = data[offset]
+	length = ord(data[offset+1])
+	offset += 2
+	if length & 0x80:
+		count = length & 0x7f
+		length = 0
+		for byte in data[offset:offset+count]:
+			length = (length << 8) | ord(byte)
+		offset += count
+	return tag, offset, offset+length
+
+def decodeMessage( message ):
+	"""Locate the fields of an encoded SNMPv1/v2c message
+
+	returns (pduTag, start, communityEnd, pduEnd, idStart, idEnd)
+	giving the offsets of the message content, the end of the
+	community field, the end of the PDU and the request-id content
+	"""
+	tag, start, end = decodeHeader( message, 0 )
+	tag, versionStart, versionEnd = decodeHeader( message, start )
+	tag, communityStart, communityEnd = decodeHeader( message, versionEnd )
+	pduTag, pduStart, pduEnd = decodeHeader( message, communityEnd )
+	tag, idStart, idEnd = decodeHeader( message, pduStart )
+	if tag != INTEGER_TAG:
+		raise ValueError( """No request id in message""" )
+	return pduTag, start, communityEnd, pduEnd, idStart, idEnd
+
+def requestID( message ):
+	"""Get the request id of encoded message (None if undecodable)"""
+	try:
+		tag, start, communityEnd, pduEnd, idStart, idEnd = decodeMessage( message )
+	except (ValueError,IndexError), err:
+		return None
+	content = message[idStart:idEnd]
+	value = 0L
+	for byte in content:
+		value = (value << 8) | ord(byte)
+	if content and ord(content[0]) & 0x80:
+		value -= 1L << (8*len(content))
+	return int(value)
+
+def splitResponse( message ):
+	"""Split encoded response message around its request id
+
+	returns (head, tail) where head is the encoded version and
+	community and tail is the encoded error-status, error-index
+	and variable bindings
+	"""
+	tag, start, communityEnd, pduEnd, idStart, idEnd = decodeMessage( message )
+	if tag != RESPONSE_TAG:
+		raise ValueError( """Not a response PDU: %r"""%(tag,))
+	return message[start:communityEnd], message[idEnd:pduEnd]
+
+def joinMessage( head, tag, requestID, tail ):
+	"""Build encoded message with PDU tag from head and tail for requestID"""
+	return encodeTLV(
+		SEQUENCE_TAG,
+		head + encodeTLV( tag, encodeInteger( requestID ) + tail ),
+	)
+
+def joinResponse( head, requestID, tail ):
+	"""Build encoded response from cached head and tail for requestID"""
+	return joinMessage( head, RESPONSE_TAG, requestID, tail )
+
+def replaceRequestID( message, requestID ):
+	"""Get copy of encoded message with the given request id"""
+	tag, start, communityEnd, pduEnd, idStart, idEnd = decodeMessage( message )
+	return joinMessage(
+		message[start:communityEnd], tag, requestID, message[idEnd:pduEnd],
+	)
+
+class ResponseCache( object ):
+	"""Bounded cache of encoded responses, invalidated by store version
+
+	attributes:
+		maxEntries -- maximum number of cached responses
+		hits, misses -- statistics counts
+	"""
+	def __init__( self, maxEntries=1024 ):
+		"""Initialise the cache
+
+		maxEntries -- maximum number of cached responses, when full
+			an arbitrary entry is discarded for each new entry
+		"""
+		self.maxEntries = maxEntries
+		self.entries = {}
+		self.version = None
+		self.hits = 0
+		self.misses = 0
+	def key( self, request, implementation, requestType ):
+		"""Calculate cache key for request
+
+		requestType -- name of the Agent method answering the
+			request (get, getNext or getTable)
+		"""
+		pdu = request.apiGenGetPdu()
+		oids = tuple([ str(key) for (key,value) in pdu.apiGenGetVarBind() ])
+		if requestType == 'getTable':
+			repetitions = (
+				pdu.apiGenGetNonRepeaters(),
+				pdu.apiGenGetMaxRepetitions(),
+			)
+		else:
+			repetitions = None
+		return (
+			implementation.__name__,
+			request.apiGenGetCommunity(),
+			requestType, oids, repetitions,
+		)
+	def checkVersion( self, store ):
+		"""Clear the cache if store has changed
+
+		returns false if the store can't be cached at all
+		"""
+		if getattr( store, 'volatile', True ):
+			return False
+		version = getattr( store, 'version', None )
+		if version != self.version:
+			self.entries.clear()
+			self.version = version
+		return True
+	def lookup( self, key, request, store ):
+		"""Get encoded response for request (or None)"""
+		if key is None or not self.checkVersion( store ):
+			return None
+		entry = self.entries.get( key )
+		if entry is None:
+			self.misses += 1
+			return None
+		self.hits += 1
+		head, tail = entry
+		return joinResponse( head, request.apiGenGetPdu().apiGenGetRequestId(), tail )
+	def store( self, key, message, store ):
+		"""Store encoded response message for key"""
+		if key is None or not self.checkVersion( store ):
+			return
+		try:
+			entry = splitResponse( message )
+		except (ValueError,IndexError,TypeError), err:
+			log.warn( """Unable to cache response: %s""", err )
+			return
+		if len(self.entries) >= self.maxEntries:
+			self.entries.popitem()
+		self.entries[ key ] = entry
+	def clear( self ):
+		"""Discard all cached responses"""
+		self.entries.clear()
+
+class RetransmitCache( object ):
+	"""Short-lived cache of responses to recently-received requests
+
+	Entries are keyed on (address, requestID, hash(datagram)) and
+	expire timeout seconds after the response is sent.  Requests
+	which are retransmitted while the original is still being
+	answered (for up to timeout seconds) are dropped.
+
+	attributes:
+		maxEntries -- maximum number of responses kept
+		timeout -- seconds for which responses are kept
+		hits -- count of retransmissions answered from the cache
+		inFlight -- count of retransmissions dropped because the
+			original request had not yet been answered
+	"""
+	def __init__( self, maxEntries=256, timeout=5.0 ):
+		"""Initialise the cache
+
+		maxEntries -- maximum number of responses kept, the oldest
+			are discarded first
+		timeout -- seconds for which responses are kept
+		"""
+		self.maxEntries = maxEntries
+		self.timeout = timeout
+		self.entries = {}
+		self.order = []
+		self.pending = {}
+		self.hits = 0
+		self.inFlight = 0
+	def received( self, datagram, address ):
+		"""Check newly received datagram for retransmission
+
+		returns (key, response) where response is the encoded
+		response to replay (or '' to drop the datagram, None to
+		process it normally), key is None if the datagram can't
+		be tracked
+		"""
+		id = requestID( datagram )
+		if id is None:
+			return None, None
+		key = (address, id, hash(datagram))
+		self.expire()
+		entry = self.entries.get( key )
+		if entry is not None:
+			self.hits += 1
+			return key, entry[1]
+		pending = self.pending.get( key[:2] )
+		if pending is not None and pending[1] == key:
+			if pending[0] >= time.time() - self.timeout:
+				self.inFlight += 1
+				return key, ''
+			# original was never answered (e.g. bad community), so
+			# process the retransmission as a new request
+		if len(self.pending) >= self.maxEntries:
+			self.prunePending()
+		self.pending[ key[:2] ] = (time.time(), key)
+		return key, None
+	def sent( self, response, address ):
+		"""Record encoded response sent to address"""
+		pending = self.pending.pop( (address, requestID( response )), None )
+		if pending is None:
+			return
+		key = pending[1]
+		now = time.time()
+		self.entries[ key ] = (now, response)
+		self.order.append( (now, key) )
+		while len(self.entries) > self.maxEntries:
+			self.discard()
+	def expire( self ):
+		"""Discard responses older than self.timeout"""
+		horizon = time.time() - self.timeout
+		while self.order and self.order[0][0] < horizon:
+			self.discard()
+	def prunePending( self ):
+		"""Forget requests which were never answered
+
+		Requests are also recorded before the protocol checks their
+		community, so some will never be answered.
+		"""
+		horizon = time.time() - self.timeout
+		for key,(received,requestKey) in self.pending.items():
+			if received < horizon:
+				del self.pending[ key ]
+		if len(self.pending) >= self.maxEntries:
+			self.pending.clear()
+	def discard( self ):
+		"""Discard the oldest response"""
+		sent, key = self.order.pop( 0 )
+		entry = self.entries.get( key )
+		if entry is not None and entry[0] == sent:
+			del self.entries[ key ]
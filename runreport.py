@@ -0,0 +1,249 @@
+"""Per-agent timing and traffic report for mass retrievals
+
+A RunReport passed to a MassRetriever (report=) records for each
+agent the wall time from dispatch to completion, the number of
+requests and responses and the bytes sent and received (via the
+SNMPProtocol's monitor hook), and the outcome of the retrieval.
+summary() then produces percentiles of the agent times, throughput
+over the run and the slowest agents, so that the devices which make
+poll cycles overrun can be found.  The records and summary can be
+written to a JSON-lines file with writeJSONL.
+"""
+import time
+try:
+	import json
+except ImportError:
+	try:
+		import simplejson as json
+	except ImportError:
+		json = None
+
+SUCCESS = 'success'
+PARTIAL = 'partial'
+FAILED = 'failed'
+
+class AgentRecord( object ):
+	"""Timing/traffic record for a single agent in a run
+
+	attributes:
+		key -- (ip,port) of the agent
+		start, end -- wall-clock dispatch and completion times
+		requests, responses -- datagrams sent to/received from agent
+		bytesSent, bytesReceived -- total datagram sizes
+		outcome -- SUCCESS, PARTIAL (some values None) or FAILED
+	"""
+	end = None
+	outcome = None
+	def __init__( self, key, start ):
+		"""Initialise the record for agent key dispatched at start"""
+		self.key = key
+		self.start = start
+		self.requests = 0
+		self.responses = 0
+		self.bytesSent = 0
+		self.bytesReceived = 0
+	def getDuration( self ):
+		"""Get seconds from dispatch to completion (None if incomplete)"""
+		if self.end is None:
+			return None
+		return self.end - self.start
+	duration = property( getDuration )
+	def getTimeouts( self ):
+		"""Get requests which were never answered (timed out)
+
+		Each answered request produces one response, so requests
+		without a response are the attempts which cost a timeout
+		(a late answer to a retried request is counted as a
+		response).  For an agent which never answers this
+		includes the final attempt as well as the retries.
+		"""
+		return max((0,self.requests - self.responses))
+	timeouts = property( getTimeouts )
+	def asDict( self ):
+		"""Get the record as a simple (serialisable) dictionary"""
+		return {
+			'ip': self.key[0],
+			'port': self.key[1],
+			'start': self.start,
+			'duration': self.duration,
+			'requests': self.requests,
+			'responses': self.responses,
+			'timeouts': self.timeouts,
+			'bytesSent': self.bytesSent,
+			'bytesReceived': self.bytesReceived,
+			'outcome': self.outcome,
+		}
+
+class ChainedMonitor( object ):
+	"""Protocol monitor passing traffic to a report and a previous monitor"""
+	def __init__( self, report, previous ):
+		"""Initialise the chain
+
+		report -- RunReport recording the traffic
+		previous -- monitor installed before the report's
+		"""
+		self.report = report
+		self.previous = previous
+	def sent( self, address, size ):
+		"""Protocol monitor callback for sent datagrams"""
+		self.report.sent( address, size )
+		self.previous.sent( address, size )
+	def received( self, address, size ):
+		"""Protocol monitor callback for received datagrams"""
+		self.report.received( address, size )
+		self.previous.received( address, size )
+
+def percentile( values, fraction ):
+	"""Get nearest-rank percentile (0.0-1.0) from sorted values"""
+	if not values:
+		return None
+	index = int( round( fraction * (len(values)-1) ) )
+	return values[ index ]
+
+class RunReport( object ):
+	"""Structured report of a MassRetriever run
+
+	Agents sharing an (ip,port) share a single record.  The
+	report installs itself as the monitor of the protocols of
+	the agents it records, so traffic from other users of the
+	same protocol to those agents will be included.  A monitor
+	already installed on a protocol is chained (see
+	ChainedMonitor) and restored when the run finishes.
+	"""
+	def __init__( self ):
+		"""Initialise the (empty) report"""
+		self.records = {}
+		self.start = time.time()
+		self.end = None
+		self.protocols = {}
+	def agentStarted( self, proxy ):
+		"""Record dispatch of the agent proxy"""
+		key = proxy.ip,proxy.port
+		record = self.records.get( key )
+		if record is None:
+			self.records[ key ] = AgentRecord( key, time.time() )
+		protocol = proxy.protocol
+		if protocol is not None and not self.protocols.has_key( id(protocol) ):
+			previous = getattr( protocol, 'monitor', None )
+			if previous is None:
+				monitor = self
+			else:
+				monitor = ChainedMonitor( self, previous )
+			self.protocols[ id(protocol) ] = (protocol, monitor, previous)
+			protocol.monitor = monitor
+	def agentFinished( self, proxy, valueSet ):
+		"""Record completion of the agent proxy
+
+		valueSet -- the agent's { queriedOID: dataValues } result,
+			used to determine the outcome
+		"""
+		record = self.records.get( (proxy.ip,proxy.port) )
+		if record is None:
+			return
+		record.end = time.time()
+		values = (valueSet or {}).values()
+		failures = len([ v for v in values if v is None ])
+		if not values or failures == len(values):
+			record.outcome = FAILED
+		elif failures:
+			record.outcome = PARTIAL
+		else:
+			record.outcome = SUCCESS
+	def finished( self ):
+		"""Record the end of the run, restoring previous protocol monitors"""
+		self.end = time.time()
+		for protocol, monitor, previous in self.protocols.values():
+			if protocol.monitor is monitor:
+				protocol.monitor = previous
+		self.protocols = {}
+	def sent( self, address, size ):
+		"""Protocol monitor callback for sent datagrams"""
+		record = self.records.get( address )
+		if record is not None:
+			record.requests += 1
+			record.bytesSent += size
+	def received( self, address, size ):
+		"""Protocol monitor callback for received datagrams"""
+		record = self.records.get( address )
+		if record is not None:
+			record.responses += 1
+			record.bytesReceived += size
+
+	def summary(
+		self, percentiles=(.5,.9,.95,.99), bucket=1.0, slowest=10,
+	):
+		"""Produce summary of the run as a dictionary
+
+		percentiles -- fractions for which to report agent durations
+		bucket -- seconds per throughput bucket
+		slowest -- number of slowest agents to report
+
+		returns dictionary with keys:
+			agents -- number of agents recorded
+			outcomes -- { outcome: count }
+			elapsed -- seconds for the whole run
+			durations -- { 'p50': seconds, ... } agent durations
+			requests, responses, timeouts -- totals
+			bytesSent, bytesReceived -- totals
+			throughput -- [ (offset, agentsCompleted), ... ] for each
+				bucket seconds from the start of the run
+			slowest -- AgentRecord.asDict() for the slowest agents
+		"""
+		records = self.records.values()
+		outcomes = {}
+		for record in records:
+			outcomes[ record.outcome ] = outcomes.get( record.outcome, 0 ) + 1
+		complete = [ r for r in records if r.end is not None ]
+		durations = [ r.duration for r in complete ]
+		durations.sort()
+		duration = {}
+		for fraction in percentiles:
+			duration[ 'p%g'%(fraction*100) ] = percentile( durations, fraction )
+		if durations:
+			duration[ 'max' ] = durations[-1]
+		buckets = {}
+		for record in complete:
+			index = int( (record.end - self.start) / bucket )
+			buckets[ index ] = buckets.get( index, 0 ) + 1
+		throughput = []
+		if buckets:
+			for index in range( max(buckets.keys()) + 1 ):
+				throughput.append( (index*bucket, buckets.get( index, 0 )) )
+		decorated = [ (r.duration,r.key,r) for r in complete ]
+		decorated.sort()
+		decorated.reverse()
+		end = self.end or time.time()
+		def total( name ):
+			return sum([ getattr( r, name ) for r in records ])
+		return {
+			'agents': len(records),
+			'outcomes': outcomes,
+			'elapsed': end - self.start,
+			'durations': duration,
+			'requests': total( 'requests' ),
+			'responses': total( 'responses' ),
+			'timeouts': total( 'timeouts' ),
+			'bytesSent': total( 'bytesSent' ),
+			'bytesReceived': total( 'bytesReceived' ),
+			'throughput': throughput,
+			'slowest': [ r.asDict() for (d,k,r) in decorated[:slowest] ],
+		}
+	def writeJSONL( self, filename, **named ):
+		"""Write per-agent records and summary to JSON-lines file
+
+		filename -- file to which to write, one line per agent
+			record, followed by a line { "summary": summary }
+		** named -- passed to summary
+
+		raises ImportError if no json (or simplejson) module is
+		available
+		"""
+		if json is None:
+			raise ImportError( """Require the json or simplejson module to write JSONL reports""" )
+		file = open( filename, 'w' )
+		try:
+			for record in self.records.values():
+				file.write( json.dumps( record.asDict() ) + '\n' )
+			file.write( json.dumps( {'summary': self.summary( **named )} ) + '\n' )
+		finally:
+			file.close()
@@ -0,0 +1,150 @@
+"""Simulation of many virtual agents from a single process
+
+For load-testing managers/pollers against large fleets of devices
+without an AgentProtocol, Agent and full OIDStore for each device.
+Each virtual device is an Agent serving an OverlayOIDStore which
+holds only the device's own values (sysName, counters, etc.) over
+a single shared base store.
+
+Requests are routed to the virtual devices by (in order of
+precedence) the manager's source port, the request's community
+string or the (simulator) port on which they were received.
+
+Usage:
+
+	simulator = Simulator( baseStore )
+	for index in range( 10000 ):
+		simulator.addDevice(
+			community = 'device%s'%(index,),
+			OIDs = { '.1.3.6.1.2.1.1.5.0': 'device%s'%(index,) },
+		)
+	simulator.listen( 161 )
+"""
+from twisted.internet import reactor
+from twistedsnmp import agent, agentprotocol, overlayoidstore
+from twistedsnmp.logs import agentprotocol_log as log
+
+class SimulatorProtocol( agentprotocol.AgentProtocol ):
+	"""AgentProtocol dispatching requests to a Simulator's devices"""
+	def __init__(
+		self, simulator, interface=None, port=161,
+		snmpVersion='v2', retransmitCache=None,
+	):
+		"""Initialise the protocol
+
+		simulator -- Simulator whose devices we serve
+		interface, port, snmpVersion, retransmitCache -- as for
+			AgentProtocol, community is checked by the simulator
+		"""
+		self.simulator = simulator
+		agentprotocol.AgentProtocol.__init__(
+			self, interface=interface, port=port, community=None,
+			snmpVersion=snmpVersion, retransmitCache=retransmitCache,
+		)
+	def findAgent( self, request, address ):
+		"""Find the virtual device's Agent for request"""
+		device = self.simulator.findDevice(
+			self.port, request.apiGenGetCommunity(), address,
+		)
+		if device is not None:
+			device.setProtocol( self )
+		return device
+
+class Simulator( object ):
+	"""Collection of virtual devices sharing a base OIDStore
+
+	attributes:
+		baseStore -- OIDStore shared by all devices
+		devices -- list of all device Agents
+		byPort, byCommunity, bySource -- routing tables mapping
+			simulator port, community string and manager source
+			port respectively to (device, community), community
+			being None if the device accepts any community
+	"""
+	def __init__( self, baseStore, snmpVersion='v2', responseCache=False ):
+		"""Initialise the simulator
+
+		baseStore -- OIDStore holding the template device's values
+		snmpVersion -- version for the protocols created by listen
+		responseCache -- if true, devices each get a ResponseCache
+		"""
+		self.baseStore = baseStore
+		self.snmpVersion = snmpVersion
+		self.responseCache = responseCache
+		self.devices = []
+		self.byPort = {}
+		self.byCommunity = {}
+		self.bySource = {}
+		self.ports = []
+	def addDevice(
+		self, OIDs=None, port=None, community=None, sourcePort=None,
+	):
+		"""Add a virtual device
+
+		OIDs -- device-specific values, as for OIDStore.update
+		port -- simulator port routed to the device
+		community -- community string routed to the device, if only
+			port or sourcePort are given, the device still only
+			accepts this community (None accepts any)
+		sourcePort -- manager source port routed to the device
+
+		returns the device's Agent
+		"""
+		if port is None and community is None and sourcePort is None:
+			raise ValueError( """Need a port, community or sourcePort to route to device""" )
+		device = agent.Agent(
+			overlayoidstore.OverlayOIDStore( self.baseStore, OIDs ),
+			responseCache = self.responseCache,
+		)
+		for table, key in (
+			(self.byPort, port),
+			(self.byCommunity, community),
+			(self.bySource, sourcePort),
+		):
+			if key is not None:
+				if table.has_key( key ):
+					log.warn( """Replacing simulated device routed by %r""", key )
+				table[ key ] = (device,community)
+		self.devices.append( device )
+		return device
+	def findDevice( self, port, community, address ):
+		"""Find the device for a request
+
+		port -- simulator port on which the request arrived
+		community -- the request's community string
+		address -- (ip,port) of the manager
+
+		returns device Agent or None
+		"""
+		for table, key in (
+			(self.bySource, address[1]),
+			(self.byCommunity, community),
+			(self.byPort, port),
+		):
+			route = table.get( key )
+			if route is not None:
+				device, expected = route
+				if expected is None or expected == community:
+					return device
+				return None
+		return None
+	def listen( self, port, interface='' ):
+		"""Listen for requests on the given port
+
+		returns the twisted port object
+		"""
+		listening = reactor.listenUDP(
+			port,
+			SimulatorProtocol(
+				self, interface=interface, port=port,
+				snmpVersion=self.snmpVersion,
+			),
+			interface = interface,
+		)
+		self.ports.append( listening )
+		return listening
+	def stopListening( self ):
+		"""Stop listening on all of our ports"""
+		for port in self.ports:
+			port.stopListening()
+		self.ports = []
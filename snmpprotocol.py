@@ -23,7 +23,12 @@ class SNMPProtocol(protocol.DatagramProtocol):
 			where request-keys are calculated by our getRequestKey
 			method, df is the defer for callbacks to the request,
 			and timer is the timeout timer for the request.
+		monitor -- optional traffic monitor, if not None, called as
+			monitor.sent( address, size ) and
+			monitor.received( address, size ) for each datagram
+			(see runreport.RunReport)
 	"""
+	monitor = None
 	def __init__(self, port=20000 ):
 		"""Initialize the SNMPProtocol object
 
@@ -45,6 +50,8 @@ class SNMPProtocol(protocol.DatagramProtocol):
 		callback, as the response object is needed for
 		table download and the like.
 		"""
+		if self.monitor is not None:
+			self.monitor.received( address, len(datagram) )
 		response = self.decode(datagram)
 		if response is None:
 			log.warn(
@@ -125,6 +132,8 @@ class SNMPProtocol(protocol.DatagramProtocol):
 		return False
 	def send(self, request, target):
 		"""Send a request (string) to the network"""
+		if self.monitor is not None:
+			self.monitor.sent( target, len(request) )
 		return self.transport.write( request, target )
 		
 	# implementation details...
@@ -2,9 +2,35 @@
 from twisted.internet import defer, protocol, reactor
 from twisted.python import failure
 from twistedsnmp.pysnmpproto import v2c,v1, error, oid, USE_STRING_OIDS
-import traceback, socket, weakref
+from twistedsnmp import twinetables
+import traceback, socket, weakref, time
 from twistedsnmp.logs import tableretriever_log as log
 
+# Policies for handling agents which return non-increasing OIDs
+STRICT = 'strict' # stop walking the column on the first bad OID
+TOLERATE = 'tolerate' # accept up to orderingTolerance bad OIDs per column
+SKIP = 'skip' # continue after the highest OID seen, up to orderingTolerance times
+ORDERING_POLICIES = (STRICT, TOLERATE, SKIP)
+
+def sortableOID( value ):
+	"""Convert an OID value to a tuple of integers for ordering comparisons"""
+	return twinetables.sortableSuffix( oid.OID( value ) )
+
+# largest sub-identifier value allowed by SNMP
+MAX_SUBIDENTIFIER = 4294967295
+
+def successorOID( value ):
+	"""Get dotted OID from which a GETNEXT continues after value
+
+	Appends the largest possible sub-identifier, e.g.
+	.1.3.6.1.2.1.2.2.1.2.3 becomes .1.3.6.1.2.1.2.2.1.2.3.4294967295,
+	so a GETNEXT can't return value again, but does return the
+	OID immediately following it (e.g. .1.3.6.1.2.1.2.2.1.2.4).
+	Only OIDs within value.4294967295 are skipped.
+	"""
+	position = sortableOID( value ) + (MAX_SUBIDENTIFIER,)
+	return '.'+'.'.join( map( str, position ) )
+
 class TableRetriever( object ):
 	"""Object for retrieving an entire table from an SNMP agent
 
@@ -17,11 +43,24 @@ class TableRetriever( object ):
 	# use iterative retrieval even on v2c ports.
 	bulk = 1
 	finished = 0
+	# Microseconds of integration work allowed before yielding to the
+	# reactor, None integrates each response in a single step
+	integrationBudget = None
+	# Number of records integrated between checks of the budget
+	integrationSliceSize = 64
+	integrating = False
+	integrationCount = 0
+	integrationSlices = 0
+	integrationTime = 0.0
+	maxSliceTime = 0.0
+	maxIntegrationLatency = 0.0
 
 	def __init__(
 		self, proxy, roots, includeStart=0,
 		retryCount=4, timeout= 2.0,
-		maxRepetitions=128,
+		maxRepetitions=128, nonRepeaters=(),
+		orderingPolicy=STRICT, orderingTolerance=3,
+		anomalyCallback=None, integrationBudget=None,
 	):
 		"""Initialise the retriever
 
@@ -36,33 +75,100 @@ class TableRetriever( object ):
 			timeout iteration.
 		maxRepetitions -- max records to request with a single
 			bulk request
+		nonRepeaters -- scalar OIDs to be retrieved (get-next) in
+			the first request alongside the table roots, results
+			are reported as { nonRepeaterOID: { oid: value } }
+			in the same mapping as the tables
+		orderingPolicy -- how to handle an agent which returns an
+			OID which does not increase (which would otherwise cause
+			an endless walk), one of:
+				STRICT -- stop walking that column
+				TOLERATE -- accept the OID and continue from it
+				SKIP -- discard the OID and continue the column
+					after the highest OID already retrieved (from its
+					successorOID, so a GETNEXT can't answer with that
+					OID again, while the rows following it are kept)
+		orderingTolerance -- for TOLERATE and SKIP, the number of
+			bad OIDs per column after which we stop walking the column
+		anomalyCallback -- if specified, called as
+			anomalyCallback( root, previousOID, returnedOID )
+			for each non-increasing OID, see orderingAnomaly
+		integrationBudget -- if specified, maximum microseconds to
+			spend integrating results before yielding to the reactor,
+			see integrateQueued
 		"""
+		if orderingPolicy not in ORDERING_POLICIES:
+			raise ValueError( """Unknown orderingPolicy %r, expected one of %s"""%(
+				orderingPolicy, ORDERING_POLICIES,
+			))
 		self.proxy = proxy
 		self.roots = [ oid.OID(r) for r in roots]
+		self.nonRepeaters = [ oid.OID(r) for r in nonRepeaters ]
 		self.includeStart = includeStart
 		self.retryCount = retryCount
 		self.timeout = timeout
 		self.values = {} # {rootOID: {OID: value}} mapping
 		self.maxRepetitions = maxRepetitions
-	def __call__( self, recordCallback=None, startOIDs=None ):
+		self.orderingPolicy = orderingPolicy
+		self.orderingTolerance = orderingTolerance
+		self.anomalyCallback = anomalyCallback
+		self.anomalies = [] # [(root, previousOID, returnedOID)]
+		self.anomalyCounts = {} # {rootOID: count}
+		self.integrationQueue = [] # [[oidValues, rootOIDs, queued, index, found]]
+		if integrationBudget is not None:
+			self.integrationBudget = integrationBudget
+	assembler = None
+	differ = None
+	def __call__(
+		self, recordCallback=None, startOIDs=None, rowCallback=None,
+		snapshot=None, changeCallback=None,
+	):
 		"""Collect results, call recordCallback for each retrieved record
 
 		recordCallback -- called for each new record discovered
 		startOIDs -- optional OID markers to be used as starting point,
 			i.e. if passed in, we retrieve the table from startOIDs to
 			the end of the table.
+		rowCallback -- if specified, the roots are treated as the
+			columns of a single table and rowCallback( suffix, record )
+			is called for each row (see twinetables.RowAssembler) as
+			soon as every column has passed the row's index.  In this
+			mode table values are not accumulated in the result.
+		snapshot -- twinetables.TableSnapshot for the previous poll of
+			the table, or the previous (getTable) result for the table,
+			used with changeCallback.  A TableSnapshot is updated with
+			the new rows when the walk completes.
+		changeCallback -- if specified, rows are assembled as for
+			rowCallback and compared against snapshot, calling
+			changeCallback( change, suffix, record ) for each
+			twinetables.ADDED, CHANGED or REMOVED (record None) row,
+			see twinetables.SnapshotDiffer
 
 		Will use bulk downloading when available (i.e. if
 		we have implementation v2c, not v1) and self.bulk is true.
 
-		return value is a defered for a { rootOID: { oid: value } } mapping
+		return value is a defered for a { rootOID: { oid: value } } mapping,
+		which only includes the non-repeating values in rowCallback mode
 		"""
 		self.recordCallback = recordCallback
+		if changeCallback is not None:
+			if rowCallback is not None:
+				raise ValueError( """Specify only one of rowCallback and changeCallback""" )
+			if snapshot is None:
+				snapshot = twinetables.TableSnapshot()
+			elif not isinstance( snapshot, twinetables.TableSnapshot ):
+				snapshot = twinetables.TableSnapshot.fromTable( snapshot, self.roots )
+			self.differ = rowCallback = snapshot.differ( changeCallback )
+		if rowCallback is not None:
+			self.assembler = twinetables.RowAssembler( self.roots, rowCallback )
 		self.df = defer.Deferred()
-		self.getTable( includeStart= self.includeStart, oids=startOIDs, firstCall=True)
+		self.getTable(
+			includeStart= self.includeStart, oids=startOIDs, firstCall=True,
+			nonRepeaters=self.nonRepeaters,
+		)
 		return self.df
 	if USE_STRING_OIDS:
-		def integrateNewRecord( self, oidValues, rootOIDs ):
+		def integrateRecords( self, oidValues, rootOIDs ):
 			"""Integrate a record-set into the table
 
 			This method is quite simplistic in its approach, it
@@ -89,13 +195,8 @@ class TableRetriever( object ):
 							current[ key ] = value
 							if self.recordCallback is not None and callable(self.recordCallback):
 								self.recordCallback( root, key, value )
-			if self.finished and self.finished < 2:
-				self.finished = 2
-				if getattr(self,'df',None) and not self.df.called:
-					reactor.callLater( 0, self.df.callback, self.values )
-					del self.df
 	else:
-		def integrateNewRecord( self, oidValues, rootOIDs ):
+		def integrateRecords( self, oidValues, rootOIDs ):
 			"""Integrate a record-set into the table
 
 			This method is quite simplistic in its approach, it
@@ -132,22 +233,174 @@ class TableRetriever( object ):
 					else:
 						unmatched.append( (key,value) )
 				remainder = unmatched
-			if self.finished and self.finished < 2:
-				self.finished = 2
-				if getattr(self,'df',None) and not self.df.called:
-					reactor.callLater( 0, self.df.callback, self.values )
-					del self.df
+	def checkFinished( self ):
+		"""If the walk is finished, call back our df with self.values"""
+		if self.finished and self.finished < 2:
+			if self.assembler is not None:
+				self.assembler.finish()
+			if self.differ is not None:
+				self.differ.finish()
+			self.finished = 2
+			log.debug(
+				"""Integrated %s responses in %s slices, %.6fs total, max slice %.6fs, max latency %.6fs""",
+				self.integrationCount, self.integrationSlices,
+				self.integrationTime, self.maxSliceTime,
+				self.maxIntegrationLatency,
+			)
+			if getattr(self,'df',None) and not self.df.called:
+				reactor.callLater( 0, self.df.callback, self.values )
+				del self.df
+	def integrateRows( self, oidValues, rootOIDs, found ):
+		"""Integrate a record-set into our RowAssembler
+
+		Used instead of integrateRecords when retrieving in
+		rowCallback mode.  Table records are handed to the
+		assembler rather than being stored, non-repeating values
+		are stored in self.values as usual.
+
+		found -- dictionary in which to record the columns for
+			which records were found, see completeRows
+		"""
+		callback = None
+		if self.recordCallback and callable( self.recordCallback ):
+			callback = self.recordCallback
+		assembler = self.assembler
+		if USE_STRING_OIDS:
+			OID = self.proxy.getImplementation().ObjectIdentifier
+			prefixes = [ (str(root), OID(str(root))) for root in rootOIDs ]
+			keyType = str
+		else:
+			prefixes = [ (root,root) for root in rootOIDs ]
+			keyType = oid.OID
+		tableRoots = dict([ (root,1) for root in assembler.roots ])
+		for (key,value) in oidValues:
+			key = keyType( key )
+			if isinstance(value, v2c.EndOfMibView):
+				continue
+			for root,prefix in prefixes:
+				if prefix.isaprefix( key ):
+					if tableRoots.has_key( root ):
+						found[ root ] = 1
+						if assembler.addRecord( root, key, value ):
+							if callback is not None:
+								callback( root, key, value )
+					else:
+						current = self.values.get( root )
+						if current is None:
+							self.values[ root ] = current = {}
+						if not current.has_key( key ):
+							current[ key ] = value
+							if callback is not None:
+								callback( root, key, value )
+	def completeRows( self, oidValues, rootOIDs, found ):
+		"""Finish integration of a (whole) response in rowCallback mode
+
+		A column which was not requested, or for which the
+		(non-empty) response has no records, has been exhausted,
+		as every response includes at least one value for each
+		column requested.  Emits all rows which are now complete.
+		"""
+		assembler = self.assembler
+		if USE_STRING_OIDS:
+			requested = dict([ (str(root),1) for root in rootOIDs ])
+		else:
+			requested = dict([ (root,1) for root in rootOIDs ])
+		for root in assembler.roots:
+			if not requested.has_key( root ) or (
+				oidValues and not found.has_key( root )
+			):
+				assembler.finishColumn( root )
+		assembler.flush()
 	def scheduleIntegrate( self, oidValues, rootOIDs ):
 		"""Schedule integration of oidValues into this table's results
 		
 		This breaks up the process so that we can process other events
 		before we do the (heavy) work of integrating the result-table...
+
+		Responses are queued and integrated in order by
+		integrateQueued, which yields back to the reactor whenever
+		self.integrationBudget is exceeded.
 		"""
-		reactor.callLater( 0, self.integrateNewRecord, oidValues, rootOIDs )
+		self.integrationQueue.append( [oidValues, rootOIDs, time.time(), 0, {}] )
+		if not self.integrating:
+			self.integrating = True
+			reactor.callLater( 0, self.integrateQueued )
 		return oidValues
+	def integrateQueued( self ):
+		"""Integrate queued responses within our time budget
+
+		Records are integrated in slices of self.integrationSliceSize,
+		if self.integrationBudget (microseconds) is exceeded after a
+		slice, we reschedule ourselves so that the reactor can process
+		other events (e.g. incoming responses for other requests).
+
+		Updates the integration statistics:
+			integrationCount -- number of responses integrated
+			integrationSlices -- number of (reactor) time-slices used
+			integrationTime -- total seconds spent integrating
+			maxSliceTime -- longest single time-slice in seconds
+			maxIntegrationLatency -- longest delay in seconds between
+				a response being queued and being fully integrated
+		"""
+		started = time.time()
+		deadline = None
+		if self.integrationBudget is not None:
+			deadline = started + self.integrationBudget/1000000.0
+		queue = self.integrationQueue
+		try:
+			try:
+				self.integrateSlices( deadline )
+			except Exception, err:
+				del queue[:]
+				self.integrating = False
+				if getattr(self,'df',None) and not self.df.called:
+					self.df.errback( failure.Failure() )
+					del self.df
+				else:
+					log.warn(
+						"""Unhandled exception integrating results after request completed, ignoring: %s""",
+						log.getException(err),
+					)
+		finally:
+			elapsed = time.time() - started
+			self.integrationSlices += 1
+			self.integrationTime += elapsed
+			self.maxSliceTime = max((self.maxSliceTime, elapsed))
+	def integrateSlices( self, deadline=None ):
+		"""Integrate queued records until done or past deadline (see integrateQueued)"""
+		queue = self.integrationQueue
+		while queue:
+			record = queue[0]
+			oidValues, rootOIDs, queued, index, found = record
+			if deadline is None:
+				end = len(oidValues)
+			else:
+				end = index + self.integrationSliceSize
+			records = oidValues[index:end]
+			if self.assembler is not None:
+				self.integrateRows( records, rootOIDs, found )
+			else:
+				self.integrateRecords( records, rootOIDs )
+			if end >= len(oidValues):
+				del queue[0]
+				if self.assembler is not None:
+					self.completeRows( oidValues, rootOIDs, found )
+				self.integrationCount += 1
+				self.maxIntegrationLatency = max((
+					self.maxIntegrationLatency, time.time() - queued,
+				))
+			else:
+				record[3] = end
+			if deadline is not None and queue and time.time() >= deadline:
+				# yield to the reactor, continue on the next iteration
+				reactor.callLater( 0, self.integrateQueued )
+				return
+		self.integrating = False
+		self.checkFinished()
 	def getTable(
 		self, oids=None, roots=None, includeStart=0,
 		retryCount=None, delay=None, firstCall=False,
+		nonRepeaters=(),
 	):
 		"""Retrieve all sub-oids from these roots
 
@@ -162,6 +415,10 @@ class TableRetriever( object ):
 			request.  We don't cache continuations because they will
 			be different depending on where the iteration happens to
 			break.
+		nonRepeaters -- scalar OIDs still to be retrieved, these are
+			placed at the start of the request (as the GETBULK
+			non-repeaters) and are only sent until they have been
+			answered.
 
 		This is the "walk" example from pysnmp re-cast...
 		"""
@@ -173,12 +430,14 @@ class TableRetriever( object ):
 			oids = self.roots
 		if roots is None:
 			roots = self.roots
+		nonRepeaters = list(nonRepeaters)
 		request = self.proxy.encode(
-			oids,
+			nonRepeaters + list(oids),
 			self.proxy.community,
 			next= not includeStart,
 			bulk = (self.bulk and self.proxy.getImplementation() is v2c),
 			maxRepetitions = self.maxRepetitions,
+			nonRepeaters = len(nonRepeaters),
 			# only want to cache the first request, as all others are 
 			# continuations which might start at any random record
 			allowCache = firstCall,
@@ -204,27 +463,76 @@ class TableRetriever( object ):
 				self.timeout,
 				self.getTable,
 				oids, roots, includeStart,
-				retryCount-1, delay
+				retryCount-1, delay, nonRepeaters=nonRepeaters,
 			)
 			return
 		else:
 			df = defer.Deferred()
 			key = self.proxy.getRequestKey( request )
 
-			df.addCallback( self.areWeDone, roots=roots, request=request )
+			df.addCallback(
+				self.areWeDone, roots=roots, request=request,
+				nonRepeaters=nonRepeaters,
+			)
 			df.addCallback( self.proxy.getResponseResults )
-			df.addCallback( self.scheduleIntegrate, rootOIDs = roots[:] )
+			df.addCallback( self.scheduleIntegrate, rootOIDs = nonRepeaters + roots )
 
 			timer = reactor.callLater(
 				self.timeout,
 				self.tableTimeout,
-				df, key, oids, roots, includeStart, retryCount-1, delay
+				df, key, oids, roots, includeStart, retryCount-1, delay,
+				nonRepeaters,
 			)
 
 			self.proxy.protocol.requests[key] = df, timer
 
 			return df
-	def tableTimeout( self, df, key, oids, roots, includeStart, retryCount, delay ):
+	def continueTable( self, *arguments, **named ):
+		"""Request the next part of the table (see getTable)
+
+		Errors (e.g. failure to encode the request) are passed to
+		our df, rather than being lost in the reactor, which would
+		leave the walk waiting forever.
+		"""
+		try:
+			return self.getTable( *arguments, **named )
+		except Exception, err:
+			if getattr(self,'df',None) and not self.df.called:
+				self.df.errback( failure.Failure() )
+				del self.df
+			else:
+				log.warn(
+					"""Unhandled exception continuing table after request completed, ignoring: %s""",
+					log.getException(err),
+				)
+	def orderingAnomaly( self, root, previous, returned ):
+		"""Record a non-increasing OID returned for root's column
+
+		root -- the root OID of the column being walked
+		previous -- the highest OID previously retrieved for the column
+		returned -- the (not greater) OID returned by the agent
+
+		Appends (root, previous, returned) to self.anomalies and
+		calls self.anomalyCallback (if set) with the same values.
+
+		returns true if the walk of the column may continue
+		"""
+		self.anomalies.append( (root,previous,returned) )
+		count = self.anomalyCounts.get( root, 0 ) + 1
+		self.anomalyCounts[ root ] = count
+		log.warn(
+			"""Agent %r returned non-increasing OID %s after %s walking %s (%s)""",
+			self.proxy, returned, previous, root, count,
+		)
+		if self.anomalyCallback is not None:
+			self.anomalyCallback( root, previous, returned )
+		if self.orderingPolicy == STRICT:
+			return False
+		return count <= self.orderingTolerance
+	def tableTimeout(
+		self, df, key, oids, roots, includeStart, retryCount, delay,
+		nonRepeaters=(),
+	):
 		"""Table timeout implementation
 
 		Table queries timeout if a single retrieval
@@ -238,7 +546,10 @@ class TableRetriever( object ):
 							del self.proxy.protocol.requests[ key ]
 					except KeyError:
 						pass
-					return self.getTable( oids, roots, includeStart, retryCount-1, delay*1.5 )
+					return self.getTable(
+						oids, roots, includeStart, retryCount-1, delay*1.5,
+						nonRepeaters=nonRepeaters,
+					)
 				try:
 					if not self.finished and getattr(self,'df',None):
 						self.df.errback( defer.TimeoutError('SNMP request timed out'))
@@ -254,25 +565,43 @@ class TableRetriever( object ):
 						"""Unhandled exception %r after request completed, ignoring: %s""",
 						log.getException(err),
 					)
-	def areWeDone( self, response, roots, request, recordCallback=None ):
+	def areWeDone(
+		self, response, roots, request, recordCallback=None,
+		nonRepeaters=(),
+	):
 		"""Callback which checks to see if we're done
 
+		nonRepeaters -- the scalar OIDs which were included at the
+			start of request, these are only re-requested if the
+			agent refused to answer the request (v1 noSuchName)
+
 		if not, passes on request & schedules next iteration
 		if so, returns None
 		"""
 		log.debug( """areWeDone response: %s""", response )
 		newOIDs = response.apiGenGetPdu().apiGenGetVarBind()
+		# N is the number of non-repeating (scalar) OIDs at the start of request
+		N = len(nonRepeaters)
+		remainingNonRepeaters = []
 		if response.apiGenGetPdu().apiGenGetErrorStatus():
 			errorIndex = response.apiGenGetPdu().apiGenGetErrorIndex() - 1
 			# SNMP agent (v.1) reports 'no such name' when walk is over
 			repeatingRoots = roots[:]
 			if response.apiGenGetPdu().apiGenGetErrorStatus() == 2:
-				# One of the tables exceeded
-				for l in newOIDs, repeatingRoots:
-					if errorIndex < len(l):
-						del l[errorIndex]
-					else:
-						raise error.ProtoError('Bad ErrorIndex %s vs length of queried items in VarBind in %s' %( errorIndex, response))
+				# nothing was answered, so scalars need to be re-requested
+				remainingNonRepeaters = list(nonRepeaters)
+				newOIDs = newOIDs[N:]
+				if 0 <= errorIndex < N:
+					# One of the scalars doesn't exist, drop it
+					del remainingNonRepeaters[errorIndex]
+				else:
+					# One of the tables exceeded
+					errorIndex -= N
+					for l in newOIDs, repeatingRoots:
+						if errorIndex < len(l):
+							del l[errorIndex]
+						else:
+							raise error.ProtoError('Bad ErrorIndex %s vs length of queried items in VarBind in %s' %( errorIndex, response))
 				# okay, now newOIDs is just the set of old OIDs with the
 				# exhausted ones removed...
 			else:
@@ -283,52 +612,82 @@ class TableRetriever( object ):
 				raise error.ProtoError(errorStatus)
 		else:
 			# The following is taken from RFC1905 (fixed not to depend on repetitions)
-			# N should be retrieved from the response, the non-repeating set
 			# XXX Note, that there seems to be a problem with this
 			# algorithm, it assumes that the repeating OID-set remains
 			# of constant-size.  AFAICS the spec says it should reduce
 			# as each table ends, which makes sense, as you want the remainder
 			# of the OIDs to only be those which are still valid at the end
 			# of the iteration.
-
 			if isinstance( request, v2c.GetBulkRequest ):
-				N = request.apiGenGetPdu().apiGenGetNonRepeaters()
-			else:
-				N = 0
-			assert N == 0, """Not yet sure that non-repeaters are handled correctly!"""
+				assert request.apiGenGetPdu().apiGenGetNonRepeaters() == N, """Request non-repeaters count doesn't match the non-repeating OIDs"""
 			# R is the number of repeating OIDs
-			R = len(roots) - N
-			# Leave the last instance of each requested repeating OID
-			newOIDs = newOIDs[-R:]
-
-			# Exclude completed var-binds
-			repeatingRoots = roots[-R:]
+			R = len(roots)
+			rows = newOIDs[N:]
+			starts = request.apiGenGetPdu().apiGenGetVarBind()[N:]
+			# a GET (includeStart) returns the starting OIDs themselves
+			inclusive = request['pdu'].keys()[0] == 'get_request'
+			ObjectIdentifier = self.proxy.getImplementation().ObjectIdentifier
+			# indices of varbinds which are not to be integrated
+			rejected = {}
+			# Leave the last (good) instance of each requested repeating OID,
+			# excluding completed var-binds
+			newOIDs, repeatingRoots = [], []
 			for idx in range(R):
-				try:
-					root = self.proxy.getImplementation().ObjectIdentifier(repeatingRoots[idx])
+				if idx >= len(rows) or idx >= len(starts):
+					raise error.ProtoError( """Incorrectly formed table response: %s"""%(rows,))
+				root = ObjectIdentifier(roots[idx])
+				highest = starts[idx][0]
+				previous = sortableOID( highest )
+				last = None
+				for index in range( idx, len(rows), R ):
+					key,value = rows[index]
 					if (
-						not root.isaprefix(newOIDs[idx][0]) or
-						isinstance(newOIDs[idx][1], v2c.EndOfMibView)
+						not root.isaprefix(key) or
+						isinstance(value, v2c.EndOfMibView)
 					):
 						# One of the tables exceeded
-						for l in newOIDs, repeatingRoots:
-							del l[idx]
-						break # XXX check logic here, can't more than one end at the same time?
-				except IndexError, err:
-					raise error.ProtoError( """Incorrectly formed table response: %s : %s"""%(newOIDs,err))
+						last = None
+						break
+					position = sortableOID( key )
+					if position > previous or (
+						inclusive and index == idx and position == previous
+					):
+						previous, highest, last = position, key, (key,value)
+					elif not self.orderingAnomaly( roots[idx], highest, key ):
+						last = None
+						for later in range( index, len(rows), R ):
+							rejected[ N+later ] = 1
+						break
+					elif self.orderingPolicy == SKIP:
+						last = (oid.OID( successorOID( highest ) ),None)
+						for later in range( index, len(rows), R ):
+							rejected[ N+later ] = 1
+						break
+					else:
+						previous, last = position, (key,value)
+				if last is not None:
+					newOIDs.append( last )
+					repeatingRoots.append( roots[idx] )
+			if rejected:
+				pdu = response.apiGenGetPdu()
+				pdu.apiGenSetVarBind([
+					varBind
+					for (index,varBind) in enumerate(pdu.apiGenGetVarBind())
+					if not rejected.has_key( index )
+				])
 
 		# Decide whether to request next item...
-		if newOIDs and repeatingRoots: # still something to do...
+		if (newOIDs and repeatingRoots) or remainingNonRepeaters: # still something to do...
 			nextIteration = reactor.callLater(
 				0.0,
-				self.getTable,
+				self.continueTable,
 				[x[0] for x in newOIDs],
 				roots=repeatingRoots,
 				includeStart=0,
+				nonRepeaters=remainingNonRepeaters,
 			)
 		else:
 			# actually, this should wait for this last record
 			# to get updated before it does the callback :(
 			self.finished = 1
-		# XXX should return newOIDs with the bad results filtered out
 		return response
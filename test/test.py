@@ -2,6 +2,7 @@
 import unittest, types
 
 from twistedsnmp.test import test_get, test_set, test_storage, test_basic
+from twistedsnmp.test import test_twine
 
 def moduleSuite( module ):
 	return unittest.TestLoader().loadTestsFromModule( module )
@@ -13,6 +14,7 @@ suite = unittest.TestSuite( [
 		test_get,
 		test_set,
 		test_storage,
+		test_twine,
 	]
 ])
 
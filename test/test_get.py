@@ -1,8 +1,12 @@
 from __future__ import nested_scopes
-from twisted.internet import reactor
-import socket, unittest
+from twisted.internet import reactor, defer
+import socket, unittest, bisect
 from twistedsnmp import agent, agentprotocol, twinetables, agentproxy
 from twistedsnmp import snmpprotocol, massretriever, tableretriever
+from twistedsnmp import bisectoidstore, massprocess, pollscheduler, runreport
+from twistedsnmp import responsecache, simulator, instrumentation
+from twisted.internet import error as twisted_error
+from twisted.python import failure
 from twistedsnmp.test import basetestcase
 from twistedsnmp.pysnmpproto import v2c,v1, error, oid
 
@@ -83,6 +87,81 @@ class GetRetrieverV1( basetestcase.BaseTestCase ):
 		assert tableData.has_key(oid.OID('.1.3.6.1.2.1.1.4.0')), tableData
 		assert len(tableData) == 1
 
+	def test_tableGetNonRepeaters( self ):
+		"""Are non-repeating scalars retrieved alongside the table?"""
+		self.installMessageCounter()
+		d = self.client.getTable(
+			[
+				'.1.3.6.1.2.1.2'
+			],
+			nonRepeaters = [
+				'.1.3.6.1.2.1.1.1',
+				'.1.3.6.1.2.1.1.9', # doesn't exist
+			],
+		)
+		self.doUntilFinish( d )
+
+		assert self.success, self.response
+		assert self.response.has_key(
+			oid.OID('.1.3.6.1.2.1.1.1')
+		), (self.response,self)
+		assert self.response[oid.OID('.1.3.6.1.2.1.1.1')] == {
+			oid.OID('.1.3.6.1.2.1.1.1.0'):'Hello world!',
+		}, self.response
+		assert not self.response.has_key( oid.OID('.1.3.6.1.2.1.1.9') ), self.response
+		tableData = self.response[oid.OID('.1.3.6.1.2.1.2') ]
+		assert len(tableData) == 4, tableData
+		assert self.client.messageCount <= 6, self.client.messageCount
+
+	def test_tableGetRows( self ):
+		"""Are twined rows delivered incrementally in rowCallback mode?"""
+		rows = []
+		def onRow( suffix, record ):
+			rows.append( (suffix, record) )
+		oids = [
+			'.1.3.6.1.2.1.1',
+			'.1.3.6.1.2.1.2',
+		]
+		d = self.client.getTable( oids, rowCallback = onRow )
+		self.doUntilFinish( d )
+
+		assert self.success, self.response
+		# table values are delivered as rows, not accumulated
+		assert self.response == {}, self.response
+		assert len(rows) == 4, rows
+		for suffix, record in rows:
+			assert len(record) == 2, (suffix, record)
+		assert rows[0][1] == {
+			oid.OID(oids[0]): 'Hello world!',
+			oid.OID(oids[1]): 'Hello world!',
+		}, rows
+
+	def test_tableGetChanges( self ):
+		"""Are only changed rows reported in changeCallback mode?"""
+		oids = [
+			'.1.3.6.1.2.1.1',
+			'.1.3.6.1.2.1.2',
+		]
+		d = self.client.getTable( oids )
+		self.doUntilFinish( d )
+		assert self.success, self.response
+		snapshot = twinetables.TableSnapshot.fromTable(
+			self.response, [oid.OID(x) for x in oids],
+		)
+		assert len(snapshot) == 4, snapshot.fingerprints
+		self.agent.protocol.agent.dataStore.setValue( '.1.3.6.1.2.1.2.2.0', 33 )
+		changes = []
+		def onChange( change, suffix, record ):
+			changes.append( (change, suffix, record) )
+		d = self.client.getTable(
+			oids, snapshot=snapshot, changeCallback=onChange,
+		)
+		self.doUntilFinish( d )
+		assert self.success, self.response
+		assert len(changes) == 1, changes
+		assert changes[0][0] == twinetables.CHANGED, changes
+		assert changes[0][2][oid.OID(oids[1])] == 33, changes
+
 	#good
 	def test_tableGetMissing( self ):
 		"""Does tabular retrieval ignore non-existent oid-sets?"""
@@ -258,6 +337,413 @@ class MassRetrieverTest( basetestcase.BaseTestCase ):
 			{oid.OID('.1.3.6.1.1.3'):'Blah!'}
 		}, self.response
 		retriever.printStats()
+	def testMassRetrieverFixedDelay( self ):
+		"""Does the fixed-delay (concurrency=None) algorithm still work?"""
+		proxies = massretriever.proxies(
+			self.client.protocol,
+			[('127.0.0.1',self.agent.port, 'public',self.version)]*50
+		)
+		retriever = massretriever.MassRetriever(
+			proxies, concurrency=None,
+		)
+		d = retriever( oids = ['.1.3.6.1.1.3',] )
+		self.doUntilFinish( d )
+		assert self.success, self.response
+		assert self.response == {
+			('127.0.0.1',self.agent.port):
+			{oid.OID('.1.3.6.1.1.3'):'Blah!'}
+		}, self.response
+		assert retriever.successCount == 50, retriever.successCount
+	def testMassRetrieverWindow( self ):
+		"""Does the concurrency window limit agents in-flight?"""
+		proxies = massretriever.proxies(
+			self.client.protocol,
+			[('127.0.0.1',self.agent.port, 'public',self.version)]*100
+		)
+		retriever = massretriever.MassRetriever(
+			proxies, concurrency=8, packetRate=2000,
+		)
+		seen = []
+		originalComplete = retriever.proxyComplete
+		def proxyComplete( *args, **named ):
+			seen.append( retriever.inFlight )
+			return originalComplete( *args, **named )
+		retriever.proxyComplete = proxyComplete
+		d = retriever( oids = ['.1.3.6.1.1.3',] )
+		self.doUntilFinish( d )
+		assert self.success, self.response
+		assert retriever.successCount == 100, retriever.successCount
+		assert len(seen) == 100, seen
+		assert max(seen) <= 8, seen
+		assert retriever.inFlight == 0, retriever.inFlight
+	def testMassRetrieverLazy( self ):
+		"""Are proxies created from an address generator as needed?"""
+		created = []
+		class CountingProxy( agentproxy.AgentProxy ):
+			def __init__( self, *args, **named ):
+				created.append( retriever.inFlight )
+				super( CountingProxy, self ).__init__( *args, **named )
+		def addresses():
+			for i in range(50):
+				yield ('127.0.0.1',self.agent.port, 'public',self.version)
+		retriever = massretriever.MassRetriever(
+			addresses(), concurrency=5,
+			protocol=self.client.protocol, proxyClass=CountingProxy,
+		)
+		d = retriever( oids = ['.1.3.6.1.1.3',] )
+		self.doUntilFinish( d )
+		assert self.success, self.response
+		assert len(created) == 50, created
+		assert max(created) < 5, created
+		assert retriever.successCount == 50, retriever.successCount
+	def listenAgent( self ):
+		"""Start an extra agent (on its own port) serving our test OIDs
+
+		returns the agent's port number, the listening port is
+		appended to self.extraAgents so the caller can stop it
+		"""
+		for port in range(30000,35000):
+			try:
+				listening = reactor.listenUDP(
+					port, agentprotocol.AgentProtocol(
+						snmpVersion = self.version,
+						agent = agent.Agent( dataStore = self.createStorage() ),
+					),
+				)
+			except twisted_error.CannotListenError:
+				pass
+			else:
+				self.extraAgents.append( listening )
+				return port
+		raise twisted_error.CannotListenError(
+			"""Could not listen on any port for an extra agent""",
+		)
+	def testMassRetrieverFairQueue( self ):
+		"""Are high-priority agents first and groups limited?"""
+		self.extraAgents = []
+		try:
+			accessPort = self.listenAgent()
+			branchPort = self.listenAgent()
+			started = []
+			class RecordingProxy( agentproxy.AgentProxy ):
+				def __init__( self, *args, **named ):
+					super( RecordingProxy, self ).__init__( *args, **named )
+					started.append( (self.port, dict(queue.inFlight)) )
+			queue = massretriever.FairQueue( groupLimit=2 )
+			for i in range(10):
+				queue.add(
+					('127.0.0.1',accessPort, 'public',self.version),
+					group = 'access',
+				)
+			queue.add(
+				('127.0.0.1',branchPort, 'public',self.version),
+				group = 'branch',
+			)
+			queue.add(
+				('127.0.0.1',self.agent.port, 'public',self.version),
+				priority = -1, group = 'core',
+			)
+			retriever = massretriever.MassRetriever(
+				queue, concurrency=8,
+				protocol=self.client.protocol, proxyClass=RecordingProxy,
+			)
+			d = retriever( oids = ['.1.3.6.1.1.3',] )
+			self.doUntilFinish( d )
+			assert self.success, self.response
+			assert len(started) == 12, started
+			assert started[0][0] == self.agent.port, started
+			assert branchPort in [port for (port,inFlight) in started[:3]], started
+			for port,inFlight in started:
+				assert inFlight.get( 'access', 0 ) <= 2, started
+			assert retriever.successCount == 12, retriever.successCount
+		finally:
+			for listening in self.extraAgents:
+				listening.stopListening()
+	def testMassRetrieverReport( self ):
+		"""Does the run report record per-agent timings and traffic?"""
+		import tempfile, os
+		report = runreport.RunReport()
+		retriever = massretriever.MassRetriever(
+			[
+				('127.0.0.1',self.agent.port, 'public',self.version),
+				('127.0.0.1',self.agent.port+1, 'public',self.version),
+			],
+			protocol=self.client.protocol, report=report,
+		)
+		d = retriever( oids = ['.1.3.6.1.1.3',], timeout=.25, retryCount=1 )
+		self.doUntilFinish( d )
+		assert self.success, self.response
+		live = report.records[('127.0.0.1',self.agent.port)]
+		dead = report.records[('127.0.0.1',self.agent.port+1)]
+		assert live.outcome == runreport.SUCCESS, live.asDict()
+		assert live.requests == 1 and live.responses == 1, live.asDict()
+		assert live.bytesSent and live.bytesReceived, live.asDict()
+		assert dead.outcome == runreport.FAILED, dead.asDict()
+		assert dead.requests == 2 and dead.timeouts == 2, dead.asDict()
+		assert dead.duration >= .25, dead.asDict()
+		assert self.client.protocol.monitor is None
+		summary = report.summary()
+		assert summary['agents'] == 2, summary
+		assert summary['outcomes'] == {
+			runreport.SUCCESS: 1, runreport.FAILED: 1,
+		}, summary
+		assert summary['slowest'][0]['port'] == self.agent.port+1, summary
+		assert summary['durations']['p50'] is not None, summary
+		if runreport.json is not None:
+			filename = tempfile.mktemp( '.jsonl' )
+			try:
+				report.writeJSONL( filename )
+				lines = open( filename ).readlines()
+				assert len(lines) == 3, lines
+			finally:
+				os.remove( filename )
+	def testMassRetrieverReportChained( self ):
+		"""Does the run report chain and restore an existing monitor?"""
+		report = runreport.RunReport()
+		previous = runreport.RunReport()
+		key = ('127.0.0.1',self.agent.port)
+		previous.records[ key ] = runreport.AgentRecord( key, 0 )
+		self.client.protocol.monitor = previous
+		try:
+			retriever = massretriever.MassRetriever(
+				[ key+('public',self.version) ],
+				protocol=self.client.protocol, report=report,
+			)
+			d = retriever( oids = ['.1.3.6.1.1.3',], timeout=.25, retryCount=1 )
+			self.doUntilFinish( d )
+			assert self.success, self.response
+			assert report.records[ key ].responses == 1, report.records[ key ].asDict()
+			assert previous.records[ key ].responses == 1, previous.records[ key ].asDict()
+			assert self.client.protocol.monitor is previous
+		finally:
+			self.client.protocol.monitor = None
+	def testMassRetrieverStreaming( self ):
+		"""Are per-agent results delivered and dropped as agents finish?"""
+		proxies = massretriever.proxies(
+			self.client.protocol,
+			[
+				('127.0.0.1',self.agent.port, 'public',self.version),
+				('127.0.0.1',self.agent.port+1, 'public',self.version),
+			]
+		)
+		delivered = []
+		def agentCallback( key, valueSet ):
+			delivered.append( (key,valueSet) )
+			assert not retriever.result, retriever.result
+		retriever = massretriever.MassRetriever(
+			proxies, agentCallback=agentCallback, keepResults=False,
+		)
+		d = retriever( oids = ['.1.3.6.1.1.3',], timeout=.25, retryCount=1 )
+		self.doUntilFinish( d )
+		assert self.success, self.response
+		delivered.sort()
+		assert delivered == [
+			(('127.0.0.1',self.agent.port),{oid.OID('.1.3.6.1.1.3'):'Blah!'}),
+			(('127.0.0.1',self.agent.port+1),{oid.OID('.1.3.6.1.1.3'):None}),
+		], delivered
+		assert self.response['agents'] == 2, self.response
+		assert self.response['success'] == 1, self.response
+		assert self.response['errors'] == 1, self.response
+		assert not retriever.result, retriever.result
+	def testCircuitBreaker( self ):
+		"""Are agents which repeatedly time out only probed?"""
+		breaker = massretriever.CircuitBreaker( threshold=2, probeTimeout=.1 )
+		dead = ('127.0.0.1',self.agent.port+1)
+		live = ('127.0.0.1',self.agent.port)
+		for cycle in range(3):
+			proxies = massretriever.proxies(
+				self.client.protocol,
+				[
+					live+('public',self.version),
+					dead+('public',self.version),
+				]
+			)
+			retriever = massretriever.MassRetriever( proxies, breaker=breaker )
+			d = retriever( oids = ['.1.3.6.1.1.3',], timeout=.25, retryCount=1 )
+			self.doUntilFinish( d )
+			assert self.success, self.response
+			assert self.response[dead] == {oid.OID('.1.3.6.1.1.3'):None}, self.response
+			assert self.response[live] == {oid.OID('.1.3.6.1.1.3'):'Blah!'}, self.response
+		assert breaker.openAgents() == [dead], breaker.openAgents()
+		status = breaker.status( dead )
+		assert status['open'], status
+		assert status['probes'] == 1, status
+		assert status['failures'] == 3, status
+		assert not breaker.status( live )['open']
+		breaker.success( dead )
+		assert not breaker.openAgents()
+	def testCircuitBreakerErrorAnswer( self ):
+		"""Does an error answer to a probe close the circuit?"""
+		class ErrorProxy( object ):
+			ip, port, protocol = '127.0.0.1', 9, None
+			def __init__( self ):
+				self.calls = []
+			def get( self, oids, **named ):
+				self.calls.append( list(oids) )
+				if len(self.calls) == 1:
+					return defer.fail( error.ProtoError( 'noSuchName' ) )
+				return defer.succeed( {oid.OID('.1.3.6.1.1.3'):'Blah!'} )
+		proxy = ErrorProxy()
+		key = (proxy.ip,proxy.port)
+		breaker = massretriever.CircuitBreaker( threshold=1 )
+		breaker.failure( key )
+		assert breaker.isOpen( key )
+		retriever = massretriever.MassRetriever( [proxy], breaker=breaker )
+		d = retriever( oids = ['.1.3.6.1.1.3',] )
+		self.doUntilFinish( d )
+		assert self.success, self.response
+		assert proxy.calls[0] == breaker.probeOIDs, proxy.calls
+		assert not breaker.isOpen( key )
+		assert breaker.status( key )['error'] is not None, breaker.status( key )
+		assert self.response[key] == {oid.OID('.1.3.6.1.1.3'):'Blah!'}, self.response
+	def testPollScheduler( self ):
+		"""Does the poll scheduler repeatedly poll agents?"""
+		results = []
+		finished = defer.Deferred()
+		def resultCallback( job, valueSet ):
+			results.append( (job,valueSet) )
+			if len(results) == 6:
+				scheduler.stop()
+				finished.callback( results )
+		scheduler = pollscheduler.PollScheduler(
+			resultCallback = resultCallback,
+		)
+		jobs = [
+			scheduler.add(
+				self.client, oids = ['.1.3.6.1.1.3',], interval = .2,
+			)
+			for i in range(3)
+		]
+		scheduler.start()
+		self.doUntilFinish( finished )
+		assert self.success, self.response
+		for job,valueSet in results:
+			assert valueSet == {oid.OID('.1.3.6.1.1.3'):'Blah!'}, valueSet
+		for job in jobs:
+			assert job.polls >= 1, job
+			assert job.lastDuration is not None, job
+	def testPollSchedulerOverrun( self ):
+		"""Are polls still running at their deadline skipped?"""
+		skipped = []
+		finished = defer.Deferred()
+		def skipCallback( job, reason ):
+			skipped.append( reason )
+			scheduler.stop()
+			finished.callback( skipped )
+		scheduler = pollscheduler.PollScheduler(
+			skipCallback = skipCallback, jitter = 0,
+		)
+		proxy = agentproxy.AgentProxy(
+			'127.0.0.1', self.agent.port+1,
+			snmpVersion = self.version,
+			protocol = self.client.protocol,
+		)
+		job = scheduler.add(
+			proxy, oids = ['.1.3.6.1.1.3',], interval = .1,
+			timeout = .25, retryCount = 0,
+		)
+		scheduler.start()
+		self.doUntilFinish( finished )
+		assert self.success, self.response
+		assert skipped == [pollscheduler.OVERRUN], skipped
+		assert job.overruns == 1, job.overruns
+	def testPollSchedulerRemove( self ):
+		"""Are proxy settings restored and phase slots re-used on remove?"""
+		scheduler = pollscheduler.PollScheduler()
+		proxy = agentproxy.AgentProxy(
+			'127.0.0.1', self.agent.port,
+			snmpVersion = self.version,
+			protocol = self.client.protocol,
+			allowCache = False,
+		)
+		first = scheduler.add( proxy, oids = ['.1.3.6.1.1.3',], interval = 10 )
+		second = scheduler.add( proxy, oids = ['.1.3.6.1.1.3',], interval = 10 )
+		assert proxy.allowCache
+		scheduler.remove( first )
+		assert proxy.allowCache, """Proxy still polled by second job"""
+		third = scheduler.add( proxy, oids = ['.1.3.6.1.1.3',], interval = 10 )
+		assert third.phase == first.phase, (third.phase, first.phase)
+		scheduler.remove( second )
+		scheduler.remove( third )
+		assert not proxy.allowCache
+	def testProcessMassRetriever( self ):
+		"""Can we retrieve mass values using worker processes?"""
+		retriever = massprocess.ProcessMassRetriever(
+			[
+				('127.0.0.1',self.agent.port, 'public',self.version),
+				('127.0.0.1',self.agent.port+1, 'public',self.version),
+			],
+			processes = 2,
+		)
+		d = retriever( oids = ['.1.3.6.1.1.3',], timeout=.25, retryCount=1 )
+		self.doUntilFinish( d )
+		assert self.success, self.response
+		assert self.response == {
+			('127.0.0.1',self.agent.port):
+			{oid.OID('.1.3.6.1.1.3'):'Blah!'},
+			('127.0.0.1',self.agent.port+1):
+			{oid.OID('.1.3.6.1.1.3'):None},
+		}, self.response
+		assert not retriever.failedWorkers
+	def testProcessFraming( self ):
+		"""Do worker result frames round-trip?"""
+		key = ('127.0.0.1',161)
+		valueSet = {
+			oid.OID('.1.3.6.1.1.3'): 'Blah!',
+			oid.OID('.1.3.6.1.2.1.1'): {
+				oid.OID('.1.3.6.1.2.1.1.1.0'): 32,
+			},
+			oid.OID('.1.3.6.1.2.1.2'): None,
+		}
+		frame = massprocess.encodeResult( key, valueSet )
+		format = frame[0]
+		payload = frame[massprocess.HEADER_SIZE:]
+		assert massprocess.decodeResult( format, payload ) == (key,valueSet)
+	def testProcessWorkerKilled( self ):
+		"""Are agents a killed worker didn't report given None values?"""
+		addresses = [('127.0.0.1',161),('127.0.0.1',162),('127.0.0.1',163)]
+		retriever = massprocess.ProcessMassRetriever( addresses, processes=1 )
+		retriever.oids, retriever.tables = ['.1.3.6.1.1.3'], []
+		retriever.result = {}
+		retriever.finalDefer = defer.Deferred()
+		worker = massprocess.WorkerProtocol( retriever, addresses, '' )
+		retriever.workers.append( worker )
+		frame = massprocess.encodeResult(
+			addresses[0], {oid.OID('.1.3.6.1.1.3'): 'Blah!'},
+		)
+		second = massprocess.encodeResult(
+			addresses[1], {oid.OID('.1.3.6.1.1.3'): 'Blah!'},
+		)
+		# killed by a signal part-way through writing the second frame
+		worker.outReceived( frame + second[:-2] )
+		worker.processEnded( failure.Failure(
+			twisted_error.ProcessTerminated( exitCode=None, signal=9 ),
+		))
+		assert retriever.finalDefer.called
+		assert retriever.failedWorkers == 1, retriever.failedWorkers
+		assert retriever.result == {
+			addresses[0]: {oid.OID('.1.3.6.1.1.3'): 'Blah!'},
+			addresses[1]: {oid.OID('.1.3.6.1.1.3'): None},
+			addresses[2]: {oid.OID('.1.3.6.1.1.3'): None},
+		}, retriever.result
+	def testProcessPartialFrame( self ):
+		"""Is a partial frame at a clean exit a worker failure?"""
+		addresses = [('127.0.0.1',161)]
+		retriever = massprocess.ProcessMassRetriever( addresses, processes=1 )
+		retriever.oids, retriever.tables = ['.1.3.6.1.1.3'], []
+		retriever.result = {}
+		retriever.finalDefer = defer.Deferred()
+		worker = massprocess.WorkerProtocol( retriever, addresses, '' )
+		retriever.workers.append( worker )
+		frame = massprocess.encodeResult(
+			addresses[0], {oid.OID('.1.3.6.1.1.3'): 'Blah!'},
+		)
+		worker.outReceived( frame[:-1] )
+		worker.processEnded( failure.Failure( twisted_error.ProcessDone( 0 ) ) )
+		assert retriever.failedWorkers == 1, retriever.failedWorkers
+		assert retriever.result == {
+			addresses[0]: {oid.OID('.1.3.6.1.1.3'): None},
+		}, retriever.result
 	def testMassRetrieverTables( self ):
 		"""Can we retrieve mass value tabular sets?"""
 		import random
@@ -319,11 +805,455 @@ class LargeTableTest( basetestcase.BaseTestCase ):
 		assert self.success, """Failed to retrieve"""
 		perRecord = twinetables.twineTables( self.response, self.response.keys())
 		assert len(perRecord) == 1024, """Didn't get 1024 records, got %r"""%(len(perRecord))
+	def testLargeTableSliced( self ):
+		"""Do we retrieve all records when integrating in time-slices?"""
+		retriever = tableretriever.TableRetriever(
+			self.client, ['.1.3.6.1.2.1.1'], integrationBudget = 1,
+		)
+		retriever.integrationSliceSize = 16
+		d = retriever()
+		self.doUntilFinish( d )
+		assert self.success, """Failed to retrieve"""
+		perRecord = twinetables.twineTables( self.response, self.response.keys())
+		assert len(perRecord) == 1024, """Didn't get 1024 records, got %r"""%(len(perRecord))
+		if self.version != 'v1':
+			# bulk responses are larger than a slice, so each must
+			# have been integrated over several reactor iterations
+			assert retriever.integrationSlices > retriever.integrationCount, (
+				retriever.integrationSlices, retriever.integrationCount,
+			)
 		
 class LargeTableTestv2c( LargeTableTest ):
 	"""Test for full retrieval of a large table"""
 	version = 'v1'
 
+class MessageSizeTest( basetestcase.BaseTestCase ):
+	"""Test for the agent's response size limit"""
+	version = 'v2'
+	oidsForTesting = [
+		('.1.3.6.1.2.1.2.2.1.10.%s'%i, i*1000)
+		for i in range(1,201)
+	]
+	def setUp( self ):
+		basetestcase.BaseTestCase.setUp( self )
+		self.agent.protocol.agent.maxMessageSize = 484
+		self.sizes = []
+		protocol = self.agent.protocol
+		original = protocol.send
+		def send( message, address ):
+			self.sizes.append( len(message) )
+			return original( message, address )
+		protocol.send = send
+	def testBulkTruncated( self ):
+		"""Are GETBULK responses truncated to the maximum size?"""
+		d = self.client.getTable(
+			['.1.3.6.1.2.1.2.2.1.10'], maxRepetitions=128,
+		)
+		self.doUntilFinish( d )
+		assert self.success, self.response
+		table = self.response[oid.OID('.1.3.6.1.2.1.2.2.1.10')]
+		assert len(table) == 200, len(table)
+		assert len(self.sizes) > 2, self.sizes
+		assert max(self.sizes) <= 484, self.sizes
+	def testTooBig( self ):
+		"""Are oversized GET responses replaced by tooBig?"""
+		d = self.client.get(
+			[key for (key,value) in self.oidsForTesting[:40]],
+		)
+		self.doUntilFinish( d )
+		assert self.success, self.response
+		assert self.response == {}, self.response
+		assert len(self.sizes) == 1, self.sizes
+		assert max(self.sizes) <= 484, self.sizes
+	def testRowTruncation( self ):
+		"""Are GETBULK responses truncated to whole rows?"""
+		server = self.agent.protocol.agent
+		assert server.truncatedLength( 10, 1, 3 ) == 10
+		assert server.truncatedLength( 9, 1, 3 ) == 7
+		assert server.truncatedLength( 4, 1, 3 ) == 4
+		# a partial first row (or nothing) means tooBig
+		assert server.truncatedLength( 3, 1, 3 ) is None
+		assert server.truncatedLength( 0, 0, 1 ) is None
+		server.truncateRows = False
+		assert server.truncatedLength( 9, 1, 3 ) == 9
+		assert server.truncatedLength( 3, 1, 3 ) is None
+
+class ResponseCacheTest( basetestcase.BaseTestCase ):
+	"""Test for the agent's encoded-response cache"""
+	version = 'v2'
+	oidsForTesting = [
+		('.1.3.6.1.2.1.1.%s.0'%i, 'value %s'%i)
+		for i in range(1,10)
+	]
+	def setUp( self ):
+		basetestcase.BaseTestCase.setUp( self )
+		self.cache = responsecache.ResponseCache()
+		self.agent.protocol.agent.responseCache = self.cache
+	def testCached( self ):
+		"""Are repeated requests answered from the cache?"""
+		for i in range(2):
+			d = self.client.get( ['.1.3.6.1.2.1.1.1.0'] )
+			self.doUntilFinish( d )
+			assert self.success, self.response
+			assert self.response == {
+				oid.OID('.1.3.6.1.2.1.1.1.0'): 'value 1',
+			}, self.response
+		assert self.cache.hits == 1, self.cache.hits
+		d = self.client.getTable( ['.1.3.6.1.2.1.1'] )
+		self.doUntilFinish( d )
+		assert self.success, self.response
+		table = self.response[ oid.OID('.1.3.6.1.2.1.1') ]
+		assert len(table) == 9, table
+	def testInvalidated( self ):
+		"""Does setting a value invalidate cached responses?"""
+		d = self.client.get( ['.1.3.6.1.2.1.1.1.0'] )
+		self.doUntilFinish( d )
+		self.agent.protocol.agent.dataStore.setValue(
+			'.1.3.6.1.2.1.1.1.0', 'changed',
+		)
+		d = self.client.get( ['.1.3.6.1.2.1.1.1.0'] )
+		self.doUntilFinish( d )
+		assert self.success, self.response
+		assert self.response == {
+			oid.OID('.1.3.6.1.2.1.1.1.0'): 'changed',
+		}, self.response
+		assert self.cache.hits == 0, self.cache.hits
+	def testVolatile( self ):
+		"""Are stores with calculated values left uncached?"""
+		store = self.agent.protocol.agent.dataStore
+		store.setValue( '.1.3.6.1.2.1.1.9.0', lambda oid, storage: 'calculated' )
+		for i in range(2):
+			d = self.client.get( ['.1.3.6.1.2.1.1.9.0'] )
+			self.doUntilFinish( d )
+			assert self.success, self.response
+		assert self.cache.hits == 0, self.cache.hits
+		assert not self.cache.entries, self.cache.entries
+
+	def testRetransmission( self ):
+		"""Are retransmitted requests replayed without re-execution?"""
+		protocol = self.agent.protocol
+		protocol.retransmitCache = responsecache.RetransmitCache()
+		calls = []
+		def calculated( oid, storage ):
+			calls.append( oid )
+			return 'calculated'
+		protocol.agent.dataStore.setValue( '.1.3.6.1.2.1.1.9.0', calculated )
+		request = v2c.GetRequest()
+		request.apiGenSetCommunity( 'public' )
+		request.apiGenGetPdu().apiGenSetVarBind( [('.1.3.6.1.2.1.1.9.0',None)] )
+		datagram = request.encode()
+		sent = []
+		original = protocol.transport.write
+		def write( message, address ):
+			sent.append( message )
+			return original( message, address )
+		protocol.transport.write = write
+		address = ('127.0.0.1',9) # discard
+		for i in range(3):
+			protocol.datagramReceived( datagram, address )
+		assert len(calls) == 1, calls
+		assert len(sent) == 3, sent
+		assert sent[0] == sent[1] == sent[2]
+		assert protocol.retransmitCache.hits == 2, protocol.retransmitCache.hits
+		assert responsecache.requestID( sent[0] ) == responsecache.requestID( datagram )
+
+	def testStalePending( self ):
+		"""Are unanswered requests re-processed once their entry is stale?"""
+		cache = responsecache.RetransmitCache( timeout=1.0 )
+		request = v2c.GetRequest()
+		request.apiGenSetCommunity( 'wrong' )
+		request.apiGenGetPdu().apiGenSetVarBind( [('.1.3.6.1.2.1.1.1.0',None)] )
+		datagram = request.encode()
+		address = ('127.0.0.1',9)
+		key, response = cache.received( datagram, address )
+		assert response is None, response
+		key, response = cache.received( datagram, address )
+		assert response == '', response
+		# never answered, age the pending entry past the timeout
+		received, requestKey = cache.pending[ key[:2] ]
+		cache.pending[ key[:2] ] = (received - 2.0, requestKey)
+		key, response = cache.received( datagram, address )
+		assert response is None, response
+		assert cache.inFlight == 1, cache.inFlight
+
+class DeferredValueTest( basetestcase.BaseTestCase ):
+	"""Test for values produced asynchronously (as Deferreds)"""
+	version = 'v2'
+	oidsForTesting = [
+		('.1.3.6.1.2.1.1.%s.0'%i, 'value %s'%i)
+		for i in range(1,10)
+	]
+	def setUp( self ):
+		basetestcase.BaseTestCase.setUp( self )
+		self.server = self.agent.protocol.agent
+		self.server.valueTimeout = .25
+		self.values = []
+		self.server.dataStore.setValue( '.1.3.6.1.2.1.1.5.0', self.slowValue )
+	def slowValue( self, oid, storage ):
+		"""Produce the next of self.values after a short delay"""
+		d = defer.Deferred()
+		if self.values:
+			reactor.callLater( .05, d.callback, self.values.pop(0) )
+		return d
+	def testDeferred( self ):
+		"""Are responses sent once Deferred values are available?"""
+		self.values = ['slow']
+		d = self.client.get( ['.1.3.6.1.2.1.1.4.0','.1.3.6.1.2.1.1.5.0'] )
+		self.doUntilFinish( d )
+		assert self.success, self.response
+		assert self.response == {
+			oid.OID('.1.3.6.1.2.1.1.4.0'): 'value 4',
+			oid.OID('.1.3.6.1.2.1.1.5.0'): 'slow',
+		}, self.response
+	def testTable( self ):
+		"""Do GETBULK responses wait for Deferred values?"""
+		self.values = ['slow']
+		d = self.client.getTable( ['.1.3.6.1.2.1.1'] )
+		self.doUntilFinish( d )
+		assert self.success, self.response
+		table = self.response[ oid.OID('.1.3.6.1.2.1.1') ]
+		assert table[ oid.OID('.1.3.6.1.2.1.1.5.0') ] == 'slow', table
+	def testFallback( self ):
+		"""Are timed-out values replaced by the last value?"""
+		self.values = ['first']
+		d = self.client.get( ['.1.3.6.1.2.1.1.5.0'] )
+		self.doUntilFinish( d )
+		assert self.success, self.response
+		d = self.client.get( ['.1.3.6.1.2.1.1.5.0'], timeout=1.0, retryCount=0 )
+		self.doUntilFinish( d )
+		assert self.success, self.response
+		assert self.response == {
+			oid.OID('.1.3.6.1.2.1.1.5.0'): 'first',
+		}, self.response
+	def testGenErr( self ):
+		"""Are timed-out values without a last value reported as genErr?"""
+		d = self.client.get( ['.1.3.6.1.2.1.1.5.0'], timeout=1.0, retryCount=0 )
+		self.doUntilFinish( d )
+		assert self.success, self.response
+		assert self.response == {}, self.response
+
+class InstrumentationTest( basetestcase.BaseTestCase ):
+	"""Test for per-request-type latency instrumentation"""
+	version = 'v2'
+	oidsForTesting = [
+		('.1.3.6.1.2.1.1.%s.0'%i, 'value %s'%i)
+		for i in range(1,10)
+	]
+	def setUp( self ):
+		basetestcase.BaseTestCase.setUp( self )
+		self.stats = instrumentation.Instrumentation()
+		self.stats.attach( self.agent.protocol, self.agent.protocol.agent )
+	def series( self ):
+		"""Get snapshot as {(requestType,store,phase): series}"""
+		result = {}
+		for series in self.stats.snapshot():
+			result[ (series['requestType'],series['store'],series['phase']) ] = series
+		return result
+	def testPhases( self ):
+		"""Are protocol and agent phases recorded per request type?"""
+		for i in range(2):
+			d = self.client.get( ['.1.3.6.1.2.1.1.1.0'] )
+			self.doUntilFinish( d )
+			assert self.success, self.response
+		d = self.client.getTable( ['.1.3.6.1.2.1.1'] )
+		self.doUntilFinish( d )
+		assert self.success, self.response
+		series = self.series()
+		store = instrumentation.storeName( self.agent.protocol.agent.dataStore )
+		for phase in ('cache','lookup','coerce','encode','total'):
+			assert series[ ('get',store,phase) ]['count'] == 2, (phase, series.keys())
+		for phase in ('decode','verify','handle','total'):
+			assert series[ ('get',None,phase) ]['count'] == 2, (phase, series.keys())
+		assert series[ ('getTable',store,'total') ]['count'] >= 1, series.keys()
+		total = series[ ('get',store,'total') ]
+		assert sum([ count for (bound,count) in total['histogram'] ]) == 2, total
+	def testDeferred( self ):
+		"""Are responses waiting for Deferred values recorded?"""
+		def slowValue( oid, storage ):
+			d = defer.Deferred()
+			reactor.callLater( .05, d.callback, 'slow' )
+			return d
+		server = self.agent.protocol.agent
+		server.dataStore.setValue( '.1.3.6.1.2.1.1.5.0', slowValue )
+		d = self.client.get( ['.1.3.6.1.2.1.1.5.0'] )
+		self.doUntilFinish( d )
+		assert self.success, self.response
+		series = self.series()
+		store = instrumentation.storeName( server.dataStore )
+		for phase in ('lookup','resolve','encode','total'):
+			assert series[ ('get',store,phase) ]['count'] == 1, (phase, series.keys())
+		assert series[ ('get',store,'total') ]['max'] >= .05, series[ ('get',store,'total') ]
+		assert series[ ('get',None,'total') ]['max'] >= .05, series[ ('get',None,'total') ]
+	def testRejected( self ):
+		"""Are datagrams with a bad community recorded as rejected?"""
+		request = v2c.GetRequest()
+		request.apiGenSetCommunity( 'not-the-community' )
+		request.apiGenGetPdu().apiGenSetVarBind( [('.1.3.6.1.2.1.1.1.0',None)] )
+		self.agent.protocol.datagramReceived( request.encode(), ('127.0.0.1',9) )
+		series = self.series()
+		assert series[ ('get',None,'rejected') ]['count'] == 1, series.keys()
+		assert not series.has_key( ('get',None,'total') ), series.keys()
+	def testDetach( self ):
+		"""Does detaching stop recording?"""
+		self.stats.detach( self.agent.protocol, self.agent.protocol.agent )
+		d = self.client.get( ['.1.3.6.1.2.1.1.1.0'] )
+		self.doUntilFinish( d )
+		assert self.success, self.response
+		assert self.stats.snapshot() == [], self.stats.snapshot()
+		timing = instrumentation.startTiming( None, 'get' )
+		assert timing is instrumentation.NULL_TIMING, timing
+		timing.mark( 'lookup' )
+		timing.finish()
+		assert self.stats.snapshot() == [], self.stats.snapshot()
+
+class SimulatorTest( basetestcase.BaseTestCase ):
+	"""Test for virtual devices served by a Simulator"""
+	version = 'v2'
+	oidsForTesting = [
+		('.1.3.6.1.2.1.1.%s.0'%i, 'shared %s'%i)
+		for i in range(1,10)
+	]
+	def setUp( self ):
+		basetestcase.BaseTestCase.setUp( self )
+		self.simulator = simulator.Simulator(
+			self.createStorage(), snmpVersion=self.version,
+		)
+		for name in ('first','second'):
+			self.simulator.addDevice(
+				community = name,
+				OIDs = [('.1.3.6.1.2.1.1.5.0', name)],
+			)
+		for port in range(25000,30000):
+			try:
+				self.simulator.listen( port )
+			except twisted_error.CannotListenError:
+				pass
+			else:
+				self.simulatorPort = port
+				break
+	def tearDown( self ):
+		self.simulator.stopListening()
+		basetestcase.BaseTestCase.tearDown( self )
+	def createProxy( self, community ):
+		return agentproxy.AgentProxy(
+			"127.0.0.1", self.simulatorPort,
+			community = community,
+			snmpVersion = self.version,
+			protocol = self.clientPort.protocol,
+		)
+	def testRouting( self ):
+		"""Are requests routed to devices by community?"""
+		for name in ('first','second'):
+			d = self.createProxy( name ).get(
+				['.1.3.6.1.2.1.1.4.0','.1.3.6.1.2.1.1.5.0'],
+			)
+			self.doUntilFinish( d )
+			assert self.success, self.response
+			assert self.response == {
+				oid.OID('.1.3.6.1.2.1.1.4.0'): 'shared 4',
+				oid.OID('.1.3.6.1.2.1.1.5.0'): name,
+			}, self.response
+	def testWalk( self ):
+		"""Do walks merge device values with the shared store?"""
+		d = self.createProxy( 'second' ).getTable( ['.1.3.6.1.2.1.1'] )
+		self.doUntilFinish( d )
+		assert self.success, self.response
+		table = self.response[ oid.OID('.1.3.6.1.2.1.1') ]
+		assert len(table) == 9, table
+		assert table[ oid.OID('.1.3.6.1.2.1.1.5.0') ] == 'second', table
+	def testUnknownCommunity( self ):
+		"""Are requests for unknown devices ignored?"""
+		d = self.createProxy( 'third' ).get(
+			['.1.3.6.1.2.1.1.4.0'], timeout=.25, retryCount=0,
+		)
+		self.doUntilFinish( d )
+		assert not self.success, self.response
+
+class LoopingStore( bisectoidstore.BisectOIDStore ):
+	"""Storage which loops back to an earlier OID, like some broken agents"""
+	loopFrom = oid.OID('.1.3.6.1.2.1.1.3.0')
+	loopTo = oid.OID('.1.3.6.1.2.1.1.2.0')
+	def nextOID( self, base ):
+		if oid.OID(base) >= self.loopFrom:
+			return self.loopTo, 32
+		return super( LoopingStore, self ).nextOID( base )
+
+class SkippingStore( LoopingStore ):
+	"""Storage looping back once, answering GETNEXT from any other OID"""
+	def nextOID( self, base ):
+		if oid.OID(base) == self.loopFrom:
+			return self.loopTo, 32
+		key = bisectoidstore.oidToSortable( base )
+		start = bisect.bisect( self.OIDs, (key,) )
+		if start < len(self.OIDs) and self.OIDs[start][0] == key:
+			start += 1
+		return self.followingOID( start, key )
+
+class LoopingAgentTest( basetestcase.BaseTestCase ):
+	"""Test for walks against agents returning non-increasing OIDs"""
+	version = 'v2'
+	oidsForTesting = [
+		('.1.3.6.1.2.1.1.%s.0'%i, 32)
+		for i in range(1,10)
+	]
+	def createStorage( self ):
+		return LoopingStore( OIDs = self.oidsForTesting )
+	def getLooping( self, **named ):
+		"""Walk the looping table recording anomalies"""
+		self.anomalies = []
+		def onAnomaly( root, previous, returned ):
+			self.anomalies.append( (root, previous, returned) )
+		d = self.client.getTable(
+			['.1.3.6.1.2.1.1'],
+			anomalyCallback = onAnomaly,
+			maxRepetitions = 4,
+			**named
+		)
+		self.doUntilFinish( d )
+		assert self.success, self.response
+		return self.response[ oid.OID('.1.3.6.1.2.1.1') ]
+	def testStrict( self ):
+		"""Does a strict walk stop at the first non-increasing OID?"""
+		table = self.getLooping()
+		assert len(self.anomalies) == 1, self.anomalies
+		assert oid.OID(self.anomalies[0][2]) == LoopingStore.loopTo, self.anomalies
+		assert len(table) == 3, table
+	def testTolerate( self ):
+		"""Does a tolerant walk give up after orderingTolerance anomalies?"""
+		table = self.getLooping( orderingPolicy='tolerate', orderingTolerance=2 )
+		assert len(self.anomalies) == 3, self.anomalies
+		assert len(table) == 3, table
+	def testSkip( self ):
+		"""Does a skip-ahead walk give up after orderingTolerance anomalies?"""
+		table = self.getLooping( orderingPolicy='skip', orderingTolerance=2 )
+		assert len(self.anomalies) == 3, self.anomalies
+		assert len(table) == 3, table
+	def testSkipPast( self ):
+		"""Does a skip-ahead walk continue past a single bad OID?"""
+		self.agent.protocol.agent.dataStore = SkippingStore(
+			OIDs = self.oidsForTesting,
+		)
+		table = self.getLooping( orderingPolicy='skip', orderingTolerance=2 )
+		assert len(self.anomalies) == 1, self.anomalies
+		assert len(table) == 9, table
+	def testSkipKeepsRows( self ):
+		"""Does a skip-ahead walk keep the OID following the bad one?"""
+		self.agent.protocol.agent.dataStore = SkippingStore(
+			OIDs = self.oidsForTesting + [('.1.3.6.1.2.1.1.3.1', 31)],
+		)
+		table = self.getLooping( orderingPolicy='skip', orderingTolerance=2 )
+		assert len(self.anomalies) == 1, self.anomalies
+		assert table[ oid.OID('.1.3.6.1.2.1.1.3.1') ] == 31, table
+		assert len(table) == 10, table
+	def testToleratePast( self ):
+		"""Does a tolerant walk keep re-walking from a single bad OID?"""
+		self.agent.protocol.agent.dataStore = SkippingStore(
+			OIDs = self.oidsForTesting,
+		)
+		table = self.getLooping( orderingPolicy='tolerate', orderingTolerance=2 )
+		assert len(self.anomalies) == 3, self.anomalies
+		assert len(table) == 3, table
+
 if __name__ == "__main__":
 	unittest.main()
 		
@@ -1,5 +1,7 @@
-from twistedsnmp import bisectoidstore, agent, errors
+from twistedsnmp import bisectoidstore, overlayoidstore, agent, errors
+from twistedsnmp import dynamicvalues
 import unittest
+from twisted.internet import defer
 from twistedsnmp.pysnmpproto import v2c,v1, error
 try:
 	from twistedsnmp import bsdoidstore
@@ -52,6 +54,31 @@ class StorageTest( unittest.TestCase ):
 		assert result[0] == '.1.3.6.1.2.12.1.2.0', result
 		assert result[1] == 32, result
 
+	def testNextOIDs( self ):
+		"""Does the range-scan match chained nextOID calls?"""
+		store = self.createStorage(
+			[
+				('.1.3.6.1.2.1.1.%s.0'%(i,), i)
+				for i in range(1,11)
+			]
+		)
+		result = store.nextOIDs( '.1.3.6.1.2.1.1.1.0', 4 )
+		assert [value for (key,value) in result] == [2,3,4,5], result
+		base = '.1.3.6.1.2.1.1.1.0'
+		for key,value in result:
+			expected = store.nextOID( base )
+			assert (key,value) == expected, (key,value,expected)
+			base = key
+		result = store.nextOIDs( '.1.3.6.1.2.1.1.8.0', 10 )
+		assert [value for (key,value) in result] == [9,10], result
+		result = store.nextOIDs( '.1.3.6.1.2.1.1', 2 )
+		assert [value for (key,value) in result] == [1,2], result
+		self.failUnlessRaises(
+			errors.OIDNameError,
+			store.nextOIDs,
+			'.1.3.6.1.2.1.1.10.0', 5,
+		)
+
 	def testIter( self ):
 		"""Test basic iteration"""
 		store = self.createStorage(
@@ -225,6 +252,34 @@ class RecursiveTest( unittest.TestCase ):
 		)
 		result = store.nextOID( '.1.3.6.1' )
 		assert result == ( '.1.3.6.1.2.1.1.3.3', 44 ), result
+	def testNextOIDs( self ):
+		"""Does the range-scan chain into/out-of sub-storages?"""
+		store = bisectoidstore.BisectOIDStore(
+			[
+				('.1.3.6.1.2.1.1.1.0', 1),
+				('.1.3.6.1.2.1.1.5.0', 5),
+			]
+		)
+		assert not store.chained
+		store.setValue(
+			'.1.3.6.1.2.1.1.3',
+			bisectoidstore.BisectOIDStore([
+				('.1.3.6.1.2.1.1.3.3', 33),
+				('.1.3.6.1.2.1.1.3.4', 34),
+			]),
+		)
+		assert store.chained
+		result = store.nextOIDs( '.1.3.6.1.2.1.1.1.0', 5 )
+		assert result == [
+			('.1.3.6.1.2.1.1.3.3', 33),
+			('.1.3.6.1.2.1.1.3.4', 34),
+			('.1.3.6.1.2.1.1.5.0', 5),
+		], result
+		result = store.nextOIDs( '.1.3.6.1.2.1.1.3.3', 5 )
+		assert result == [
+			('.1.3.6.1.2.1.1.3.4', 34),
+			('.1.3.6.1.2.1.1.5.0', 5),
+		], result
 	def testCalculated( self ):
 		store = bisectoidstore.BisectOIDStore(
 			[
@@ -244,8 +299,180 @@ class RecursiveTest( unittest.TestCase ):
 		assert result[0] == '.1.3.6.1.2.1.1.1.0', result
 		assert result[1] == 550, result
 
-	
-		
+
+class DynamicValueTest( unittest.TestCase ):
+	"""Test for memoized values and table providers"""
+	def setUp( self ):
+		self.store = bisectoidstore.BisectOIDStore(
+			[
+				('.1.3.6.1.2.1.1.1.0', 1),
+				('.1.3.6.1.2.1.3.1.0', 3),
+			]
+		)
+		self.calls = 0
+	def calculate( self, *arguments ):
+		self.calls += 1
+		return self.calls
+	def table( self ):
+		self.calls += 1
+		return [
+			('.1.3.6.1.2.1.2.2.1.%s.%s'%(column,row), column*100+row)
+			for column in (1,2)
+			for row in (1,2,3)
+		]
+	def testMemoized( self ):
+		self.store.setValue(
+			'.1.3.6.1.2.1.1.2.0',
+			dynamicvalues.MemoizedValue( self.calculate, ttl=60 ),
+		)
+		for i in range(3):
+			result = self.store.getExactOID( '.1.3.6.1.2.1.1.2.0' )
+			assert result[1] == 1, result
+		assert self.calls == 1, self.calls
+	def testMemoizedDeferred( self ):
+		"""Do retrievals before a Deferred fires share a single call?"""
+		pending = []
+		def slow( oid, storage ):
+			self.calls += 1
+			d = defer.Deferred()
+			pending.append( d )
+			return d
+		self.store.setValue(
+			'.1.3.6.1.2.1.1.2.0',
+			dynamicvalues.MemoizedValue( slow, ttl=60 ),
+		)
+		results = []
+		for i in range(2):
+			d = self.store.getExactOID( '.1.3.6.1.2.1.1.2.0' )[1]
+			assert isinstance( d, defer.Deferred ), d
+			d.addCallback( results.append )
+		assert self.calls == 1, self.calls
+		pending[0].callback( 'slow' )
+		assert results == ['slow','slow'], results
+		result = self.store.getExactOID( '.1.3.6.1.2.1.1.2.0' )
+		assert result[1] == 'slow', result
+		assert self.calls == 1, self.calls
+	def testMemoizedDeferredFailure( self ):
+		"""Does each waiting retrieval get the failure, without caching it?"""
+		pending = []
+		def slow( oid, storage ):
+			self.calls += 1
+			d = defer.Deferred()
+			pending.append( d )
+			return d
+		self.store.setValue(
+			'.1.3.6.1.2.1.1.2.0',
+			dynamicvalues.MemoizedValue( slow, ttl=60 ),
+		)
+		failures = []
+		for i in range(2):
+			d = self.store.getExactOID( '.1.3.6.1.2.1.1.2.0' )[1]
+			assert isinstance( d, defer.Deferred ), d
+			d.addErrback( failures.append )
+		assert self.calls == 1, self.calls
+		pending[0].errback( ValueError( 'unavailable' ) )
+		assert len(failures) == 2, failures
+		for reason in failures:
+			assert reason.check( ValueError ), reason
+		# the failure was not cached, the function is called again
+		d = self.store.getExactOID( '.1.3.6.1.2.1.1.2.0' )[1]
+		assert isinstance( d, defer.Deferred ), d
+		assert self.calls == 2, self.calls
+		results = []
+		d.addCallback( results.append )
+		pending[1].callback( 'slow' )
+		assert results == ['slow'], results
+	def testTableProvider( self ):
+		"""Are walks of a provider's subtree served from one snapshot?"""
+		provider = dynamicvalues.TableProvider( self.table, ttl=60 )
+		self.store.setValue( '.1.3.6.1.2.1.2.2', provider )
+		result = self.store.nextOIDs( '.1.3.6.1.2.1.1.1.0', 10 )
+		assert [value for (key,value) in result] == [
+			101,102,103,201,202,203,3,
+		], result
+		result = self.store.nextOID( '.1.3.6.1.2.1.2.2' )
+		assert result == ('.1.3.6.1.2.1.2.2.1.1.1', 101), result
+		result = self.store.nextOID( '.1.3.6.1.2.1.2.2.1.2.3' )
+		assert result == ('.1.3.6.1.2.1.3.1.0', 3), result
+		result = self.store.getExactOID( '.1.3.6.1.2.1.2.2.1.2.2' )
+		assert result[1] == 202, result
+		assert provider.refreshes == 1, provider.refreshes
+		provider.refresh()
+		self.store.getExactOID( '.1.3.6.1.2.1.2.2.1.2.2' )
+		assert provider.refreshes == 2, provider.refreshes
+
+class OverlayTest( unittest.TestCase ):
+	"""Test for per-device overlays over a shared store"""
+	def setUp( self ):
+		self.base = bisectoidstore.BisectOIDStore(
+			[
+				('.1.3.6.1.2.1.1.%s.0'%(i,), i)
+				for i in range(1,11)
+			]
+		)
+		self.store = overlayoidstore.OverlayOIDStore(
+			self.base,
+			[
+				('.1.3.6.1.2.1.1.5.0', 'device'),
+				('.1.3.6.1.2.1.1.11.0', 'extra'),
+			],
+		)
+	def testExact( self ):
+		result = self.store.getExactOID( '.1.3.6.1.2.1.1.5.0' )
+		assert result[1] == 'device', result
+		result = self.store.getExactOID( '.1.3.6.1.2.1.1.4.0' )
+		assert result[1] == 4, result
+		result = self.base.getExactOID( '.1.3.6.1.2.1.1.5.0' )
+		assert result[1] == 5, result
+	def testNextOIDs( self ):
+		result = self.store.nextOIDs( '.1.3.6.1.2.1.1.4.0', 3 )
+		assert [value for (key,value) in result] == ['device',6,7], result
+		result = self.store.nextOIDs( '.1.3.6.1.2.1.1.9.0', 5 )
+		assert [value for (key,value) in result] == [10,'extra'], result
+		result = self.store.nextOID( '.1.3.6.1.2.1.1.10.0' )
+		assert result[0] == '.1.3.6.1.2.1.1.11.0', result
+		self.failUnlessRaises(
+			errors.OIDNameError,
+			self.store.nextOID, '.1.3.6.1.2.1.1.11.0',
+		)
+	def testWalkAcrossOverlayOnly( self ):
+		"""Do walks continue past OIDs only present in the overlay?"""
+		self.store.setValue( '.1.3.6.1.2.1.1.5.1', 'local' )
+		result = self.store.nextOIDs( '.1.3.6.1.2.1.1.5.0', 3 )
+		assert result == [
+			('.1.3.6.1.2.1.1.5.1', 'local'),
+			('.1.3.6.1.2.1.1.6.0', 6),
+			('.1.3.6.1.2.1.1.7.0', 7),
+		], result
+		result = self.store.nextOIDs( '.1.3.6.1.2.1.1.5.1', 2 )
+		assert result == [
+			('.1.3.6.1.2.1.1.6.0', 6),
+			('.1.3.6.1.2.1.1.7.0', 7),
+		], result
+		result = self.store.nextOID( '.1.3.6.1.2.1.1.5.1' )
+		assert result == ('.1.3.6.1.2.1.1.6.0', 6), result
+		walked = []
+		oid = '.1.3.6.1.2.1.1'
+		while 1:
+			try:
+				oid,value = self.store.nextOID( oid )
+			except errors.OIDNameError, err:
+				break
+			walked.append( value )
+		assert walked == [1,2,3,4,'device','local',6,7,8,9,10,'extra'], walked
+	def testSet( self ):
+		"""Are sets kept in the overlay, changing its version?"""
+		version = self.store.version
+		old = self.store.setValue( '.1.3.6.1.2.1.1.6.0', 'changed' )
+		assert old == 6, old
+		assert self.store.version != version
+		assert self.store.getExactOID( '.1.3.6.1.2.1.1.6.0' )[1] == 'changed'
+		assert self.base.getExactOID( '.1.3.6.1.2.1.1.6.0' )[1] == 6
+		assert not self.store.volatile
+		self.store.setValue( '.1.3.6.1.2.1.1.7.0', lambda oid,store: 77 )
+		assert self.store.volatile
+		assert self.store.getExactOID( '.1.3.6.1.2.1.1.7.0' )[1] == 77
+
 if bsdoidstore:
 	class BSDTest( object ):
 		def createStorage( self, oids ):
@@ -1,7 +1,7 @@
 """Tests for SNMP trap sending/receiving"""
 from twistedsnmp.test import basetestcase
 from twistedsnmp.pysnmpproto import v1, oid, alpha
-from twistedsnmp import agent
+from twistedsnmp import agent, responsecache
 from twisted.internet import defer, reactor
 import unittest
 
@@ -66,6 +66,100 @@ class TrapTestsV1( basetestcase.BaseTestCase ):
 		self.runFor( 1 )
 		assert not getattr( self, 'trap', None )
 
+	def test_routing( self ):
+		"""Are trap routes kept until the registrations change?"""
+		theAgent = self.agent.protocol.agent
+		first = theAgent.registerTrap( agent.TrapHandler(
+			managerIP = ('127.0.0.1',9),
+		))
+		assert theAgent.trapHandlers( 6, 8 ) == [first]
+		second = theAgent.registerTrap( agent.TrapHandler(
+			managerIP = ('127.0.0.1',10),
+			genericType = 6, specificType = 8,
+		))
+		handlers = theAgent.trapHandlers( 6, 8 )
+		assert len(handlers) == 2, handlers
+		assert first in handlers and second in handlers, handlers
+		assert theAgent.trapHandlers( 6, 0 ) == [first]
+		theAgent.deregisterTrap( ('127.0.0.1',10) )
+		assert theAgent.trapHandlers( 6, 8 ) == [first]
+	def test_batchedEncoding( self ):
+		"""Is a trap encoded once for all managers sharing a community?"""
+		theAgent = self.agent.protocol.agent
+		encoded = []
+		sent = []
+		for port in (9,10,11):
+			handler = theAgent.registerTrap( agent.TrapHandler(
+				managerIP = ('127.0.0.1',port),
+			))
+			original = handler.encode
+			def encode( *arguments, **named ):
+				encoded.append( arguments )
+				return original( *arguments, **named )
+			handler.encode = encode
+		protocol = theAgent.protocol
+		def send( message, address ):
+			sent.append( (message, address) )
+		protocol.send = send
+		count = theAgent.sendTrap( pdus=[('.1.3.6.1.2.1.1.3.0',None)] )
+		del protocol.send
+		assert count == 3, count
+		assert len(encoded) == 1, encoded
+		assert len(sent) == 3, sent
+		assert len(dict([(message,1) for (message,address) in sent])) == 1
+
+	def test_inform( self ):
+		"""Are informs re-sent until acknowledged?"""
+		theAgent = self.agent.protocol.agent
+		protocol = theAgent.protocol
+		manager = ('127.0.0.1',9)
+		theAgent.registerTrap( agent.TrapHandler(
+			managerIP = manager,
+			notification = agent.INFORM,
+			timeout = .1,
+		))
+		sent = []
+		def send( message, address ):
+			sent.append( message )
+		protocol.send = send
+		d = theAgent.sendInform( pdus=[('.1.3.6.1.2.1.1.3.0',None)] )
+		self.runFor( .25 )
+		del protocol.send
+		assert len(sent) >= 2, sent
+		assert sent[-1] == sent[0], sent
+		# acknowledge with a response echoing the request
+		tag, start, communityEnd, pduEnd, idStart, idEnd = responsecache.decodeMessage( sent[0] )
+		assert tag == responsecache.INFORM_TAG, repr(tag)
+		protocol.datagramReceived(
+			responsecache.joinResponse(
+				sent[0][start:communityEnd],
+				responsecache.requestID( sent[0] ),
+				sent[0][idEnd:pduEnd],
+			),
+			manager,
+		)
+		self.doUntilFinish( d )
+		assert self.success, self.response
+		assert self.response == [(True,manager)], self.response
+		assert protocol.informTracker.acknowledged == 1
+		assert not protocol.informTracker.outstanding
+	def test_informTimeout( self ):
+		"""Are unacknowledged informs failed after their retries?"""
+		theAgent = self.agent.protocol.agent
+		theAgent.registerTrap( agent.TrapHandler(
+			managerIP = ('127.0.0.1',9),
+			notification = agent.INFORM,
+			timeout = .05, retryCount = 1,
+		))
+		d = theAgent.sendInform( pdus=[('.1.3.6.1.2.1.1.3.0',None)] )
+		self.doUntilFinish( d )
+		assert self.success, self.response
+		assert len(self.response) == 1, self.response
+		assert not self.response[0][0], self.response
+		tracker = theAgent.protocol.informTracker
+		assert tracker.retried == 1, tracker.retried
+		assert tracker.failed == 1, tracker.failed
+
 	def runFor( self, seconds=1 ):
 		df = defer.Deferred()
 		def finish( ):
@@ -0,0 +1,212 @@
+"""Tests for the twinetables module"""
+import unittest, array
+from twistedsnmp import twinetables
+
+class RowAssemblerTest( unittest.TestCase ):
+	"""Test incremental row assembly from column walks"""
+	roots = ('.1.3.6.1.2.1.2.2.1.10', '.1.3.6.1.2.1.2.2.1.16')
+	def setUp( self ):
+		self.rows = []
+		self.assembler = twinetables.RowAssembler(
+			self.roots, self.onRow,
+		)
+	def onRow( self, suffix, record ):
+		self.rows.append( (suffix, record) )
+	def testIncremental( self ):
+		"""Are rows emitted once every column has passed them?"""
+		inOctets, outOctets = self.roots
+		assembler = self.assembler
+		for i in (1,2,3):
+			assembler.addRecord( inOctets, '%s.%s'%(inOctets,i), i )
+		assembler.flush()
+		# outOctets hasn't reported yet
+		assert not self.rows, self.rows
+		assembler.addRecord( outOctets, '%s.1'%(outOctets,), 10 )
+		assembler.addRecord( outOctets, '%s.2'%(outOctets,), 20 )
+		assembler.flush()
+		assert self.rows == [
+			('.1', {inOctets:1, outOctets:10}),
+			('.2', {inOctets:2, outOctets:20}),
+		], self.rows
+		assert len(assembler.pending) == 1, assembler.pending
+	def testOrdering( self ):
+		"""Are rows emitted in numeric (not string) index order?"""
+		inOctets, outOctets = self.roots
+		assembler = self.assembler
+		for i in (2,10):
+			assembler.addRecord( inOctets, '%s.%s'%(inOctets,i), i )
+			assembler.addRecord( outOctets, '%s.%s'%(outOctets,i), i )
+		assembler.flush()
+		assert [suffix for (suffix,record) in self.rows] == ['.2','.10'], self.rows
+	def testDuplicates( self ):
+		"""Are duplicated records ignored?"""
+		inOctets, outOctets = self.roots
+		assert self.assembler.addRecord( inOctets, inOctets+'.1', 1 )
+		assert not self.assembler.addRecord( inOctets, inOctets+'.1', 1 )
+	def testFinishColumn( self ):
+		"""Does an exhausted column stop holding back other columns?"""
+		inOctets, outOctets = self.roots
+		assembler = self.assembler
+		assembler.addRecord( inOctets, inOctets+'.1', 1 )
+		assembler.addRecord( outOctets, outOctets+'.1', 10 )
+		assembler.addRecord( outOctets, outOctets+'.2', 20 )
+		assembler.flush()
+		assert len(self.rows) == 1, self.rows
+		assembler.finishColumn( inOctets )
+		assembler.flush()
+		assert self.rows[-1] == ('.2', {outOctets:20}), self.rows
+	def testFinish( self ):
+		"""Does finish flush all pending rows?"""
+		inOctets, outOctets = self.roots
+		self.assembler.addRecord( inOctets, inOctets+'.1', 1 )
+		self.assembler.finish()
+		assert self.rows == [('.1', {inOctets:1})], self.rows
+		assert not self.assembler.pending
+
+class SnapshotTest( unittest.TestCase ):
+	"""Test change detection against table snapshots"""
+	inOctets = '.1.3.6.1.2.1.2.2.1.10'
+	def table( self, values ):
+		"""Create a getTable-style result for the inOctets column"""
+		return { self.inOctets: dict([
+			('%s.%s'%(self.inOctets,index), value)
+			for index,value in values.items()
+		]) }
+	def diff( self, snapshot, values ):
+		"""Feed rows for values through a differ, return reported changes"""
+		changes = []
+		def onChange( change, suffix, record ):
+			changes.append( (change, suffix, record) )
+		differ = snapshot.differ( onChange )
+		indices = values.keys()
+		indices.sort()
+		for index in indices:
+			differ( '.%s'%(index,), {self.inOctets:values[index]} )
+		differ.finish()
+		return changes
+	def testFromTable( self ):
+		"""Can we create a snapshot from a previous result?"""
+		snapshot = twinetables.TableSnapshot.fromTable(
+			self.table( {1:10, 2:20} ), [self.inOctets],
+		)
+		assert len(snapshot) == 2, snapshot.fingerprints
+	def testChanges( self ):
+		"""Are only added, changed and removed rows reported?"""
+		snapshot = twinetables.TableSnapshot.fromTable(
+			self.table( {1:10, 2:20, 3:30, 5:50} ), [self.inOctets],
+		)
+		changes = self.diff( snapshot, {1:10, 2:21, 4:40, 5:50} )
+		assert changes == [
+			(twinetables.CHANGED, '.2', {self.inOctets:21}),
+			(twinetables.REMOVED, '.3', None),
+			(twinetables.ADDED, '.4', {self.inOctets:40}),
+		], changes
+		# snapshot now reflects the latest poll
+		assert self.diff( snapshot, {1:10, 2:21, 4:40, 5:50} ) == []
+	def testRemovedAtEnd( self ):
+		"""Are trailing missing rows reported on finish?"""
+		snapshot = twinetables.TableSnapshot.fromTable(
+			self.table( {1:10, 2:20} ), [self.inOctets],
+		)
+		changes = self.diff( snapshot, {1:10} )
+		assert changes == [(twinetables.REMOVED, '.2', None)], changes
+		assert len(snapshot) == 1
+
+class ColumnarTest( unittest.TestCase ):
+	"""Test the columnar (array-backed) twined form"""
+	inOctets = '.1.3.6.1.2.1.2.2.1.10'
+	descr = '.1.3.6.1.2.1.2.2.1.2'
+	oidTable = {
+		inOctets: {
+			inOctets+'.10': 100, inOctets+'.2': 20, inOctets+'.1': 10,
+		},
+		descr: {
+			descr+'.1': 'eth0', descr+'.2': 'eth1', descr+'.3': 'lo',
+		},
+	}
+	def testColumns( self ):
+		"""Are the index and columns aligned and in numeric order?"""
+		table = twinetables.columnarTwine( self.oidTable, [self.inOctets, self.descr] )
+		assert len(table) == 4, table.index
+		assert table.suffixes == ['.1','.2','.3','.10'], table.suffixes
+		assert table.columns[self.inOctets] == [10,20,None,100], table.columns
+		assert table.columns[self.descr] == ['eth0','eth1','lo',None], table.columns
+	def testLookup( self ):
+		"""Can we look up rows and values by suffix?"""
+		table = twinetables.columnarTwine( self.oidTable, [self.inOctets, self.descr] )
+		assert table.row( '.3' ) == {self.descr:'lo'}, table.row( '.3' )
+		assert table.get( '.10', self.inOctets ) == 100
+		assert table.get( '.10', self.descr, 'x' ) == 'x'
+		assert table.get( '.4', self.descr ) is None
+		self.assertRaises( KeyError, table.row, '.4' )
+	def testMatchesTwine( self ):
+		"""Does iteration produce the same rows as twineTables?"""
+		oids = [self.inOctets, self.descr]
+		table = twinetables.columnarTwine( self.oidTable, oids )
+		assert dict(list(table)) == twinetables.twineTables( self.oidTable, oids )
+	def testCompact( self ):
+		"""Are fully-populated numeric columns stored as arrays?"""
+		oidTable = {
+			self.inOctets: {
+				self.inOctets+'.2': 20, self.inOctets+'.1': 10,
+			},
+			self.descr: {
+				self.descr+'.1': 'eth0', self.descr+'.2': 'eth1',
+			},
+		}
+		table = twinetables.columnarTwine( oidTable, [self.inOctets, self.descr] )
+		column = table.columns[self.inOctets]
+		assert isinstance( column, array.array ), column
+		assert list(column) == [10,20], column
+		assert isinstance( table.columns[self.descr], list )
+		assert table.row( '.2' ) == {self.inOctets:20,self.descr:'eth1'}, table.row( '.2' )
+		big = twinetables.compactColumn( [1, 2**80] )
+		assert big == [1, 2**80], big
+	def testNumpy( self ):
+		"""Are numeric columns converted to NumPy arrays?"""
+		if twinetables.numpy is None:
+			return
+		table = twinetables.columnarTwine(
+			self.oidTable, [self.inOctets, self.descr], useNumpy=True,
+		)
+		column = table.columns[self.inOctets]
+		assert isinstance( column, twinetables.numpy.ndarray ), column
+		assert column[0] == 10 and column[3] == 100, column
+		assert column[2] != column[2], column
+		assert isinstance( table.columns[self.descr], list )
+		assert table.row( '.3' ) == {self.descr:'lo'}, table.row( '.3' )
+
+class MergeTwineTest( unittest.TestCase ):
+	"""Test merge-based streaming twining"""
+	inOctets = ColumnarTest.inOctets
+	descr = ColumnarTest.descr
+	oidTable = ColumnarTest.oidTable
+	def testSorted( self ):
+		"""Are getTable results twined in numeric index order?"""
+		oids = [self.inOctets, self.descr]
+		rows = list( twinetables.sortedTwine( self.oidTable, oids ))
+		assert [suffix for (suffix,record) in rows] == ['.1','.2','.3','.10'], rows
+		assert dict(rows) == twinetables.twineTables( self.oidTable, oids )
+		# the input is not consumed
+		assert len(self.oidTable[self.inOctets]) == 3
+	def testStreaming( self ):
+		"""Are rows yielded before the columns are exhausted?"""
+		consumed = []
+		def column( root, count ):
+			for i in range( 1, count+1 ):
+				consumed.append( (root,i) )
+				yield '%s.%s'%(root,i), i
+		rows = twinetables.mergeTwine([
+			(self.inOctets, column( self.inOctets, 1000 )),
+			(self.descr, column( self.descr, 2 )),
+		])
+		suffix, record = rows.next()
+		assert suffix == '.1', suffix
+		assert record == {self.inOctets:1, self.descr:1}, record
+		assert len(consumed) == 4, consumed
+		remaining = list( rows )
+		assert len(remaining) == 999, len(remaining)
+		assert remaining[-1] == ('.1000', {self.inOctets:1000}), remaining[-1]
+
+if __name__ == "__main__":
+	unittest.main()
@@ -12,7 +12,39 @@ the returned structure into one of this form:
 	extension: { rootOID: value }
 
 where extension is fullOID[len(rootOID):]
+
+RowAssembler performs the same twining incrementally while
+a table is being walked (see getTable's rowCallback), so that
+complete rows can be processed before the walk has finished.
+
+TableSnapshot records a compact fingerprint for each row of a
+table so that later walks can report only the rows which were
+added, removed or changed (see getTable's changeCallback).
+
+columnarTwine produces a ColumnarTable, holding a single sorted
+index plus one value sequence per column rather than a dictionary
+for every row, fully-populated numeric columns are stored as
+array.array (or NumPy arrays on request).  See
+utilities/benchtwine.py for time and peak-memory comparisons.
+
+mergeTwine twines pre-sorted column iterators in a single merge
+pass, yielding rows lazily in index order, sortedTwine applies it
+to getTable results.
 """
+try:
+	from hashlib import md5
+except ImportError:
+	from md5 import new as md5
+import bisect, array
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+ADDED = 'added'
+CHANGED = 'changed'
+REMOVED = 'removed'
+
 
 def twineTables( oidTable, oids ):
 	"""Given oidTable with root OIDs, give per-item version
@@ -66,3 +98,432 @@ def iterTwine( oidTable, oids ):
 			except KeyError, err:
 				pass 
 		yield suffix, record 
+
+
+def sortedColumn( root, table ):
+	"""Get (oid, value) items of a getTable column sorted in index order
+
+	root -- root OID of the column
+	table -- { oid: value } column from a getTable result
+	"""
+	return [
+		(root+suffix,value)
+		for (sortable,suffix,value) in sortedSuffixes( root, table )
+	]
+
+def sortedSuffixes( root, table ):
+	"""Get sorted (sortable, suffix, value) items of a getTable column"""
+	length = len(root)
+	items = [
+		(sortableSuffix( key[length:] ),key[length:],value)
+		for key,value in table.iteritems()
+	]
+	items.sort()
+	return items
+
+def mergeTwine( columns ):
+	"""Twine pre-sorted columns in a single merge pass
+
+	columns -- sequence of (root, iterable) where iterable yields
+		(oid, value) for the column in index order, i.e. the order
+		of a column walk (see sortedColumn)
+
+	Only the head of each column is held, so the columns may be
+	streaming (e.g. a generator fed from a walk), and each row is
+	yielded as soon as all columns have passed its index.
+
+	yields (suffix,record) in index order, with record as dict
+	with the column roots as keys, as for iterTwine
+	"""
+	def suffixes( root, iterable ):
+		length = len(root)
+		for key,value in iterable:
+			suffix = key[length:]
+			yield sortableSuffix( suffix ), suffix, value
+	return mergeSuffixes([
+		(root, suffixes( root, iterable ))
+		for (root,iterable) in columns
+	])
+
+def mergeSuffixes( columns ):
+	"""Merge pre-sorted columns of (sortable, suffix, value) into rows
+
+	columns -- sequence of (root, iterable) where iterable yields
+		(sortableSuffix, suffix, value) in index order
+
+	Implementation of mergeTwine for columns whose sortable
+	suffixes are already calculated (see sortedSuffixes).
+	"""
+	heads = []
+	for root,iterable in columns:
+		iterator = iter(iterable)
+		for sortable,suffix,value in iterator:
+			heads.append( [sortable,suffix,value,root,iterator] )
+			break
+	# columns are few and tend to share indices, so a linear scan of
+	# the column heads beats a heap here
+	while heads:
+		current = min([ head[0] for head in heads ])
+		record = {}
+		exhausted = False
+		for head in heads:
+			if head[0] == current:
+				suffix = head[1]
+				record[ head[3] ] = head[2]
+				try:
+					head[:3] = head[4].next()
+				except StopIteration:
+					head[0] = None
+					exhausted = True
+		if exhausted:
+			heads = [ head for head in heads if head[0] is not None ]
+		yield suffix, record
+
+def sortedTwine( oidTable, oids ):
+	"""Twine getTable result in index order with mergeTwine
+
+	oidTable -- raw results from getTable query
+	oids -- oids to extract from oidTable as the columns
+
+	Unlike iterTwine, does not modify oidTable, and yields the
+	rows in index order.
+
+	yields (suffix,record) with record as dict with passed oids as keys
+	"""
+	return mergeSuffixes([
+		(oid, sortedSuffixes( oid, oidTable.get( oid, {} )))
+		for oid in oids
+	])
+
+
+def sortableSuffix( suffix ):
+	"""Convert an OID suffix (string or OID) to a sortable tuple of integers"""
+	if isinstance( suffix, (str,unicode)):
+		if suffix[:1] == '.':
+			suffix = suffix[1:]
+		if not suffix:
+			return ()
+		return tuple( map( int, suffix.split('.') ) )
+	return tuple( suffix )
+
+class RowAssembler( object ):
+	"""Incrementally twine records from a multi-column walk into rows
+
+	Column walks proceed in lexicographic order, so once every
+	column being walked has reached (or passed) a given index
+	suffix, no further values can arrive for that suffix and the
+	row can be handed off to the client.  Only the incomplete rows
+	are held in memory.
+
+	The rowCallback is called as rowCallback( suffix, record ),
+	where record is a dictionary with root OIDs as keys, i.e.
+	the same format yielded by iterTwine.  Rows are emitted in
+	index order.
+	"""
+	def __init__( self, roots, rowCallback ):
+		"""Initialise the assembler
+
+		roots -- the column root OIDs being walked
+		rowCallback -- callable as rowCallback( suffix, record )
+		"""
+		self.roots = list(roots)
+		self.rowCallback = rowCallback
+		self.positions = {} # root: sortable suffix of last record
+		self.finished = {} # root: 1 for exhausted columns
+		self.pending = {} # sortable: (suffix, record)
+	def addRecord( self, root, key, value ):
+		"""Add single (root, key, value) record
+
+		returns true if the record was added, false if it was
+		a duplicate (or otherwise at/before the column's
+		current position).  Does not emit rows, call flush()
+		after adding a batch of records.
+		"""
+		suffix = key[len(root):]
+		position = sortableSuffix( suffix )
+		current = self.positions.get( root )
+		if current is not None and position <= current:
+			return False
+		self.positions[ root ] = position
+		row = self.pending.get( position )
+		if row is None:
+			self.pending[ position ] = row = (suffix, {})
+		row[1][ root ] = value
+		return True
+	def finishColumn( self, root ):
+		"""Note that the column for root has been exhausted"""
+		self.finished[ root ] = 1
+	def flush( self ):
+		"""Emit all rows which are now complete
+
+		returns the number of rows emitted
+		"""
+		positions = []
+		for root in self.roots:
+			if self.finished.has_key( root ):
+				continue
+			position = self.positions.get( root )
+			if position is None:
+				# column hasn't reported yet, can't be sure of anything
+				return 0
+			positions.append( position )
+		if positions:
+			limit = min( positions )
+			ready = [ key for key in self.pending.keys() if key <= limit ]
+		else:
+			ready = self.pending.keys()
+		ready.sort()
+		for key in ready:
+			suffix, record = self.pending.pop( key )
+			self.rowCallback( suffix, record )
+		return len(ready)
+	def finish( self ):
+		"""Mark all columns finished and emit all remaining rows"""
+		for root in self.roots:
+			self.finishColumn( root )
+		return self.flush()
+
+
+def columnarTwine( oidTable, oids, useNumpy=False ):
+	"""Twine oidTable into a ColumnarTable
+
+	oidTable -- raw results from getTable query
+	oids -- oids to extract from oidTable as the table's columns
+	useNumpy -- if true, numeric columns are stored as NumPy
+		arrays (see ColumnarTable.numericColumn)
+
+	raises ImportError if useNumpy and NumPy is not available
+	"""
+	if not oids:
+		raise ValueError( """Null oids argument specified, require at least 1 oid to twine""" )
+	# gather the distinct suffixes, each is converted to sortable
+	# form exactly once, regardless of how many columns it is in
+	positions = {}
+	for oid in oids:
+		length = len(oid)
+		for key in oidTable.get( oid, {} ).iterkeys():
+			positions[ key[length:] ] = None
+	ordered = [ (sortableSuffix( suffix ), suffix) for suffix in positions.iterkeys() ]
+	ordered.sort()
+	index = [ sortable for (sortable,suffix) in ordered ]
+	suffixList = [ suffix for (sortable,suffix) in ordered ]
+	del ordered
+	for i,suffix in enumerate(suffixList):
+		positions[ suffix ] = i
+	columns = {}
+	for oid in oids:
+		length = len(oid)
+		column = [None] * len(index)
+		for key,value in oidTable.get( oid, {} ).iteritems():
+			column[ positions[ key[length:] ] ] = value
+		columns[ oid ] = compactColumn( column )
+	del positions
+	result = ColumnarTable( index, suffixList, columns )
+	if useNumpy:
+		for oid in oids:
+			try:
+				result.columns[ oid ] = result.numericColumn( oid )
+			except (TypeError,ValueError):
+				# not a numeric column, leave as a list
+				pass
+	return result
+
+def compactColumn( column ):
+	"""Store a fully-populated numeric column as an array.array
+
+	column -- list of values in index order
+
+	Integer columns become array('l'), float columns array('d'),
+	columns with missing (None) or non-numeric values, or with
+	integers too large for a C long, are returned unchanged.
+	"""
+	types = {}
+	for value in column:
+		types[ type(value) ] = 1
+	if not types:
+		return column
+	for typecode,allowed in (('l',(int,long)),('d',(float,))):
+		if not [t for t in types.keys() if t not in allowed]:
+			try:
+				return array.array( typecode, column )
+			except OverflowError:
+				return column
+	return column
+
+class ColumnarTable( object ):
+	"""Column-oriented twined table
+
+	attributes:
+		index -- sorted list of sortable (integer-tuple) suffixes
+		suffixes -- the original suffixes, in index order
+		columns -- { rootOID: values } where values is a list,
+			array.array (see compactColumn) or NumPy array in
+			index order, with None (or NaN) for rows missing from
+			the column
+	"""
+	def __init__( self, index, suffixes, columns ):
+		"""Initialise the table (see columnarTwine)"""
+		self.index = index
+		self.suffixes = suffixes
+		self.columns = columns
+	def __len__( self ):
+		"""Return the number of rows in the table"""
+		return len(self.index)
+	def __iter__( self ):
+		"""Iterate (suffix, record) in index order, as iterTwine"""
+		for position in xrange( len(self.index) ):
+			yield self.suffixes[position], self.record( position )
+	def position( self, suffix ):
+		"""Get row position for suffix (string, OID or sortable tuple)
+
+		raises KeyError if the suffix is not in the table
+		"""
+		if not isinstance( suffix, tuple ):
+			suffix = sortableSuffix( suffix )
+		position = bisect.bisect_left( self.index, suffix )
+		if position >= len(self.index) or self.index[position] != suffix:
+			raise KeyError( suffix )
+		return position
+	def record( self, position ):
+		"""Get { rootOID: value } record for row at position"""
+		record = {}
+		for oid,column in self.columns.iteritems():
+			value = column[position]
+			if value is not None and value == value:
+				record[ oid ] = value
+		return record
+	def row( self, suffix ):
+		"""Get { rootOID: value } record for suffix
+
+		raises KeyError if the suffix is not in the table
+		"""
+		return self.record( self.position( suffix ) )
+	def get( self, suffix, oid, default=None ):
+		"""Get single value for suffix in column oid (or default)"""
+		try:
+			value = self.columns[oid][ self.position( suffix ) ]
+		except KeyError:
+			return default
+		if value is None or value != value:
+			return default
+		return value
+	def numericColumn( self, oid, dtype=None ):
+		"""Get column oid as a NumPy array
+
+		dtype -- NumPy dtype, by default int64 if the column has
+			no missing values, otherwise float64 with NaN for
+			missing values
+
+		raises ImportError if NumPy is not available, TypeError
+		or ValueError if the column is not numeric
+		"""
+		if numpy is None:
+			raise ImportError( """NumPy is required for numeric columns""" )
+		column = self.columns[ oid ]
+		if isinstance( column, numpy.ndarray ):
+			return column
+		for value in column:
+			if value is not None and not isinstance( value, (int,long,float) ):
+				raise TypeError( """Column %s has non-numeric value %r"""%(oid,value))
+		if dtype is None:
+			if None in column:
+				dtype = numpy.float64
+			else:
+				dtype = numpy.int64
+		return numpy.array(
+			[ (value is None and numpy.nan) or value for value in column ],
+			dtype = dtype,
+		)
+
+def rowFingerprint( record ):
+	"""Calculate a compact (16-byte) fingerprint for a twined row record"""
+	items = record.items()
+	items.sort()
+	return md5( repr(items) ).digest()
+
+class TableSnapshot( object ):
+	"""Compact record of a table's rows for change detection
+
+	Only the suffix and a fingerprint of each row are held, keyed
+	by the sortable form of the suffix, so a snapshot is much
+	smaller than the table it describes.  Pass the same snapshot
+	to each poll of the table (getTable's snapshot argument), it
+	is updated when each walk completes.
+	"""
+	def __init__( self, fingerprints=None ):
+		"""Initialise the snapshot
+
+		fingerprints -- { sortableSuffix: (suffix, fingerprint) }
+		"""
+		self.fingerprints = fingerprints or {}
+	def fromTable( cls, oidTable, oids ):
+		"""Create a snapshot from a (previous) getTable result
+
+		oidTable -- raw results from getTable query
+		oids -- the root OIDs of the table's columns
+		"""
+		fingerprints = {}
+		for suffix, record in twineTables( oidTable, oids ).iteritems():
+			fingerprints[ sortableSuffix(suffix) ] = (suffix, rowFingerprint(record))
+		return cls( fingerprints )
+	fromTable = classmethod( fromTable )
+	def __len__( self ):
+		"""Return the number of rows in the snapshot"""
+		return len(self.fingerprints)
+	def differ( self, changeCallback ):
+		"""Create a SnapshotDiffer comparing new rows against this snapshot"""
+		return SnapshotDiffer( self, changeCallback )
+
+class SnapshotDiffer( object ):
+	"""Compare a stream of rows (in index order) against a TableSnapshot
+
+	Used as the rowCallback for a RowAssembler, calls
+	changeCallback( change, suffix, record ) for each row which
+	is ADDED or CHANGED as it arrives, and for each row of the
+	snapshot which is REMOVED (with record None) as soon as a
+	later row shows it is missing.  Unchanged rows are not
+	reported.
+
+	finish() reports the remaining removed rows and replaces the
+	snapshot's fingerprints with those of the new rows.
+	"""
+	def __init__( self, snapshot, changeCallback ):
+		"""Initialise the differ
+
+		snapshot -- TableSnapshot for the previous poll
+		changeCallback -- callable as changeCallback( change, suffix, record )
+		"""
+		self.snapshot = snapshot
+		self.changeCallback = changeCallback
+		self.previous = snapshot.fingerprints
+		self.remaining = self.previous.keys()
+		self.remaining.sort()
+		self.position = 0
+		self.current = {}
+	def __call__( self, suffix, record ):
+		"""Compare the row for suffix against the snapshot"""
+		key = sortableSuffix( suffix )
+		self.removedBefore( key )
+		fingerprint = rowFingerprint( record )
+		self.current[ key ] = (suffix, fingerprint)
+		old = self.previous.get( key )
+		if old is None:
+			self.changeCallback( ADDED, suffix, record )
+		elif old[1] != fingerprint:
+			self.changeCallback( CHANGED, suffix, record )
+	def removedBefore( self, key=None ):
+		"""Report snapshot rows before key (or all remaining) as removed"""
+		remaining = self.remaining
+		while self.position < len(remaining):
+			previous = remaining[ self.position ]
+			if key is not None and previous >= key:
+				if previous == key:
+					self.position += 1
+				break
+			self.position += 1
+			if not self.current.has_key( previous ):
+				self.changeCallback( REMOVED, self.previous[previous][0], None )
+	def finish( self ):
+		"""Report remaining removed rows and update the snapshot"""
+		self.removedBefore( None )
+		self.snapshot.fingerprints = self.current
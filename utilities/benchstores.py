@@ -0,0 +1,92 @@
+"""Benchmark GETBULK serving throughput for each OIDStore
+
+Usage:
+	python benchstores.py [rows [maxRepetitions]]
+
+Walks a synthetic 4-column table with Agent.getTableOIDs (the core
+of the agent's GETBULK handling) for each available store, both
+with the store's nextOIDs range-scan and with the chained
+per-OID nextOID calls used previously.
+"""
+from twistedsnmp import agent, bisectoidstore, oidstore
+from twistedsnmp.pysnmpproto import v2c, oid
+import time, sys, os, tempfile
+try:
+	from twistedsnmp import bsdoidstore
+except ImportError:
+	bsdoidstore = None
+
+OID = oid.OID
+ROOTS = [ '.1.3.6.1.2.1.2.2.1.%s'%(column,) for column in range(1,5) ]
+
+def createOIDs( rows ):
+	"""Create the synthetic table's OID,value pairs"""
+	return [
+		('%s.%s'%(root,row), row)
+		for root in ROOTS
+		for row in xrange( 1, rows+1 )
+	]
+
+class Chained( object ):
+	"""Store wrapper using chained nextOID calls for nextOIDs"""
+	def __init__( self, store ):
+		self.store = store
+		self.nextOID = store.nextOID
+	def nextOIDs( self, base, count ):
+		return oidstore.OIDStore.nextOIDs.im_func( self, base, count )
+
+def walk( store, maxRepetitions ):
+	"""Walk ROOTS as a manager would with GETBULK requests
+
+	returns number of varbinds served
+	"""
+	served = 0
+	server = agent.Agent( store )
+	columns = [ (OID(root),OID(root)) for root in ROOTS ]
+	while columns:
+		result = server.getTableOIDs(
+			(), [base for (root,base) in columns], maxRepetitions,
+		)
+		served += len(result)
+		lastRow = result[-len(columns):]
+		# continue columns which haven't reached the end of the table
+		columns = [
+			(root,OID(key))
+			for ((root,base),(key,value)) in zip( columns, lastRow )
+			if not isinstance( value, v2c.EndOfMibView )
+			and oidstore.dumbPrefix( root, OID(key) )
+		]
+	return served
+
+def timed( name, store, maxRepetitions ):
+	"""Time a full walk of store, printing varbinds/second"""
+	t = time.time()
+	served = walk( store, maxRepetitions )
+	elapsed = time.time() - t
+	print '%-24s %8.3fs %10.0f varbinds/s'%( name, elapsed, served/(elapsed or 1e-9) )
+
+def main( rows=10000, maxRepetitions=64 ):
+	OIDs = createOIDs( rows )
+	print '%s rows x %s columns, maxRepetitions=%s'%( rows, len(ROOTS), maxRepetitions )
+	stores = [
+		('BisectOIDStore', bisectoidstore.BisectOIDStore( OIDs )),
+	]
+	filename = None
+	if bsdoidstore is not None:
+		filename = tempfile.mktemp( '.bsd' )
+		stores.append( ('BSDOIDStore', bsdoidstore.BSDOIDStore(
+			bsdoidstore.BSDOIDStore.open( filename, 'n' ),
+			OIDs = OIDs,
+		)))
+	try:
+		for name,store in stores:
+			timed( name+' nextOIDs', store, maxRepetitions )
+			timed( name+' nextOID', Chained( store ), maxRepetitions )
+	finally:
+		for name,store in stores:
+			store.close()
+		if filename and os.path.exists( filename ):
+			os.remove( filename )
+
+if __name__ == "__main__":
+	main( *[int(x) for x in sys.argv[1:]] )
@@ -0,0 +1,105 @@
+"""Benchmark the table twining functions
+
+Usage:
+	python benchtwine.py [rows [columns]]
+
+Times twineTables, iterTwine, sortedTwine (merge-based) and
+columnarTwine on a synthetic getTable result of the given size.
+
+Each function is run in its own child process, so that the
+reported peak memory (growth of the process' maximum resident
+set size while twining, see resource.getrusage) is not inflated
+by the functions run before it.
+"""
+from twistedsnmp import twinetables
+import time, sys, os, resource, traceback
+
+FUNCTIONS = [
+	('twineTables', twinetables.twineTables),
+	('iterTwine', twinetables.iterTwine),
+	('sortedTwine', twinetables.sortedTwine),
+	('columnarTwine', twinetables.columnarTwine),
+]
+
+def createTable( rows, columns ):
+	"""Create synthetic { root: { oid: value } } getTable result"""
+	roots = [ '.1.3.6.1.2.1.2.2.1.%s'%(column+1,) for column in range(columns) ]
+	oidTable = {}
+	for root in roots:
+		oidTable[ root ] = dict([
+			('%s.%s'%(root,row), row)
+			for row in xrange( 1, rows+1 )
+		])
+	return oidTable, roots
+
+def copyTable( oidTable ):
+	"""Copy oidTable (iterTwine consumes its argument)"""
+	return dict([ (root,table.copy()) for (root,table) in oidTable.items() ])
+
+def peakMemory( ):
+	"""Get the process' peak resident set size in KB"""
+	peak = resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+	if sys.platform == 'darwin':
+		# reported in bytes rather than KB
+		peak = peak / 1024
+	return peak
+
+def timed( name, function, oidTable, roots, rows ):
+	"""Time function( oidTable, roots ), consuming iterators
+
+	The result is held until the peak memory has been measured,
+	so the reported growth includes the twined table itself.
+	"""
+	oidTable = copyTable( oidTable )
+	before = peakMemory()
+	t = time.time()
+	result = function( oidTable, roots )
+	if not isinstance( result, (dict,twinetables.ColumnarTable) ):
+		count = 0
+		for suffix,record in result:
+			count += 1
+		assert count == rows, (name, count)
+	elapsed = time.time() - t
+	growth = peakMemory() - before
+	print '%-14s %8.3fs %10.0f rows/s %10.1fMB peak growth'%(
+		name, elapsed, rows/(elapsed or 1e-9), growth/1024.0,
+	)
+	sys.stdout.flush()
+
+def runChild( name, rows, columns ):
+	"""Run a single named benchmark in this (child) process"""
+	oidTable, roots = createTable( rows, columns )
+	if name == 'mergeTwine':
+		columns = [
+			(root, twinetables.sortedColumn( root, oidTable[root] ))
+			for root in roots
+		]
+		before = peakMemory()
+		t = time.time()
+		count = 0
+		for suffix,record in twinetables.mergeTwine( columns ):
+			count += 1
+		elapsed = time.time() - t
+		growth = peakMemory() - before
+		print '%-14s %8.3fs %10.0f rows/s %10.1fMB peak growth (pre-sorted walk order)'%(
+			'mergeTwine', elapsed, rows/(elapsed or 1e-9), growth/1024.0,
+		)
+	else:
+		timed( name, dict(FUNCTIONS)[name], oidTable, roots, rows )
+
+def main( rows=100000, columns=4 ):
+	print '%s rows, %s columns'%( rows, columns )
+	sys.stdout.flush()
+	for name in [name for (name,function) in FUNCTIONS] + ['mergeTwine']:
+		pid = os.fork()
+		if not pid:
+			try:
+				runChild( name, rows, columns )
+			except Exception:
+				traceback.print_exc()
+				os._exit( 1 )
+			os._exit( 0 )
+		os.waitpid( pid, 0 )
+
+if __name__ == "__main__":
+	main( *[int(x) for x in sys.argv[1:]] )
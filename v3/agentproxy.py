@@ -131,7 +131,10 @@ class AgentProxy:
 		recordCallback=None,
 		retryCount=4, timeout= 2.0,
 		maxRepetitions= DEFAULT_BULK_REPETITION_SIZE,
-		startOIDs=None,
+		startOIDs=None, nonRepeaters=(), rowCallback=None,
+		orderingPolicy=tableretriever.STRICT, orderingTolerance=3,
+		anomalyCallback=None, integrationBudget=None,
+		snapshot=None, changeCallback=None,
 	):
 		"""Convenience method for creating and running a TableRetriever
 
@@ -154,11 +157,41 @@ class AgentProxy:
 			i.e. if passed in, we retrieve the table from startOIDs to
 			the end of the table excluding startOIDs themselves, rather 
 			than from roots to the end of the table.
+		nonRepeaters -- optional scalar OIDs (e.g. sysUpTime) to be
+			retrieved with get-next semantics in the first request
+			(as the GETBULK non-repeaters), saving a separate get
+			request.  Pass the object OID, not the instance OID, i.e.
+			'.1.3.6.1.2.1.1.3' to retrieve '.1.3.6.1.2.1.1.3.0'.
+		rowCallback -- if specified, roots are treated as the columns
+			of a single table and rowCallback( suffix, record ) is
+			called with each (twined) row as soon as all columns have
+			passed its index, see twinetables.RowAssembler.  Table
+			values are then not included in the final result.
+		orderingPolicy -- how to handle agents which return OIDs
+			which do not increase (e.g. looping agents), one of
+			'strict', 'tolerate' or 'skip', see
+			tableretriever.TableRetriever
+		orderingTolerance -- number of non-increasing OIDs tolerated
+			per column for the 'tolerate' and 'skip' policies
+		anomalyCallback -- called for each non-increasing OID as
+			anomalyCallback( root, previousOID, returnedOID )
+		integrationBudget -- if specified, maximum microseconds spent
+			integrating a large response before yielding to the
+			reactor
+		snapshot -- twinetables.TableSnapshot (updated in-place when
+			the walk completes) or previous result for the table,
+			used with changeCallback
+		changeCallback -- if specified, only rows which were added,
+			changed or removed since snapshot are reported, as
+			changeCallback( change, suffix, record ), see
+			twinetables.SnapshotDiffer.  Table values are then not
+			included in the final result.
 
 		Will use bulk downloading when available (i.e. if
 		we have implementation v2c, not v1).
 
-		return value is a defered for a { rootOID: { oid: value } } mapping
+		return value is a defered for a { rootOID: { oid: value } } mapping,
+		with non-repeating OIDs reported as { nonRepeaterOID: { oid: value } }
 		"""
 		log.debug(
 			'getTable( %r, %r, %r, %r, %r, %r )',
@@ -192,10 +225,19 @@ class AgentProxy:
 			self, roots, includeStart=includeStart,
 			retryCount=retryCount, timeout= timeout,
 			maxRepetitions = maxRepetitions,
+			nonRepeaters = nonRepeaters,
+			orderingPolicy = orderingPolicy,
+			orderingTolerance = orderingTolerance,
+			anomalyCallback = anomalyCallback,
+			integrationBudget = integrationBudget,
 		)
 		if self.verbose:
 			retriever.verbose = 1
-		return retriever( recordCallback = recordCallback,startOIDs = startOIDs,)
+		return retriever(
+			recordCallback = recordCallback,startOIDs = startOIDs,
+			rowCallback = rowCallback,
+			snapshot = snapshot, changeCallback = changeCallback,
+		)
 	
 	def dispatchTrap(
 		self, message 
@@ -252,6 +294,7 @@ class AgentProxy:
 		maxRepetitions=DEFAULT_BULK_REPETITION_SIZE,
 		# tables suppress all caching for requests past first...
 		allowCache = True,
+		nonRepeaters = 0,
 	):
 		"""Encode a datagram message
 		
@@ -262,14 +305,16 @@ class AgentProxy:
 		next -- whether this is to be a getnext query 
 		bulk -- whether this is to be a getbulk query
 		maxRepetitions -- max number of repeating values for getbulk
+		nonRepeaters -- number of leading oids which are to be treated
+			as non-repeating (single get-next) values for getbulk
 		allowCache -- if True, and self.allowCache and not set,
 			then we will store and re-use request objects.  allowCache is 
 			used by the  tabular retrieval code to avoid caching queries 
 			beyond the first, as these are likely to be highly variable.
 		"""
 		log.debug(
-			'encode( %r, %r, %r, %r, %r, %r )',
-			oids, community, next, bulk, set, maxRepetitions,
+			'encode( %r, %r, %r, %r, %r, %r, %r )',
+			oids, community, next, bulk, set, maxRepetitions, nonRepeaters,
 		)
 		doCache = allowCache and self.allowCache and (not set)
 		if doCache:
@@ -279,7 +324,7 @@ class AgentProxy:
 				pduKey = 'get_next_request'
 			else:
 				pduKey = 'get_request'
-			cacheKey = pduKey,tuple(oids),community,self.snmpVersion,maxRepetitions
+			cacheKey = pduKey,tuple(oids),community,self.snmpVersion,maxRepetitions,nonRepeaters
 			request = self.CACHE.get( cacheKey )
 			if request is not None:
 				# this is hacky, initialValue is the incrementer for the global value
@@ -292,6 +337,7 @@ class AgentProxy:
 		if bulk:
 			request = implementation.GetBulkRequest()
 			request.apiGenGetPdu().apiGenSetMaxRepetitions( maxRepetitions )
+			request.apiGenGetPdu().apiGenSetNonRepeaters( nonRepeaters )
 		elif set:
 			request = implementation.SetRequest()
 		elif next:
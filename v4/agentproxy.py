@@ -125,7 +125,7 @@ class BaseProxy:
 		recordCallback=None,
 		retryCount=4, timeout= 2.0,
 		maxRepetitions= DEFAULT_BULK_REPETITION_SIZE,
-		startOIDs=None,
+		startOIDs=None, nonRepeaters=(),
 	):
 		"""Convenience method for creating and running a TableRetriever
 
@@ -148,16 +148,23 @@ class BaseProxy:
 			i.e. if passed in, we retrieve the table from startOIDs to
 			the end of the table excluding startOIDs themselves, rather 
 			than from roots to the end of the table.
+		nonRepeaters -- optional scalar OIDs (e.g. sysUpTime) to be
+			retrieved with get-next semantics in the first request
+			(as the GETBULK non-repeaters), saving a separate get
+			request.
 
 		Will use bulk downloading when available (i.e. if
 		we have implementation v2c, not v1).
 
-		return value is a defered for a { rootOID: { oid: value } } mapping
+		return value is a defered for a { rootOID: { oid: value } } mapping,
+		with non-repeating OIDs reported as { nonRepeaterOID: { oid: value } }
 		"""
 		df = defer.Deferred( )
 		result = {}
 		if startOIDs is None:
 			startOIDs = roots
+		# only the first request carries the scalars...
+		scalars = list(nonRepeaters)
 		def _onTabularResult( 
 			sendRequestHandle, 
 			errorIndication, errorStatus, errorIndex,
@@ -170,6 +177,12 @@ class BaseProxy:
 				foundNonNull = False
 				for (key,value) in row:
 					if value is not None:
+						for r in scalars:
+							if key[:len(r)] == r:
+								tbl = result.get( r )
+								if tbl is None:
+									tbl = result[ r ] = {}
+								tbl[ key ] = value
 						foundNonNull = True
 						for r in roots:
 							if key[:len(r)] == r:
@@ -178,6 +191,7 @@ class BaseProxy:
 									tbl = result[ r ] = {}
 								tbl[ key] = value 
 								foundRoots[ r ] = key
+			del scalars[:]
 			if not foundRoots or not foundNonNull:
 				df.callback( result )
 			else:
@@ -200,16 +214,16 @@ class BaseProxy:
 		if self.snmpVersion != '1':
 			cmdgen.BulkCommandGenerator().sendReq(
 				self.engine, self.targetName, 
-				0, # nonRepeaters (count)
+				len(scalars), # nonRepeaters (count)
 				maxRepetitions,
-				[(r,None) for r in startOIDs], # varBinds
+				[(r,None) for r in scalars + list(startOIDs)], # varBinds
 				_onTabularResult, 
 				df,
 			)
 		else:
 			cmdgen.NextCommandGenerator().sendReq(
 				self.engine, self.targetName, 
-				[(r,None) for r in startOIDs], 
+				[(r,None) for r in scalars + list(startOIDs)], 
 				_onTabularResult, df
 			)
 		return df